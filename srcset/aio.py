@@ -0,0 +1,61 @@
+"""
+asyncio interface of `StreamRewriter`, requires Python 3.6 or newer
+"""
+import asyncio
+
+try:
+    from .scanner import StreamRewriter
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from scanner import StreamRewriter
+
+# Inside of a coroutine, get_event_loop() is deprecated since Python 3.7 in
+# favor of get_running_loop()
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+# Chunks are rewritten in slices of this size, the event loop runs between them
+SLICE_SIZE = 64 * 1024
+# With an executor, slices are rewritten there once the pending tag grows to this size
+OFFLOAD_SIZE = 1024 * 1024
+
+
+async def rewrite_stream(
+    source, callback, encoding="utf-8", slice_size=SLICE_SIZE, executor=None, offload_size=OFFLOAD_SIZE,
+    **options
+):
+    """
+    Yields chunks of the document read from `source` with URLs of `srcset`
+    and `imagesrcset` attributes replaced by `callback(url)`. `source` is an
+    `asyncio.StreamReader` or an async iterator of chunks.
+
+    Control goes back to the event loop after every `slice_size` characters.
+    If `executor` is given, a slice which completes a tag longer than
+    `offload_size` is rewritten there, so `callback` has to be thread safe
+    """
+    loop = get_running_loop()
+    rewriter = StreamRewriter(callback, encoding, **options)
+    async for chunk in iter_chunks(source, slice_size):
+        for start in range(0, len(chunk), slice_size):
+            piece = chunk[start:start + slice_size]
+            size = len(rewriter.buffer or piece[:0]) + rewriter.pending_size + len(piece)
+            if executor is not None and size >= offload_size:
+                output = await loop.run_in_executor(executor, rewriter.feed, piece)
+            else:
+                output = rewriter.feed(piece)
+                await asyncio.sleep(0)
+            if output:
+                yield output
+    output = rewriter.close()
+    if output:
+        yield output
+
+
+async def iter_chunks(source, size):
+    if isinstance(source, asyncio.StreamReader):
+        while True:
+            chunk = await source.read(size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
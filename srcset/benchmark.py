@@ -0,0 +1,784 @@
+"""
+Benchmark of parsing and stringifying srcsets grouped by input shape.
+
+    python benchmark.py --engine regex --output regex.json
+    python benchmark.py --compare state_machine.json regex.json
+    python benchmark.py --latency
+    python benchmark.py --memory
+    python benchmark.py --batch
+    python benchmark.py --parallel
+    python benchmark.py --scanner
+    python benchmark.py --speedup
+
+Every timing is the best and the median of `repeat` runs of `number` loops
+over all inputs of a group, reported per input. With `--latency` every
+input is timed on its own and percentiles are reported by input length and
+candidate count. `--memory` measures allocations with tracemalloc and
+checks them against MEMORY_BUDGETS. `--batch` and `--parallel` report the
+throughput of the batch APIs, `--scanner` times `scan` against html.parser.
+`--speedup` exits with status 1 if the regex engine parses CDN srcsets less
+than MIN_SPEEDUP times faster than the state machine
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import sys
+import timeit
+from timeit import default_timer
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:
+    from html.parser import HTMLParser
+except ImportError:  # Python 2
+    from HTMLParser import HTMLParser
+
+try:
+    from .corpus import read_corpus
+    from .scanner import scan
+    from .srcset import ENGINE_REGEX, ENGINE_STATE_MACHINE, SRCSet, parse_many, parse_parallel
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from corpus import read_corpus
+    from scanner import scan
+    from srcset import ENGINE_REGEX, ENGINE_STATE_MACHINE, SRCSet, parse_many, parse_parallel
+
+REPEAT = 5
+NUMBER = 50
+LATENCY_NUMBER = 10
+BATCH_NUMBER = 5
+# The corpus is repeated up to this many inputs for `--parallel`
+PARALLEL_INPUTS = 20000
+# Sizes of the pages of `--scanner` in characters
+PAGE_SIZES = (200 * 1024, 1024 * 1024, 2 * 1024 * 1024)
+# The regex engine has to parse the CDN srcsets of `--speedup` this many
+# times faster than the state machine
+MIN_SPEEDUP = 5.0
+# Upper bounds of buckets of the latency distribution
+LENGTH_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+CANDIDATE_BUCKETS = (0, 1, 4, 9, 19)
+PERCENTILES = (50, 90, 99)
+# Inputs shorter than this are dominated by the cost of a call, not of a byte
+MIN_OUTLIER_LENGTH = 256
+OUTLIER_FACTOR = 5.0
+
+MEMORY_MODES = (
+    ("dict", {}),
+    ("compact", {"compact": True}),
+)
+# Upper limits of `memory` results on CPython 3 for the built-in corpus, a
+# quarter or so above the measured values:
+# - candidate_bytes, candidate_blocks: retained by a parsed candidate,
+#   without the characters of its strings
+# - instance_bytes, instance_blocks: retained by a `SRCSet` on top of its
+#   candidates
+# - parse_peak_bytes: largest peak memory of `parse` per input character,
+#   the result included, for inputs of at least MIN_OUTLIER_LENGTH
+#   characters
+# - stringify_peak_bytes: the same for `stringify` per output character
+# `container_bytes`, sys.getsizeof() of a candidate, has no budget
+MEMORY_BUDGETS = {
+    "dict": {
+        "candidate_bytes": 380,
+        "candidate_blocks": 5,
+        "instance_bytes": 120,
+        "instance_blocks": 2.5,
+        "parse_peak_bytes": 12,
+        "stringify_peak_bytes": 4,
+    },
+    "compact": {
+        "candidate_bytes": 250,
+        "candidate_blocks": 4,
+        "instance_bytes": 120,
+        "instance_blocks": 2.5,
+        "parse_peak_bytes": 11,
+        "stringify_peak_bytes": 4,
+    },
+}
+
+CLOUDINARY_URL = "https://res.cloudinary.com/demo/image/upload/q_auto,f_auto,w_%s/sample%s.jpg"
+IMGIX_URL = "https://assets.imgix.net/photos/%s.jpg?w=%s&auto=format,compress&fit=crop"
+SAMPLE_HTML = (
+    '<div class="product"><a href="/product/%(i)s">'
+    '<img src="/img/%(i)s.jpg" alt="Product %(i)s" loading="lazy" '
+    'srcset="https://cdn.example.com/img/%(i)s.jpg?w=320&amp;q=80 320w, '
+    'https://cdn.example.com/img/%(i)s.jpg?w=640&amp;q=80 640w, '
+    'https://cdn.example.com/img/%(i)s.jpg?w=1280&amp;q=80 1280w" sizes="(max-width: 600px) 100vw, 33vw">'
+    '</a><h2 class="title">Product %(i)s</h2><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, '
+    'sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p>'
+    '<script>window.products.push({id: %(i)s, srcset: "<img srcset>"});</script>'
+    '<!-- product %(i)s --><span class="price" data-id="%(i)s">%(i)s.99</span></div>\n'
+)
+
+
+def build_corpus():
+    """
+    Returns an ordered list of (group, inputs), inputs are the same for
+    every run so results of different runs can be compared
+    """
+    widths = (160, 320, 480, 640, 768, 1024, 1280, 1440, 1600, 1920, 2048, 2560, 2880, 3200, 3840,
+              4096, 5120, 6016, 7680, 8192)
+    return [
+        ("single_url", [
+            "image%s.png" % i for i in range(20)
+        ]),
+        ("w_candidates", [
+            ", ".join(
+                (CLOUDINARY_URL if i % 2 else IMGIX_URL) % ((width, i) if i % 2 else (i, width)) + " %sw" % width
+                for width in widths[:count]
+            )
+            for i, count in enumerate(range(5, 21))
+        ]),
+        ("x_candidates", [
+            ", ".join("/img/%s@%sx.png %sx" % (i, density, density) for density in (1, 1.5, 2, 3, 4)[:count])
+            for i, count in enumerate((1, 2, 3, 4, 5) * 4)
+        ]),
+        ("data_urls", [
+            "data:image/png;base64,%s 1x, data:image/png;base64,%s 2x" % ("iVBORw0KGgo" * size, "AAAA" * size)
+            for size in (100, 1000, 5000)
+        ]),
+        ("parens", [
+            "image%s.png 100w (landscape) 50h, image%s.png (a, b) 2x, image%s.png 300w (unclosed" % (i, i, i)
+            for i in range(20)
+        ]),
+        ("malformed", [
+            "  ,,, ,",
+            "image.png 1x 2x, image2.png 100w 1x, image3.png -1x, image4.png 0w",
+            "image.png 1.x, image.png +1x, image.png 1e400x, image.png NaNx",
+            "image.png 100h, image.png 100w 100h 100h, image.png foo",
+            ",image.png,,, image2.png,, image3.png 1x,,,",
+            "  data:,a  1x  , data:c qw",
+        ] * 4),
+    ]
+
+
+def sample_page(size):
+    """
+    Realistic looking HTML page of about `size` characters
+    """
+    parts = ["<!doctype html><html><head><title>Products</title></head><body>"]
+    length = 0
+    i = 0
+    while length < size:
+        part = SAMPLE_HTML % {"i": i}
+        parts.append(part)
+        length = length + len(part)
+        i = i + 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def cdn_corpus():
+    """
+    Typical CDN srcsets of `--speedup`: 8 `w` candidates of Cloudinary and
+    of imgix URLs
+    """
+    widths = (160, 320, 480, 640, 768, 1024, 1280, 1440, 1600, 1920, 2048, 2560)
+    return [
+        ("cloudinary", [
+            ", ".join(CLOUDINARY_URL % (width, i) + " %sw" % width for width in widths[i:i + 8])
+            for i in range(5)
+        ]),
+        ("imgix", [
+            ", ".join(IMGIX_URL % (i, width) + " %sw" % width for width in widths[i:i + 8])
+            for i in range(5)
+        ]),
+    ]
+
+
+def flatten(corpus):
+    return [string for _, strings in corpus for string in strings]
+
+
+def parse_all(inputs, engine):
+    for string in inputs:
+        SRCSet(string, engine).parse()
+
+
+def stringify_all(objects):
+    for obj in objects:
+        obj.stringify()
+
+
+def round_trip_all(inputs, engine):
+    for string in inputs:
+        obj = SRCSet(string, engine)
+        obj.parse()
+        obj.stringify()
+
+
+def time_group(inputs, engine, repeat, number):
+    """
+    Returns {operation: timings} for a group of inputs
+    """
+    objects = [SRCSet(string, engine) for string in inputs]
+    for obj in objects:
+        obj.parse()
+    operations = (
+        ("parse", lambda: parse_all(inputs, engine)),
+        ("stringify", lambda: stringify_all(objects)),
+        ("round_trip", lambda: round_trip_all(inputs, engine)),
+    )
+    result = {}
+    for name, func in operations:
+        times = sorted(timeit.Timer(func).repeat(repeat=repeat, number=number))
+        loops = float(number * len(inputs))
+        result[name] = {
+            "best_us": times[0] / loops * 1e6,
+            "median_us": times[len(times) // 2] / loops * 1e6,
+        }
+    return result
+
+
+def load_corpus(path, limit=None):
+    """
+    Returns a corpus file written by `corpus.py` as a single group
+    """
+    return [("file", list(read_corpus(path, limit=limit)))]
+
+
+def run(engine=ENGINE_STATE_MACHINE, repeat=REPEAT, number=NUMBER, groups=None, corpus=None):
+    """
+    Returns results of all groups of `corpus` (by default the built-in one)
+    as a dict which can be saved as JSON
+    """
+    if corpus is None:
+        corpus = build_corpus()
+    results = {}
+    for group, inputs in corpus:
+        if groups and group not in groups:
+            continue
+        results[group] = time_group(inputs, engine, repeat, number)
+        results[group]["inputs"] = len(inputs)
+        results[group]["characters"] = sum(len(string) for string in inputs)
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "number": number,
+        "groups": results,
+    }
+
+
+def time_input(func, repeat, number):
+    return min(timeit.Timer(func).repeat(repeat=repeat, number=number)) / number
+
+
+def latency(engine=ENGINE_STATE_MACHINE, repeat=REPEAT, number=LATENCY_NUMBER, factor=OUTLIER_FACTOR,
+            corpus=None):
+    """
+    Times `parse` and `stringify` of every input of `corpus` (by default the
+    built-in one) separately, the time of an input is the best of `repeat`
+    runs. Returns a dict which can be saved as JSON with percentiles of
+    inputs grouped by length and by candidate count, and `outliers`: inputs
+    of at least MIN_OUTLIER_LENGTH characters which take more than `factor`
+    times the median time per character of such inputs
+    """
+    if corpus is None:
+        corpus = build_corpus()
+    samples = []
+    for group, inputs in corpus:
+        for index, string in enumerate(inputs):
+            obj = SRCSet(string, engine)
+            count = len(obj.parse())
+            samples.append({
+                "group": group,
+                "index": index,
+                "length": len(string),
+                "candidates": count,
+                "parse_us": time_input(lambda: SRCSet(string, engine).parse(), repeat, number) * 1e6,
+                "stringify_us": time_input(obj.stringify, repeat, number) * 1e6,
+            })
+
+    long_samples = [sample for sample in samples if sample["length"] >= MIN_OUTLIER_LENGTH]
+    outliers = []
+    if long_samples:
+        median_cost = percentile(sorted(sample["parse_us"] / sample["length"] for sample in long_samples), 50)
+        for sample in long_samples:
+            ratio = sample["parse_us"] / sample["length"] / median_cost
+            if ratio > factor:
+                outliers.append(dict(sample, ratio=ratio))
+        outliers.sort(key=lambda sample: -sample["ratio"])
+
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "number": number,
+        "inputs": len(samples),
+        "by_length": distribution(samples, "length", LENGTH_BUCKETS),
+        "by_candidates": distribution(samples, "candidates", CANDIDATE_BUCKETS),
+        "outliers": outliers,
+    }
+
+
+def bucket_label(value, bounds):
+    lower = 0
+    for bound in bounds:
+        if value <= bound:
+            return "%s-%s" % (lower, bound) if lower != bound else "%s" % bound
+        lower = bound + 1
+    return "%s+" % lower
+
+
+def distribution(samples, key, bounds):
+    """
+    Returns {bucket: {operation: {p50, p90, p99, max}}} of samples bucketed
+    by `key`
+    """
+    buckets = {}
+    for sample in samples:
+        buckets.setdefault(bucket_label(sample[key], bounds), []).append(sample)
+    result = {}
+    for label, items in buckets.items():
+        result[label] = {"inputs": len(items)}
+        for name in ("parse_us", "stringify_us"):
+            times = sorted(item[name] for item in items)
+            stats = dict(("p%s" % p, percentile(times, p)) for p in PERCENTILES)
+            stats["max"] = times[-1]
+            result[label][name] = stats
+    return result
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted `values`
+    """
+    rank = max(int(-(-len(values) * p // 100)), 1)
+    return values[rank - 1]
+
+
+def report_latency(results, stream=sys.stdout):
+    print(
+        "%s engine, Python %s, %s inputs, best of %s runs of %s loops, microseconds per input" %
+        (results["engine"], results["python"], results["inputs"], results["repeat"], results["number"]),
+        file=stream
+    )
+    for title, key, bounds in (
+        ("length", "by_length", LENGTH_BUCKETS),
+        ("candidates", "by_candidates", CANDIDATE_BUCKETS),
+    ):
+        print("%-12s %6s %-9s %10s %10s %10s %10s" % (title, "inputs", "", "p50", "p90", "p99", "max"),
+              file=stream)
+        labels = sorted(results[key], key=lambda label: int(label.split("-")[0].rstrip("+")))
+        for label in labels:
+            bucket = results[key][label]
+            for name in ("parse_us", "stringify_us"):
+                stats = bucket[name]
+                print("%-12s %6s %-9s %10.2f %10.2f %10.2f %10.2f" % (
+                    label if name == "parse_us" else "",
+                    bucket["inputs"] if name == "parse_us" else "",
+                    name[:-3],
+                    stats["p50"], stats["p90"], stats["p99"], stats["max"],
+                ), file=stream)
+    for sample in results["outliers"]:
+        print(
+            "Outlier: %s[%s], %s characters, %s candidates, %.2f us, %.1f times the median per character" %
+            (sample["group"], sample["index"], sample["length"], sample["candidates"], sample["parse_us"],
+             sample["ratio"]),
+            file=stream
+        )
+
+
+def memory(engine=ENGINE_STATE_MACHINE, corpus=None, modes=MEMORY_MODES):
+    """
+    Returns {mode: results} of memory retained by parsed candidates and
+    `SRCSet` instances, and of the temporary memory of `parse` and
+    `stringify`, measured with tracemalloc over `corpus` (by default the
+    built-in one)
+    """
+    if tracemalloc is None or not hasattr(tracemalloc, "reset_peak"):
+        raise ImportError("Memory benchmark requires tracemalloc of Python 3.9 or later")
+    if corpus is None:
+        corpus = build_corpus()
+    inputs = flatten(corpus)
+    results = {}
+    started = tracemalloc.is_tracing()
+    if not started:
+        tracemalloc.start()
+    try:
+        for mode, options in modes:
+            # Warm up caches of the interpreter and of `re`
+            for string in inputs:
+                SRCSet(string, engine, **options).parse()
+
+            candidates, (candidate_bytes, candidate_blocks) = retained(
+                lambda: [SRCSet(string, engine, **options).parse() for string in inputs]
+            )
+            count = sum(len(items) for items in candidates)
+            container = sum(sys.getsizeof(item) for items in candidates for item in items)
+            payload = sum(
+                len(value) for items in candidates for item in items
+                for value in (item["url"], item["w"], item["x"], item["h"]) if value is not None
+            )
+            del candidates
+            instances, (instance_bytes, instance_blocks) = retained(
+                lambda: [parsed(SRCSet(string, engine, **options)) for string in inputs]
+            )
+
+            parse_peak = 0.0
+            stringify_peak = 0.0
+            for obj in instances:
+                if len(obj.raw) >= MIN_OUTLIER_LENGTH:
+                    parse_peak = max(parse_peak, peak(obj.parse) / len(obj.raw))
+                    result = obj.stringify()
+                    if result:
+                        stringify_peak = max(stringify_peak, peak(obj.stringify) / len(result))
+
+            results[mode] = {
+                "inputs": len(inputs),
+                "candidates": count,
+                "candidate_bytes": float(candidate_bytes - payload) / count,
+                "candidate_blocks": float(candidate_blocks) / count,
+                "container_bytes": float(container) / count,
+                "instance_bytes": float(instance_bytes - candidate_bytes) / len(inputs),
+                "instance_blocks": float(instance_blocks - candidate_blocks) / len(inputs),
+                "parse_peak_bytes": parse_peak,
+                "stringify_peak_bytes": stringify_peak,
+            }
+    finally:
+        if not started:
+            tracemalloc.stop()
+    return results
+
+
+def parsed(obj):
+    obj.parse()
+    return obj
+
+
+def retained(func):
+    """
+    Returns (result of `func`, (bytes, blocks) allocated by `func` which are
+    still in use)
+    """
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    result = func()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    size = 0
+    blocks = 0
+    for stat in after.compare_to(before, "filename"):
+        size = size + stat.size_diff
+        blocks = blocks + stat.count_diff
+    return result, (size, blocks)
+
+
+def peak(func):
+    """
+    Largest amount of memory in use while `func` runs, over the memory in
+    use before
+    """
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    return tracemalloc.get_traced_memory()[1] - before
+
+
+def check_budgets(results, budgets=MEMORY_BUDGETS):
+    """
+    Returns a list of (mode, name, value, budget) of `memory` results which
+    are over `budgets`
+    """
+    exceeded = []
+    for mode, values in sorted(results.items()):
+        for name, budget in sorted(budgets.get(mode, {}).items()):
+            if values[name] > budget:
+                exceeded.append((mode, name, values[name], budget))
+    return exceeded
+
+
+def report_memory(results, stream=sys.stdout):
+    names = sorted(set(MEMORY_BUDGETS["dict"]) | set(["container_bytes"]))
+    print("%-10s %s" % ("mode", " ".join("%20s" % name for name in names)), file=stream)
+    for mode, values in sorted(results.items()):
+        print("%-10s %s" % (mode, " ".join("%20.2f" % values[name] for name in names)), file=stream)
+    for mode, name, value, budget in check_budgets(results):
+        print("Over budget: %s %s is %.2f, budget %s" % (mode, name, value, budget), file=stream)
+
+
+def batch(engine=ENGINE_STATE_MACHINE, repeat=REPEAT, number=BATCH_NUMBER, corpus=None):
+    """
+    Returns srcsets per second of `SRCSet(...).parse()` for every input
+    against `parse_many` with and without instances, over all inputs of
+    `corpus` (by default the built-in one)
+    """
+    inputs = flatten(corpus or build_corpus())
+    methods = (
+        ("parse", lambda: [SRCSet(string, engine).parse() for string in inputs]),
+        ("parse_many_instances", lambda: parse_many(inputs, instances=True, engine=engine)),
+        ("parse_many", lambda: parse_many(inputs, engine=engine)),
+    )
+    results = {}
+    for name, func in methods:
+        best = min(timeit.Timer(func).repeat(repeat=repeat, number=number))
+        results[name] = {"srcsets_per_s": len(inputs) * number / best}
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "number": number,
+        "inputs": len(inputs),
+        "methods": results,
+    }
+
+
+def parallel(engine=ENGINE_STATE_MACHINE, max_workers=None, corpus=None, size=PARALLEL_INPUTS):
+    """
+    Returns srcsets per second of `parse_parallel` from one process up to
+    `max_workers` (by default one per core). The inputs of `corpus` are
+    repeated up to `size` inputs
+    """
+    inputs = flatten(corpus or build_corpus())
+    inputs = (inputs * (size // len(inputs) + 1))[:size]
+    results = {}
+    for workers in range(1, (max_workers or multiprocessing.cpu_count()) + 1):
+        start = default_timer()
+        parse_parallel(inputs, workers=workers, engine=engine, compact=True)
+        results[str(workers)] = {"srcsets_per_s": len(inputs) / (default_timer() - start)}
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "inputs": len(inputs),
+        "workers": results,
+    }
+
+
+class SRCSetParser(HTMLParser):
+    """
+    html.parser with `SRCSet`, what `scan` replaces
+    """
+
+    def __init__(self, engine):
+        HTMLParser.__init__(self)
+        self.engine = engine
+        self.candidates = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name in ("srcset", "imagesrcset") and value is not None:
+                self.candidates.append(SRCSet(value, self.engine).parse())
+
+
+def html_parser(html, engine):
+    parser = SRCSetParser(engine)
+    parser.feed(html)
+    parser.close()
+    return parser.candidates
+
+
+def scanner(engine=ENGINE_STATE_MACHINE, repeat=REPEAT, sizes=PAGE_SIZES):
+    """
+    Returns the best time of `scan` and of html.parser with `SRCSet` over
+    `sample_page` of every size
+    """
+    results = {}
+    for size in sizes:
+        html = sample_page(size)
+        results[str(size)] = dict(
+            (name, {"best_ms": min(timeit.Timer(func).repeat(repeat=repeat, number=1)) * 1000})
+            for name, func in (
+                ("html_parser", lambda: html_parser(html, engine)),
+                ("scan", lambda: list(scan(html, engine=engine))),
+            )
+        )
+    return {
+        "engine": engine,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "pages": results,
+    }
+
+
+def speedup(repeat=REPEAT * 4, number=NUMBER, corpus=None):
+    """
+    Returns the time of `parse()` per input of both engines and their ratio
+    for every group of `corpus` (by default `cdn_corpus`). Runs of the two
+    engines take turns, so both see the same load of the machine
+    """
+    results = {}
+    for group, inputs in corpus or cdn_corpus():
+        best = {ENGINE_STATE_MACHINE: float("inf"), ENGINE_REGEX: float("inf")}
+        for _ in range(repeat):
+            for engine in best:
+                timer = timeit.Timer(lambda: parse_all(inputs, engine))
+                best[engine] = min(best[engine], timer.timeit(number) / (number * len(inputs)))
+        results[group] = {
+            "state_machine_us": best[ENGINE_STATE_MACHINE] * 1e6,
+            "regex_us": best[ENGINE_REGEX] * 1e6,
+            "speedup": best[ENGINE_STATE_MACHINE] / best[ENGINE_REGEX],
+        }
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "repeat": repeat,
+        "number": number,
+        "min_speedup": MIN_SPEEDUP,
+        "groups": results,
+    }
+
+
+def check_speedup(results, min_speedup=MIN_SPEEDUP):
+    """
+    Returns a list of (group, speedup) of `speedup` results below `min_speedup`
+    """
+    return [
+        (group, values["speedup"]) for group, values in sorted(results["groups"].items())
+        if values["speedup"] < min_speedup
+    ]
+
+
+def report_speedup(results, stream=sys.stdout):
+    print(
+        "Python %s, best of %s runs of %s loops, microseconds per input" %
+        (results["python"], results["repeat"], results["number"]),
+        file=stream
+    )
+    print("%-14s %14s %10s %10s" % ("group", "state_machine", "regex", "speedup"), file=stream)
+    for group, values in sorted(results["groups"].items()):
+        print("%-14s %14.2f %10.2f %10.2f" % (
+            group, values["state_machine_us"], values["regex_us"], values["speedup"]
+        ), file=stream)
+    for group, value in check_speedup(results, results["min_speedup"]):
+        print("Too slow: the regex engine is %.2f times faster on %s, at least %s is required" %
+              (value, group, results["min_speedup"]), file=stream)
+
+
+def report_throughput(results, key, stream=sys.stdout):
+    """
+    Prints `batch` or `parallel` results, `key` is "methods" or "workers"
+    """
+    print(
+        "%s engine, Python %s, %s inputs, srcsets per second" %
+        (results["engine"], results["python"], results["inputs"]),
+        file=stream
+    )
+    # Numbers of workers are sorted as numbers
+    for name, values in sorted(results[key].items(), key=lambda item: int(item[0]) if item[0].isdigit() else item[0]):
+        print("%-22s %12.0f" % (name, values["srcsets_per_s"]), file=stream)
+
+
+def report_scanner(results, stream=sys.stdout):
+    print(
+        "%s engine, Python %s, best of %s runs, milliseconds per page" %
+        (results["engine"], results["python"], results["repeat"]),
+        file=stream
+    )
+    print("%-10s %12s %12s" % ("KB", "html_parser", "scan"), file=stream)
+    for size, timings in sorted(results["pages"].items(), key=lambda item: int(item[0])):
+        print("%-10s %12.1f %12.1f" % (
+            int(size) // 1024, timings["html_parser"]["best_ms"], timings["scan"]["best_ms"]
+        ), file=stream)
+
+
+def report(results, stream=sys.stdout):
+    print(
+        "%s engine, Python %s, best and median of %s repeats of %s loops, microseconds per input" %
+        (results["engine"], results["python"], results["repeat"], results["number"]),
+        file=stream
+    )
+    print("%-14s %20s %20s %20s" % ("group", "parse", "stringify", "round_trip"), file=stream)
+    for group, timings in sorted(results["groups"].items()):
+        print("%-14s %s" % (group, " ".join(
+            "%9.2f / %8.2f" % (timings[name]["best_us"], timings[name]["median_us"])
+            for name in ("parse", "stringify", "round_trip")
+        )), file=stream)
+
+
+def compare(old, new, stream=sys.stdout):
+    """
+    Prints the ratio of best timings of `new` to `old` for every group
+    """
+    print("%-14s %10s %10s %10s" % ("new / old", "parse", "stringify", "round_trip"), file=stream)
+    for group, timings in sorted(new["groups"].items()):
+        if group not in old["groups"]:
+            continue
+        print("%-14s %s" % (group, " ".join(
+            "%10.2f" % (timings[name]["best_us"] / old["groups"][group][name]["best_us"])
+            for name in ("parse", "stringify", "round_trip")
+        )), file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="srcset benchmark")
+    parser.add_argument(
+        "-e", "--engine",
+        default=ENGINE_STATE_MACHINE,
+        choices=(ENGINE_STATE_MACHINE, ENGINE_REGEX),
+        help="Engine to benchmark"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=REPEAT, help="Number of timed runs")
+    parser.add_argument(
+        "-n", "--number", type=int,
+        help="Loops over the inputs per run, %s by default, %s with --latency or %s with --batch" %
+             (NUMBER, LATENCY_NUMBER, BATCH_NUMBER)
+    )
+    parser.add_argument("-g", "--group", action="append", help="Run only this group, can be repeated")
+    parser.add_argument("-o", "--output", help="Save results as JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved results")
+    parser.add_argument("--corpus", help="Use a corpus file written by corpus.py instead of the built-in corpus")
+    parser.add_argument("--limit", type=int, help="Use only this many values of --corpus")
+    parser.add_argument("--memory", action="store_true", help="Measure memory and check MEMORY_BUDGETS")
+    parser.add_argument("--latency", action="store_true", help="Report percentiles of per-input times")
+    parser.add_argument("--batch", action="store_true", help="Compare parse() and parse_many()")
+    parser.add_argument("--parallel", action="store_true", help="Report parse_parallel() by number of workers")
+    parser.add_argument("--workers", type=int, help="Largest number of workers of --parallel")
+    parser.add_argument("--scanner", action="store_true", help="Compare scan() and html.parser")
+    parser.add_argument(
+        "--speedup", action="store_true",
+        help="Fail unless the regex engine is %s times faster than the state machine" % MIN_SPEEDUP
+    )
+    parser.add_argument(
+        "--outlier-factor", type=float, default=OUTLIER_FACTOR,
+        help="Flag inputs this many times slower per character than the median"
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+    corpus = load_corpus(args.corpus, args.limit) if args.corpus else None
+    if args.memory:
+        results = memory(args.engine, corpus)
+        report_memory(results)
+    elif args.latency:
+        results = latency(args.engine, args.repeat, args.number or LATENCY_NUMBER, args.outlier_factor, corpus)
+        report_latency(results)
+    elif args.batch:
+        results = batch(args.engine, args.repeat, args.number or BATCH_NUMBER, corpus)
+        report_throughput(results, "methods")
+    elif args.parallel:
+        results = parallel(args.engine, args.workers, corpus)
+        report_throughput(results, "workers")
+    elif args.scanner:
+        results = scanner(args.engine, args.repeat)
+        report_scanner(results)
+    elif args.speedup:
+        results = speedup(number=args.number or NUMBER, corpus=corpus)
+        report_speedup(results)
+    else:
+        results = run(args.engine, args.repeat, args.number or NUMBER, args.group, corpus)
+        report(results)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.speedup and check_speedup(results):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
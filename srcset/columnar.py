@@ -0,0 +1,172 @@
+"""
+Struct-of-arrays parse results for analytics over many srcsets
+"""
+from __future__ import unicode_literals
+
+from array import array
+
+try:
+    from .srcset import MAX_INT_DIGITS, PARSERS, SRCSet, binary_types, check_length, typed_values
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from srcset import MAX_INT_DIGITS, PARSERS, SRCSet, binary_types, check_length, typed_values
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Widths and heights which do not fit into array("l") are saturated, it is
+# 32-bit on Windows. Numbers of descriptors are int below LARGE and may be
+# float above it, everything from SATURATED on goes through `saturate`
+MAX_LONG = 2 ** (8 * array("l").itemsize - 1) - 1
+LARGE = 10 ** MAX_INT_DIGITS
+SATURATED = min(LARGE, MAX_LONG + 1)
+MISSING_DENSITY = float("nan")
+
+
+class Columns(object):
+    """
+    Candidates of many srcsets in flat arrays, candidate `i` of srcset `row`
+    is at index `row_offsets[row] + i` of every column:
+
+    - URLs are in a single `url_buffer`, URL `j` is
+      `url_buffer[url_offsets[j]:url_offsets[j + 1]]`, text URLs are encoded
+      to `encoding`
+    - `widths` and `heights` are array("l") with 0 for missing values,
+      `has_width` and `has_height` are array("B") masks
+    - `densities` is array("d") with NaN for missing values
+
+    All arrays support the buffer protocol, `to_numpy` wraps them without
+    copying
+    """
+
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
+        self.binary = False
+        self.url_buffer = bytearray()
+        self.url_offsets = array("l", [0])
+        self.widths = array("l")
+        self.has_width = array("B")
+        self.densities = array("d")
+        self.heights = array("l")
+        self.has_height = array("B")
+        self.row_offsets = array("l", [0])
+
+    def __len__(self):
+        return len(self.row_offsets) - 1
+
+    @property
+    def candidate_count(self):
+        return len(self.widths)
+
+    @property
+    def nbytes(self):
+        """
+        Size of all buffers in bytes
+        """
+        return len(self.url_buffer) + sum(
+            len(column) * column.itemsize for column in (
+                self.url_offsets, self.widths, self.has_width, self.densities,
+                self.heights, self.has_height, self.row_offsets
+            )
+        )
+
+    def url(self, index):
+        """
+        URL of candidate `index` as bytes for bytes input, as text otherwise
+        """
+        url = bytes(self.url_buffer[self.url_offsets[index]:self.url_offsets[index + 1]])
+        if self.binary:
+            return url
+        return url.decode(self.encoding)
+
+    def urls(self, row):
+        """
+        URLs of srcset `row`
+        """
+        return [self.url(index) for index in range(self.row_offsets[row], self.row_offsets[row + 1])]
+
+    def append(self, string, values):
+        """
+        Adds a srcset from the values of `typed_values`. Columns are filled a
+        row at a time with list comprehensions, which is several times faster
+        than appending value by value
+        """
+        values = list(values)
+        if values:
+            starts, ends, _, _, _, widths, densities, heights = zip(*values)
+            urls = [string[start:end] for start, end in zip(starts, ends)]
+            if isinstance(string, binary_types):
+                # Slices of memoryview are memoryview, which has no join()
+                joined = b"".join(urls)
+            else:
+                joined = string[:0].join(urls)
+                encoded = joined.encode(self.encoding)
+                if len(encoded) != len(joined):
+                    # Offsets are in bytes, not in characters
+                    urls = [url.encode(self.encoding) for url in urls]
+                joined = encoded
+            offset = self.url_offsets[-1]
+            offsets = []
+            for url in urls:
+                offset = offset + len(url)
+                offsets.append(offset)
+            self.url_buffer.extend(joined)
+            self.url_offsets.extend(offsets)
+            self.widths.extend([0 if w is None else w if w < SATURATED else saturate(w) for w in widths])
+            self.has_width.extend([w is not None for w in widths])
+            self.densities.extend([MISSING_DENSITY if x is None else x for x in densities])
+            self.heights.extend([0 if h is None else h if h < SATURATED else saturate(h) for h in heights])
+            self.has_height.extend([h is not None for h in heights])
+        self.row_offsets.append(len(self.widths))
+
+    def to_numpy(self):
+        """
+        Returns a dict of NumPy arrays sharing memory with the columns. While
+        the arrays are alive, appending raises BufferError
+        """
+        if numpy is None:
+            raise ImportError("to_numpy requires NumPy")
+        result = {"url_buffer": numpy.frombuffer(self.url_buffer, dtype=numpy.uint8)}
+        for name in (
+            "url_offsets", "widths", "has_width", "densities", "heights", "has_height", "row_offsets"
+        ):
+            column = getattr(self, name)
+            result[name] = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+        result["has_width"] = result["has_width"].view(bool)
+        result["has_height"] = result["has_height"].view(bool)
+        return result
+
+
+def saturate(value):
+    return int(min(value, MAX_LONG))
+
+
+def parse_columnar(strings, encoding="utf-8", **options):
+    """
+    `parse_many` which returns a single `Columns` object. `options` are the
+    same as for `SRCSet`, all `strings` are either text or bytes
+    """
+    template = SRCSet(None, **options)
+    max_length = template.max_length
+    max_candidates = template.max_candidates
+    max_descriptors = template.max_descriptors
+    columns = Columns(encoding)
+    first = True
+    if template.cache is not None:
+        engine = template.engine
+        cached_parse = template.cache.parse
+    else:
+        engine = PARSERS[template.engine]
+        cached_parse = None
+    for string in strings:
+        if first:
+            columns.binary = isinstance(string, binary_types)
+            first = False
+        check_length(string, max_length)
+        if cached_parse is not None:
+            values = cached_parse(string, engine, max_candidates, max_descriptors, typed_values)
+        else:
+            values = engine(string, max_candidates, max_descriptors, typed_values)
+        columns.append(string, values)
+    return columns
@@ -0,0 +1,240 @@
+"""
+Seeded generator of srcset values modeled on real CDN markup, for scale
+testing and benchmarks:
+
+    python corpus.py --count 1000000 --seed 1 --invalid 0.05 corpus.txt.gz
+
+Corpus files are UTF-8 with one srcset per line, gzip compressed if the
+name ends with `.gz`. `read_corpus` streams them into `parse_many`,
+`parse_columnar` or `benchmark.py --corpus`
+"""
+from __future__ import unicode_literals
+
+import argparse
+import gzip
+import io
+import random
+import string as characters
+
+DEFAULT_SEED = 0
+DEFAULT_INVALID_SHARE = 0.05
+
+CLOUD_NAMES = ("demo", "shop", "news-media", "acme")
+IMGIX_HOSTS = ("assets", "images", "static-cdn")
+WIDTHS = (120, 160, 240, 320, 360, 480, 540, 640, 720, 768, 828, 960, 1024, 1080, 1200, 1280, 1440,
+          1600, 1920, 2048, 2560, 3840)
+DENSITIES = ("1x", "1.5x", "2x", "2.5x", "3x", "4x")
+EXTENSIONS = ("jpg", "png", "webp", "avif")
+
+# Descriptors which make a candidate invalid, `%s` is replaced by the width
+# the candidate would have had
+INVALID_DESCRIPTORS = (
+    "-1x",
+    "0w",
+    "1.5w",
+    "%sw 1x",
+    "1x 2x",
+    "%sw %sw",
+    "%sh",
+    "%spx",
+    "0x10",
+)
+
+
+def iter_corpus(count, seed=DEFAULT_SEED, invalid_share=DEFAULT_INVALID_SHARE):
+    """
+    Yields `count` srcset values. The same `seed` always yields the same
+    values on the same major version of Python, about `invalid_share` of
+    them have an invalid candidate
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield make_srcset(rng, rng.random() < invalid_share)[0]
+
+
+def make_srcset(rng, invalid=False):
+    """
+    Returns (srcset, number of valid candidates). An invalid srcset has
+    exactly one invalid candidate
+    """
+    kind = rng.random()
+    name = "".join(rng.choice(characters.ascii_lowercase) for _ in range(rng.randint(4, 12)))
+    extension = rng.choice(EXTENSIONS)
+    if kind < 0.35:
+        candidates = cloudinary_candidates(rng, name, extension)
+    elif kind < 0.65:
+        candidates = imgix_candidates(rng, name, extension)
+    elif kind < 0.8:
+        candidates = density_candidates(rng, name, extension)
+    elif kind < 0.9:
+        candidates = height_candidates(rng, name, extension)
+    elif kind < 0.95:
+        candidates = data_candidates(rng)
+    else:
+        candidates = [("/images/%s.%s" % (name, extension), "", 0)]
+
+    valid = len(candidates)
+    if invalid:
+        index = rng.randrange(len(candidates))
+        url, _, width = candidates[index]
+        if index == len(candidates) - 1 and rng.random() < 0.2:
+            # Parentheses are never closed, the rest of the string is part of the descriptor
+            descriptors = "%sw (max-width: %spx" % (width or 100, width or 100)
+        else:
+            descriptors = rng.choice(INVALID_DESCRIPTORS)
+            descriptors = descriptors % ((width or 100,) * descriptors.count("%s"))
+        candidates[index] = (url, descriptors, width)
+        valid = valid - 1
+
+    parts = []
+    for url, descriptors, _ in candidates:
+        if descriptors:
+            parts.append("%s %s" % (url, descriptors))
+        else:
+            parts.append(url)
+    # A comma right after a URL would be part of the URL, unless there are descriptors
+    separators = [
+        rng.choice((",", ", ", " , ", ",  ")) if descriptors else rng.choice((", ", " , "))
+        for _, descriptors, _ in candidates[:-1]
+    ]
+    result = parts[0]
+    for separator, part in zip(separators, parts[1:]):
+        result = result + separator + part
+    if rng.random() < 0.05:
+        result = " " + result + ", "
+    return result, valid
+
+
+def pick_widths(rng, low=3, high=8):
+    return sorted(rng.sample(WIDTHS, rng.randint(low, high)))
+
+
+def cloudinary_candidates(rng, name, extension):
+    """
+    Transformations are separated by commas inside the path, like
+    `TestSpecific.test_channel`
+    """
+    cloud = rng.choice(CLOUD_NAMES)
+    version = rng.randint(1500000000, 1700000000)
+    crop = rng.choice(("c_fill", "c_scale", "c_limit,g_auto"))
+    return [
+        (
+            "https://res.cloudinary.com/%s/image/upload/%s,w_%s,q_auto,f_auto/v%s/%s.%s" %
+            (cloud, crop, width, version, name, extension),
+            "%sw" % width,
+            width,
+        )
+        for width in pick_widths(rng)
+    ]
+
+
+def imgix_candidates(rng, name, extension):
+    host = rng.choice(IMGIX_HOSTS)
+    path = "/".join(rng.choice(("products", "blog", "2023", "hero", "thumbs")) for _ in range(rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        width = rng.choice(WIDTHS)
+        return [
+            (
+                "https://%s.imgix.net/%s/%s.%s?w=%s&dpr=%s&auto=format,compress" %
+                (host, path, name, extension, width, density[:-1]),
+                density,
+                0,
+            )
+            for density in DENSITIES[:rng.randint(2, 4)]
+        ]
+    ratio = rng.choice(("16:9", "4:3", "1:1"))
+    return [
+        (
+            "https://%s.imgix.net/%s/%s.%s?w=%s&ar=%s&fit=crop&auto=format,compress" %
+            (host, path, name, extension, width, ratio),
+            "%sw" % width,
+            width,
+        )
+        for width in pick_widths(rng)
+    ]
+
+
+def density_candidates(rng, name, extension):
+    densities = DENSITIES[:rng.randint(1, len(DENSITIES))]
+    # The 1x candidate often has no descriptor
+    return [
+        (
+            "/static/img/%s@%s.%s" % (name, density, extension),
+            "" if density == "1x" and rng.random() < 0.5 else density,
+            0,
+        )
+        for density in densities
+    ]
+
+
+def height_candidates(rng, name, extension):
+    candidates = []
+    for width in pick_widths(rng, 2, 6):
+        numerator, denominator = rng.choice(((9, 16), (3, 4), (1, 1), (4, 3)))
+        height = width * numerator // denominator
+        candidates.append(("/media/%s-%sx%s.%s" % (name, width, height, extension), "%sw %sh" % (width, height),
+                           width))
+    return candidates
+
+
+def data_candidates(rng):
+    candidates = []
+    for density in DENSITIES[:rng.randint(1, 2)]:
+        # Hexadecimal digits are valid base64 and much faster to generate
+        size = rng.randint(16, 2048)
+        data = "%0*x" % (size, rng.getrandbits(4 * size))
+        candidates.append(("data:image/png;base64,%s==" % data, density, 0))
+    return candidates
+
+
+def open_corpus(path, mode="rb"):
+    if path.endswith(".gz"):
+        # The default level 9 is slow and makes corpus files barely smaller
+        return gzip.open(path, mode, 6)
+    return io.open(path, mode)
+
+
+def write_corpus(path, strings):
+    """
+    Writes `strings` to `path`, one per line. Returns the number of lines
+    """
+    count = 0
+    with open_corpus(path, "wb") as output:
+        for string in strings:
+            if not isinstance(string, bytes):
+                string = string.encode("utf-8")
+            if b"\n" in string or b"\r" in string:
+                raise ValueError("Corpus lines can not contain line breaks")
+            output.write(string + b"\n")
+            count = count + 1
+    return count
+
+
+def read_corpus(path, binary=False, limit=None):
+    """
+    Yields srcset values of a corpus file one by one, as bytes if `binary`
+    is set. Stops after `limit` values
+    """
+    with open_corpus(path) as stream:
+        for count, line in enumerate(stream):
+            if limit is not None and count >= limit:
+                break
+            line = line[:-1] if line.endswith(b"\n") else line
+            yield line if binary else line.decode("utf-8")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a srcset corpus")
+    parser.add_argument("path", help="Output file, gzip compressed if it ends with .gz")
+    parser.add_argument("-c", "--count", type=int, default=100000, help="Number of srcset values")
+    parser.add_argument("-s", "--seed", type=int, default=DEFAULT_SEED, help="Random seed")
+    parser.add_argument(
+        "-i", "--invalid", type=float, default=DEFAULT_INVALID_SHARE,
+        help="Share of values with an invalid candidate"
+    )
+    args = parser.parse_args(argv)
+    write_corpus(args.path, iter_corpus(args.count, args.seed, args.invalid))
+
+
+if __name__ == "__main__":
+    main()
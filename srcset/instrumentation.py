@@ -0,0 +1,268 @@
+"""
+Opt-in counters and phase timings of parsing and stringifying.
+
+    instrumentation = Instrumentation()
+    with instrumentation:
+        parse_many(strings)
+    metrics.send(instrumentation.stats())
+
+Nothing is checked on the hot path: `enable` swaps the parse engines and
+their list-building variants, the length check, the URL tokenizers, the
+descriptor validator and `SRCSet.stringify` for timed copies, and `disable`
+puts the originals back
+"""
+from __future__ import unicode_literals
+
+from timeit import default_timer
+
+try:
+    from . import columnar
+    from . import srcset as core
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    import columnar
+    import srcset as core
+
+# Phases of `stats()["time"]`:
+# - parse: everything the engines do, the sum of the three below
+# - tokenize: steps 4 - 8.1, collecting the URL. The regex engine matches a
+#   whole candidate at once, a single descriptor is split off here too
+# - descriptors: step 8.e, splitting descriptors, and building candidates
+# - validate: steps 9 - 15, validating descriptors
+# - stringify: `SRCSet.stringify` and `SRCSet.write_to`
+PHASES = ("parse", "tokenize", "descriptors", "validate", "stringify")
+
+# Module level names which are swapped, the state machine collects URLs with
+# `collect_characters_*`, the regex engine with `CANDIDATE_RE*`
+TOKENIZERS = ("collect_characters_in", "collect_characters_out")
+PATTERNS = ("CANDIDATE_RE", "CANDIDATE_RE_BINARY")
+# Memos of the regex engine which would skip the validator, they are
+# replaced by ones which never keep anything
+MEMOS = ("DESCRIPTOR_VALUES", "TYPED_DESCRIPTOR_VALUES")
+# Modules which call `check_length` before the engines, `columnar` imports it
+# by name
+LENGTH_CHECKS = (core, columnar)
+
+
+class Instrumentation(object):
+    """
+    Counters of inputs, their length in bytes or characters, candidates,
+    rejected candidates by reason, inputs over limits and time per phase in
+    seconds. Only one instance can be enabled at a time, counters are not
+    thread-safe. Inputs served by `ParseCache` are not counted, nor is
+    anything parsed in other processes by `parse_parallel`
+    """
+    # The enabled instance
+    active = None
+
+    def __init__(self):
+        self.originals = None
+        self.reset()
+
+    def reset(self):
+        self.inputs = 0
+        self.bytes = 0
+        self.candidates = 0
+        self.limit_exceeded = 0
+        self.stringified = 0
+        self.rejected = {}
+        self.times = dict((phase, 0.0) for phase in PHASES)
+
+    @property
+    def enabled(self):
+        return self.originals is not None
+
+    def enable(self):
+        if self.enabled:
+            return
+        if Instrumentation.active is not None:
+            raise RuntimeError("Another Instrumentation is already enabled")
+        originals = {
+            "ENGINES": dict(core.ENGINES),
+            "PARSERS": dict(core.PARSERS),
+            "parse_descriptors": core.parse_descriptors,
+            "check_length": core.check_length,
+            "stringify": core.SRCSet.__dict__["stringify"],
+            "write_to": core.SRCSet.__dict__["write_to"],
+        }
+        for name in TOKENIZERS + PATTERNS + MEMOS:
+            originals[name] = getattr(core, name)
+
+        for name, engine in originals["ENGINES"].items():
+            core.ENGINES[name] = self.timed_engine(engine)
+        for name, parse in originals["PARSERS"].items():
+            core.PARSERS[name] = self.timed_parser(parse)
+        core.parse_descriptors = self.timed_validator(originals["parse_descriptors"])
+        check_length = self.counted_length_check(originals["check_length"])
+        for module in LENGTH_CHECKS:
+            module.check_length = check_length
+        core.SRCSet.stringify = self.timed_method(originals["stringify"])
+        core.SRCSet.write_to = self.timed_method(originals["write_to"])
+        for name in TOKENIZERS:
+            setattr(core, name, self.timed_tokenizer(originals[name]))
+        for name in PATTERNS:
+            setattr(core, name, TimedPattern(originals[name], self))
+        for name in MEMOS:
+            setattr(core, name, ForgetfulDict())
+        self.originals = originals
+        Instrumentation.active = self
+
+    def disable(self):
+        if not self.enabled:
+            return
+        originals = self.originals
+        core.ENGINES.update(originals["ENGINES"])
+        core.PARSERS.update(originals["PARSERS"])
+        core.parse_descriptors = originals["parse_descriptors"]
+        for module in LENGTH_CHECKS:
+            module.check_length = originals["check_length"]
+        core.SRCSet.stringify = originals["stringify"]
+        core.SRCSet.write_to = originals["write_to"]
+        for name in TOKENIZERS + PATTERNS + MEMOS:
+            setattr(core, name, originals[name])
+        self.originals = None
+        Instrumentation.active = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def stats(self):
+        """
+        Returns all counters as a dict of numbers and dicts of numbers
+        """
+        times = dict(self.times)
+        times["descriptors"] = max(times["parse"] - times["tokenize"] - times["validate"], 0.0)
+        return {
+            "inputs": self.inputs,
+            "bytes": self.bytes,
+            "candidates": self.candidates,
+            "rejected": dict(self.rejected),
+            "limit_exceeded": self.limit_exceeded,
+            "stringified": self.stringified,
+            "time": times,
+        }
+
+    def timed_engine(self, engine):
+        times = self.times
+
+        def timed(string, max_candidates=None, max_descriptors=None, factory=core.candidate_dict):
+            self.inputs = self.inputs + 1
+            self.bytes = self.bytes + len(string)
+            iterator = engine(string, max_candidates, max_descriptors, factory)
+            # Candidates are parsed lazily, only the time spent in the engine is counted
+            while True:
+                start = default_timer()
+                try:
+                    candidate = next(iterator)
+                except StopIteration:
+                    times["parse"] = times["parse"] + default_timer() - start
+                    return
+                except core.LimitExceeded:
+                    times["parse"] = times["parse"] + default_timer() - start
+                    self.limit_exceeded = self.limit_exceeded + 1
+                    raise
+                times["parse"] = times["parse"] + default_timer() - start
+                self.candidates = self.candidates + 1
+                yield candidate
+
+        return timed
+
+    def timed_parser(self, parse):
+        times = self.times
+
+        def timed(string, max_candidates=None, max_descriptors=None, factory=core.candidate_dict):
+            self.inputs = self.inputs + 1
+            self.bytes = self.bytes + len(string)
+            start = default_timer()
+            try:
+                candidates = parse(string, max_candidates, max_descriptors, factory)
+            except core.LimitExceeded:
+                self.limit_exceeded = self.limit_exceeded + 1
+                raise
+            finally:
+                times["parse"] = times["parse"] + default_timer() - start
+            self.candidates = self.candidates + len(candidates)
+            return candidates
+
+        return timed
+
+    def counted_length_check(self, check_length):
+        # Inputs over `max_length` never reach the engines
+        def counted(string, max_length):
+            try:
+                check_length(string, max_length)
+            except core.LimitExceeded:
+                self.inputs = self.inputs + 1
+                self.bytes = self.bytes + len(string)
+                self.limit_exceeded = self.limit_exceeded + 1
+                raise
+
+        return counted
+
+    def timed_validator(self, validate):
+        times = self.times
+        rejected = self.rejected
+
+        def timed(descriptors, typed=False):
+            start = default_timer()
+            values = validate(descriptors, typed)
+            times["validate"] = times["validate"] + default_timer() - start
+            if values is None:
+                # Rejections are rare, validating once more for the reason is cheap
+                reason = core.check_descriptors(descriptors)[0]
+                rejected[reason] = rejected.get(reason, 0) + 1
+            return values
+
+        return timed
+
+    def timed_tokenizer(self, tokenize):
+        times = self.times
+
+        def timed(string, start, charset):
+            started = default_timer()
+            result = tokenize(string, start, charset)
+            times["tokenize"] = times["tokenize"] + default_timer() - started
+            return result
+
+        return timed
+
+    def timed_method(self, method):
+        times = self.times
+
+        def timed(obj, *args):
+            start = default_timer()
+            try:
+                return method(obj, *args)
+            finally:
+                times["stringify"] = times["stringify"] + default_timer() - start
+                self.stringified = self.stringified + 1
+
+        return timed
+
+
+class TimedPattern(object):
+    """
+    Compiled pattern which adds the time of `match` to the tokenize phase
+    """
+
+    def __init__(self, pattern, instrumentation):
+        self.pattern = pattern
+        self.times = instrumentation.times
+
+    def match(self, string, pos=0):
+        start = default_timer()
+        result = self.pattern.match(string, pos)
+        self.times["tokenize"] = self.times["tokenize"] + default_timer() - start
+        return result
+
+
+class ForgetfulDict(dict):
+    """
+    Memo which is always empty, every descriptor goes through the validator
+    """
+
+    def __setitem__(self, key, value):
+        pass
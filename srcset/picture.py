@@ -0,0 +1,146 @@
+"""
+Resolution of `<picture>` elements, based on
+https://html.spec.whatwg.org/multipage/images.html#selecting-an-image-source
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+try:
+    from .selection import Selector
+    from .sizes import SizesCache, Viewport
+    from .srcset import binary_types
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from selection import Selector
+    from sizes import SizesCache, Viewport
+    from srcset import binary_types
+
+# Image types which current browsers support
+DEFAULT_TYPES = frozenset((
+    "image/apng",
+    "image/avif",
+    "image/bmp",
+    "image/gif",
+    "image/jpeg",
+    "image/png",
+    "image/svg+xml",
+    "image/webp",
+    "image/x-icon",
+))
+
+
+class Source(namedtuple("Source", ("srcset", "sizes", "media", "type"))):
+    """
+    Attributes of a `<source>` element, or of the `<img>` element without
+    `media` and `type`. Missing attributes are None
+    """
+    __slots__ = ()
+
+    def __new__(cls, srcset, sizes=None, media=None, type=None):
+        return super(Source, cls).__new__(cls, srcset, sizes, media, type)
+
+
+class Picture(namedtuple("Picture", ("sources", "src"))):
+    """
+    `sources` are `Source` tuples in the document order with the `<img>`
+    element last, `src` is the `src` attribute of `<img>`
+    """
+    __slots__ = ()
+
+    def __new__(cls, sources, src=None):
+        return super(Picture, cls).__new__(cls, tuple(sources), src)
+
+
+class Device(namedtuple("Device", ("viewport", "types"))):
+    """
+    `Viewport` with the set of supported image types
+    """
+    __slots__ = ()
+
+    def __new__(cls, viewport, types=DEFAULT_TYPES):
+        return super(Device, cls).__new__(cls, viewport, frozenset(types))
+
+
+class Resolver(object):
+    """
+    Resolves `Picture` elements for `Device` profiles. `Selector` indexes of
+    srcsets, parsed `sizes` and `media` and the results for every viewport
+    are cached, so the same picture or attribute value is parsed only once.
+    `options` are passed to `SRCSet`
+    """
+
+    def __init__(self, max_entries=4096, sizes_cache=None, **options):
+        self.max_entries = max_entries
+        self.sizes_cache = sizes_cache if sizes_cache is not None else SizesCache(max_entries)
+        self.options = options
+        self.selectors = {}
+
+    def selector(self, srcset, src=None):
+        key = (srcset, src)
+        try:
+            return self.selectors[key]
+        except KeyError:
+            pass
+        if len(self.selectors) >= self.max_entries:
+            self.selectors.clear()
+        if srcset is None:
+            srcset = src[:0] if src is not None else ""
+        selector = Selector(srcset, src, **self.options)
+        self.selectors[key] = selector
+        return selector
+
+    def resolve(self, picture, device):
+        """
+        Returns the URL `picture` resolves to on `device` or None
+        """
+        if isinstance(device, Viewport):
+            device = Device(device)
+        viewport = device.viewport
+        sizes_cache = self.sizes_cache
+        last = len(picture.sources) - 1
+        for i, source in enumerate(picture.sources):
+            if source.srcset is None and i != last:
+                continue
+            selector = self.selector(source.srcset, picture.src if i == last else None)
+            if not selector.densities and not selector.widths:
+                continue
+            if source.media is not None and not sizes_cache.matches_media(source.media, viewport):
+                continue
+            if source.type is not None and not type_supported(source.type, device.types):
+                continue
+            width = None
+            if selector.widths:
+                if source.sizes is None:
+                    width = float(viewport.width)
+                else:
+                    width = sizes_cache.evaluate(source.sizes, viewport)
+                if width <= 0:
+                    # All `w` candidates have infinite density, the first one wins
+                    return min(zip(selector.width_orders, selector.width_urls))[1]
+            return selector.select(viewport.density, width)
+        return None
+
+    def resolve_many(self, pictures, devices):
+        """
+        Returns a list of URLs for each of `pictures`, one for each of
+        `devices`
+        """
+        devices = [Device(device) if isinstance(device, Viewport) else device for device in devices]
+        # Pages repeat the same pictures, each of them is resolved once
+        resolved = {}
+        results = []
+        for picture in pictures:
+            urls = resolved.get(picture)
+            if urls is None:
+                urls = resolved[picture] = [self.resolve(picture, device) for device in devices]
+            results.append(list(urls))
+        return results
+
+
+def type_supported(value, types):
+    """
+    Compares MIME type essence of `value` with `types`
+    """
+    if isinstance(value, binary_types):
+        value = value.decode("latin-1")
+    return value.split(";", 1)[0].strip().lower() in types
@@ -0,0 +1,475 @@
+"""
+Single pass scanner which finds `srcset` and `imagesrcset` attributes in an
+HTML document without building a tree.
+
+Text, comments, contents of raw text elements and tags without srcset
+attributes are skipped by regular expressions, Python code runs only for
+the remaining tags
+"""
+from __future__ import unicode_literals
+
+import re
+from collections import namedtuple
+
+try:
+    from .srcset import SRCSet, binary_types
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from srcset import SRCSet, binary_types
+
+try:
+    from html import unescape
+    from html.entities import html5 as NAMED_REFERENCES
+except ImportError:  # Python 2
+    from HTMLParser import HTMLParser
+    from htmlentitydefs import name2codepoint
+    unescape = HTMLParser().unescape
+    # Legacy references without ";" are left as they are
+    NAMED_REFERENCES = dict((name + ";", None) for name in name2codepoint)
+
+ATTRIBUTE_NAMES = ("srcset", "imagesrcset")
+
+# Elements whose content is not parsed as markup
+RAW_TEXT_ELEMENTS = (
+    "script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes", "plaintext"
+)
+
+# Building blocks of SKIP_RE. Every token is matched to its end, so there is
+# only one way to split a tag into tokens and a failed match does not backtrack
+_NAME = r"[^\t\n\f\r />][^\t\n\f\r />=]*(?![^\t\n\f\r />=])"
+_VALUE = r"\"[^\"]*\"|'[^']*'|(?![\"'])[^\t\n\f\r >]*(?![^\t\n\f\r >])"
+_SEPARATOR = r"[\t\n\f\r /]+(?![\t\n\f\r /])"
+_OTHER_ATTRIBUTE = (
+    r"(?!(?:image)?srcset(?![^\t\n\f\r />=]))" + _NAME +
+    r"(?:[\t\n\f\r ]*=[\t\n\f\r ]*(?![\t\n\f\r ])(?:" + _VALUE + r")|(?![\t\n\f\r ]*=))"
+)
+_OTHER_TAG = (
+    r"<(?!(?:%s)(?![^\t\n\f\r />]))[a-zA-Z][^\t\n\f\r />]*(?![^\t\n\f\r />])" % "|".join(RAW_TEXT_ELEMENTS) +
+    r"(?:" + _SEPARATOR + r"|" + _OTHER_ATTRIBUTE + r")*>"
+)
+# Everything up to the next tag which has to be looked at: text, comments,
+# end tags and start tags without srcset attributes
+SKIP_RE = re.compile(
+    r"(?:[^<]+|<!--(?:-?>|.*?-->)|<(?!!--)[!?/][^>]*>|" + _OTHER_TAG + r"|<(?![a-zA-Z!?/]))*",
+    re.S | re.I
+)
+
+# A comment, a doctype or an end tag, or a start tag with its attributes
+MARKUP_RE = re.compile(
+    r"<!--(?:-?>|.*?(?:-->|\Z))"
+    r"|<[!?/][^>]*>?"
+    r"|<(?P<name>[a-zA-Z][^\t\n\f\r />]*)"
+    r"(?P<attrs>(?:[\t\n\f\r /]+|[^\t\n\f\r />][^\t\n\f\r />=]*"
+    r"(?:[\t\n\f\r ]*=[\t\n\f\r ]*(?:\"[^\"]*\"?|'[^']*'?|[^\t\n\f\r >]*))?)*)(?P<close>>)?",
+    re.S
+)
+# A single attribute inside of the region matched by the `attrs` group of MARKUP_RE
+ATTRIBUTE_RE = re.compile(
+    r"(?P<name>[^\t\n\f\r />][^\t\n\f\r />=]*)"
+    r"(?:[\t\n\f\r ]*=[\t\n\f\r ]*(?:\"(?P<dq>[^\"]*)\"?|'(?P<sq>[^']*)'?|(?P<uq>[^\t\n\f\r >]*)))?"
+)
+SRCSET_RE = re.compile(r"srcset", re.I)
+# A character reference, the lookahead group is "=" if it follows
+ENTITY_RE = re.compile(r"&(?:#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[a-zA-Z][a-zA-Z0-9]*;?)(?=(=?))")
+
+# Matches the end tag of a raw text element, `plaintext` never ends
+RAW_TEXT_END_RE = dict(
+    (name, re.compile(r"</%s[\t\n\f\r />]" % name if name != "plaintext" else r"(?!)", re.I))
+    for name in RAW_TEXT_ELEMENTS
+)
+COMMENT_END_RE = re.compile(r"-->")
+
+# States of an unfinished tag. `StreamRewriter` follows the tag a chunk at a
+# time by the same rules as MARKUP_RE and matches it again only once it ends
+TAG_END = 0
+TAG_NAME = 1
+BEFORE_NAME = 2
+NAME = 3
+AFTER_NAME = 4
+BEFORE_VALUE = 5
+DOUBLE_QUOTED = 6
+SINGLE_QUOTED = 7
+UNQUOTED = 8
+BOGUS = 9
+_WHITESPACES = "\t\n\f\r "
+# state: (run of characters which keep the state, next state by the
+# character after the run, next state for other characters)
+TAG_STATES = dict((state, (re.compile("(?:%s)(.)?" % run, re.S), transitions, default)) for (
+    state, run, transitions, default
+) in (
+    (TAG_NAME, r"[^\t\n\f\r />]*", dict.fromkeys(_WHITESPACES + "/", BEFORE_NAME), TAG_END),
+    (BEFORE_NAME, r"[\t\n\f\r /]*", {">": TAG_END}, NAME),
+    (NAME, r"[^\t\n\f\r />=]*", dict(
+        [(character, AFTER_NAME) for character in _WHITESPACES] + [("/", BEFORE_NAME), ("=", BEFORE_VALUE)]
+    ), TAG_END),
+    (AFTER_NAME, r"[\t\n\f\r ]*", {"=": BEFORE_VALUE, "/": BEFORE_NAME, ">": TAG_END}, NAME),
+    (BEFORE_VALUE, r"[\t\n\f\r ]*", {"\"": DOUBLE_QUOTED, "'": SINGLE_QUOTED, ">": TAG_END}, UNQUOTED),
+    (DOUBLE_QUOTED, r"[^\"]*", {}, BEFORE_NAME),
+    (SINGLE_QUOTED, r"[^']*", {}, BEFORE_NAME),
+    (UNQUOTED, r"[^\t\n\f\r >]*", {">": TAG_END}, BEFORE_NAME),
+    (BOGUS, r"[^>]*", {}, TAG_END),
+))
+# Longest end tag without the last character, it may be split between chunks
+RAW_TEXT_END_LENGTH = max(len(name) for name in RAW_TEXT_ELEMENTS) + 2
+
+
+class Syntax(namedtuple("Syntax", (
+    "skip_re", "markup_re", "attribute_re", "srcset_re", "entity_re", "raw_text_end_re",
+    "comment_end_re", "names", "lt", "gt", "comment_start", "escapes", "quote", "tag_states"
+))):
+    """
+    Regular expressions and literals for text or bytes documents
+    """
+    __slots__ = ()
+
+    def encode(self):
+        return Syntax(
+            re.compile(self.skip_re.pattern.encode("ascii"), self.skip_re.flags & ~re.U),
+            re.compile(self.markup_re.pattern.encode("ascii"), self.markup_re.flags & ~re.U),
+            re.compile(self.attribute_re.pattern.encode("ascii"), self.attribute_re.flags & ~re.U),
+            re.compile(self.srcset_re.pattern.encode("ascii"), self.srcset_re.flags & ~re.U),
+            re.compile(self.entity_re.pattern.encode("ascii"), self.entity_re.flags & ~re.U),
+            dict(
+                (name.encode("ascii"), re.compile(pattern.pattern.encode("ascii"), pattern.flags & ~re.U))
+                for name, pattern in self.raw_text_end_re.items()
+            ),
+            re.compile(self.comment_end_re.pattern.encode("ascii")),
+            tuple(name.encode("ascii") for name in self.names),
+            self.lt.encode("ascii"),
+            self.gt.encode("ascii"),
+            self.comment_start.encode("ascii"),
+            dict(
+                (quote.encode("ascii"), tuple((a.encode("ascii"), b.encode("ascii")) for a, b in escapes))
+                for quote, escapes in self.escapes.items()
+            ),
+            self.quote.encode("ascii"),
+            dict(
+                (state, (
+                    re.compile(regex.pattern.encode("ascii"), regex.flags & ~re.U),
+                    dict((character.encode("ascii"), next_state) for character, next_state in transitions.items()),
+                    default,
+                ))
+                for state, (regex, transitions, default) in self.tag_states.items()
+            ),
+        )
+
+
+TEXT_SYNTAX = Syntax(
+    SKIP_RE,
+    MARKUP_RE,
+    ATTRIBUTE_RE,
+    SRCSET_RE,
+    ENTITY_RE,
+    RAW_TEXT_END_RE,
+    COMMENT_END_RE,
+    ATTRIBUTE_NAMES,
+    "<",
+    ">",
+    "<!--",
+    {
+        "\"": (("&", "&amp;"), ("\"", "&quot;")),
+        "'": (("&", "&amp;"), ("'", "&#39;")),
+    },
+    "\"",
+    TAG_STATES,
+)
+BINARY_SYNTAX = TEXT_SYNTAX.encode()
+
+
+def syntax_for(html):
+    if isinstance(html, binary_types):
+        return BINARY_SYNTAX
+    return TEXT_SYNTAX
+
+
+class Attribute(namedtuple("Attribute", ("name", "start", "end", "candidates"))):
+    """
+    Found attribute. `name` is lowercased, `start` and `end` are offsets of
+    the value in the document (without quotes), `candidates` are parsed from
+    the value with character references decoded
+    """
+    __slots__ = ()
+
+
+def scan(html, encoding="utf-8", **options):
+    """
+    Yields an `Attribute` for every `srcset` and `imagesrcset` attribute of
+    `html`, which is text or bytes. `options` are passed to `SRCSet`.
+    Character references in bytes input are decoded to `encoding`
+    """
+    syntax = syntax_for(html)
+    pos = 0
+    length = len(html)
+    while True:
+        pos = syntax.skip_re.match(html, pos).end()
+        if pos >= length:
+            return
+        match = syntax.markup_re.match(html, pos)
+        pos = match.end()
+        tag = match.group("name")
+        if tag is None:
+            continue
+
+        for name, start, end, _ in iter_srcset_attributes(html, match, syntax):
+            value = html[start:end]
+            if syntax.entity_re.search(value) is not None:
+                value = unescape_value(value, encoding)
+            yield Attribute(name, start, end, SRCSet(value, **options).parse())
+
+        # Contents of raw text elements may look like markup
+        end_re = syntax.raw_text_end_re.get(tag.lower())
+        if end_re is not None:
+            end = end_re.search(html, pos)
+            if end is None:
+                return
+            pos = end.start()
+
+
+def follow_tag(state, html, tag_states):
+    """
+    Follows an unfinished tag from `state` to the end of `html`. Returns the
+    state at the end, TAG_END as soon as the tag is complete
+    """
+    pos = 0
+    length = len(html)
+    while pos < length:
+        regex, transitions, default = tag_states[state]
+        match = regex.match(html, pos)
+        stop = match.group(1)
+        if stop is None:
+            break
+        pos = match.end()
+        state = transitions.get(stop, default)
+        if state == TAG_END:
+            break
+    return state
+
+
+def iter_srcset_attributes(html, match, syntax):
+    """
+    Yields (name, start, end, quote) of srcset attributes of the tag matched by
+    MARKUP_RE. `start` and `end` are offsets of the value, `quote` is empty
+    for unquoted values
+    """
+    attrs_start, attrs_end = match.span("attrs")
+    if syntax.srcset_re.search(html, attrs_start, attrs_end) is None:
+        return
+    for attribute in syntax.attribute_re.finditer(html, attrs_start, attrs_end):
+        name = attribute.group("name").lower()
+        if name not in syntax.names:
+            continue
+        for group in ("dq", "sq", "uq"):
+            start, end = attribute.span(group)
+            if start != -1:
+                # The quote is right before the value
+                quote = html[start - 1:start] if group != "uq" else html[start:start]
+                break
+        else:
+            # Attribute without value
+            start = end = attribute.end()
+            quote = html[start:start]
+        yield name, start, end, quote
+
+
+class StreamRewriter(object):
+    """
+    Rewrites URLs of `srcset` and `imagesrcset` attributes in an HTML document
+    which comes in chunks. `feed` returns the output which is ready so far,
+    `close` returns the rest.
+
+    Only an unfinished tag or the last few characters of a comment or raw text
+    element are kept between the chunks, so memory depends on the size of the
+    largest tag, not of the document. Chunks of an unfinished tag are only
+    followed by `follow_tag` and joined once the tag is complete, so a long
+    tag is rewritten in linear time
+    """
+
+    def __init__(self, callback, encoding="utf-8", **options):
+        self.callback = callback
+        self.encoding = encoding
+        self.options = options
+        self.syntax = None
+        self.buffer = None
+        # Chunks after `buffer` and the state of the unfinished tag in it
+        self.pending = []
+        self.pending_size = 0
+        self.tag_state = None
+        # (regular expression, whether to continue after the match) while
+        # inside of a comment or a raw text element
+        self.end = None
+
+    def feed(self, chunk):
+        if self.buffer is None:
+            self.syntax = syntax_for(chunk)
+            self.buffer = chunk
+            return self.process(False)
+        if not chunk:
+            return self.buffer[:0]
+        if self.tag_state is not None:
+            self.tag_state = follow_tag(self.tag_state, chunk, self.syntax.tag_states)
+            if self.tag_state != TAG_END:
+                self.pending.append(chunk)
+                self.pending_size = self.pending_size + len(chunk)
+                return self.buffer[:0]
+        self.pending.append(chunk)
+        self.join_pending()
+        return self.process(False)
+
+    def close(self):
+        if self.buffer is None:
+            return ""
+        self.join_pending()
+        output = self.process(True)
+        self.buffer = self.buffer[:0]
+        return output
+
+    def join_pending(self):
+        if self.pending:
+            self.buffer = self.buffer[:0].join([self.buffer] + self.pending)
+            self.pending = []
+            self.pending_size = 0
+        self.tag_state = None
+
+    def process(self, final):
+        html = self.buffer
+        syntax = self.syntax
+        length = len(html)
+        output = []
+        pos = 0
+        while pos < length:
+            if self.end is not None:
+                end_re, after = self.end
+                end = end_re.search(html, pos)
+                if end is None:
+                    # The end may be split between this chunk and the next one
+                    keep = length if final else max(pos, length - RAW_TEXT_END_LENGTH)
+                    output.append(html[pos:keep])
+                    pos = keep
+                    break
+                end = end.end() if after else end.start()
+                output.append(html[pos:end])
+                pos = end
+                self.end = None
+                continue
+
+            end = syntax.skip_re.match(html, pos).end()
+            if not final and end == length and html.endswith(syntax.lt):
+                # "<" may start a tag in the next chunk
+                output.append(html[pos:end - 1])
+                pos = end - 1
+                break
+            output.append(html[pos:end])
+            pos = end
+            if pos >= length:
+                break
+
+            if html.startswith(syntax.comment_start, pos):
+                # Complete comments are skipped above
+                if not final and length - pos <= len(syntax.comment_start) + 1:
+                    # "<!-->" and "<!--->" end the comment right away
+                    break
+                output.append(html[pos:pos + len(syntax.comment_start)])
+                pos = pos + len(syntax.comment_start)
+                self.end = (syntax.comment_end_re, True)
+                continue
+
+            match = syntax.markup_re.match(html, pos)
+            if not final and match.end() >= length and (
+                match.group("close") is None if match.group("name") is not None else not html.endswith(syntax.gt)
+            ):
+                # Unfinished tag
+                break
+            tag = match.group("name")
+            output.append(self.rewrite_tag(html, match) if tag is not None else match.group())
+            pos = match.end()
+            if tag is not None:
+                end_re = syntax.raw_text_end_re.get(tag.lower())
+                if end_re is not None:
+                    self.end = (end_re, False)
+
+        self.buffer = html[pos:]
+        if not final and self.end is None and len(self.buffer) >= len(syntax.comment_start):
+            # An unfinished tag, shorter ones are matched again with every chunk
+            state = follow_tag(
+                TAG_NAME if self.buffer[1:2].isalpha() else BOGUS, self.buffer[1:], syntax.tag_states
+            )
+            if state != TAG_END:
+                self.tag_state = state
+        return html[:0].join(output)
+
+    def rewrite_tag(self, html, match):
+        syntax = self.syntax
+        parts = []
+        pos = match.start()
+        for _, start, end, quote in iter_srcset_attributes(html, match, syntax):
+            value = html[start:end]
+            new_value = self.rewrite_value(value, quote)
+            if new_value is value:
+                continue
+            parts.append(html[pos:start])
+            if quote:
+                parts.append(new_value)
+            else:
+                parts.extend((syntax.quote, new_value, syntax.quote))
+            pos = end
+        if not parts:
+            return match.group()
+        parts.append(html[pos:match.end()])
+        return html[:0].join(parts)
+
+    def rewrite_value(self, value, quote):
+        """
+        Returns `value` itself if no URL is changed
+        """
+        escapes = self.syntax.escapes[quote or self.syntax.quote]
+        callback = self.callback
+
+        if self.syntax.entity_re.search(value) is None:
+            def rewrite(url):
+                new_url = callback(url)
+                if new_url == url:
+                    return url
+                return escape_value(new_url, escapes)
+            return SRCSet(value, **self.options).rewrite_urls(rewrite)
+
+        # Values with character references are decoded, rewritten and encoded back
+        unescaped = unescape_value(value, self.encoding)
+        new_value = SRCSet(unescaped, **self.options).rewrite_urls(callback)
+        if new_value is unescaped:
+            return value
+        return escape_value(new_value, escapes)
+
+
+def escape_value(value, escapes):
+    for character, reference in escapes:
+        value = value.replace(character, reference)
+    return value
+
+
+def unescape_value(value, encoding="utf-8"):
+    """
+    Decodes character references of an attribute value
+    """
+    if isinstance(value, binary_types):
+        return BINARY_SYNTAX.entity_re.sub(
+            lambda match: unescape_reference(
+                match.group().decode("ascii"), match.group(1)
+            ).encode(encoding, "xmlcharrefreplace"),
+            value
+        )
+    return TEXT_SYNTAX.entity_re.sub(lambda match: unescape_reference(match.group(), match.group(1)), value)
+
+
+def unescape_reference(reference, equals):
+    """
+    Decodes a reference matched by ENTITY_RE, `equals` is "=" if it follows.
+    See https://html.spec.whatwg.org/multipage/parsing.html#named-character-reference-state:
+    in attribute values a named reference is decoded only if it ends with
+    ";", or if it is a legacy one followed by neither an alphanumeric
+    character nor "=", so `?a=1&region=us` stays as it is
+    """
+    name = reference[1:]
+    if name.startswith("#"):
+        return unescape(reference)
+    if name in NAMED_REFERENCES and (name.endswith(";") or not equals):
+        return unescape(reference)
+    return reference
@@ -0,0 +1,246 @@
+"""
+Selection of the candidate a browser would fetch, based on
+https://html.spec.whatwg.org/multipage/images.html#update-the-source-set and
+https://html.spec.whatwg.org/multipage/images.html#select-an-image-source
+"""
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+
+try:
+    from .srcset import SRCSet
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from srcset import SRCSet
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Selector(object):
+    """
+    Sorted density index of a parsed srcset. `srcset` is a string, a `SRCSet`
+    or a list of parsed candidates, `options` are passed to `SRCSet` when it
+    is a string. `src` is used as a 1x candidate like the `src` attribute of
+    `<img>`.
+
+    Densities of `x` candidates are known when the index is built, densities
+    of `w` candidates depend on the slot width but their order does not, so
+    both are kept in separate sorted lists and every query is two bisects
+    """
+
+    def __init__(self, srcset, src=None, **options):
+        if isinstance(srcset, list):
+            candidates = srcset
+        else:
+            candidates = parsed_candidates(srcset, options)
+
+        densities = []
+        widths = []
+        for order, item in enumerate(candidates):
+            if item["w"] is not None:
+                widths.append((int(item["w"]), order, item["url"]))
+            elif item["x"] is not None:
+                densities.append((float(item["x"]), order, item["url"]))
+            else:
+                densities.append((1.0, order, item["url"]))
+        if src is not None and not widths and all(density != 1.0 for density, _, _ in densities):
+            densities.append((1.0, len(candidates), src))
+
+        # Only the first of candidates with the same density is kept, for `w`
+        # candidates the density is the same when the width is the same
+        self.densities, self.density_orders, self.density_urls = unique(densities)
+        self.widths, self.width_orders, self.width_urls = unique(widths)
+
+    def select(self, density=1.0, width=None):
+        """
+        Returns the URL of the candidate with the smallest density which is
+        not less than `density` (device pixel ratio), or of the candidate with
+        the largest density if all of them are less. `width` is the slot width
+        in CSS pixels, required if there are `w` candidates.
+        Returns None if there are no candidates
+        """
+        found = self.find(density, width)
+        return None if found is None else found[2]
+
+    def select_index(self, density=1.0, width=None):
+        """
+        `select` which returns the index of the candidate in the parsed srcset,
+        the number of candidates for `src` and -1 if there are no candidates
+        """
+        found = self.find(density, width)
+        return -1 if found is None else found[1]
+
+    def find(self, density, width):
+        """
+        Returns (density, index, url) of the selected candidate or None
+        """
+        if self.widths:
+            check_width(width)
+            target = density * width
+        found = []
+
+        i = bisect_left(self.densities, density)
+        if i == len(self.densities) and i:
+            i = i - 1
+        if i < len(self.densities):
+            found.append((self.densities[i], self.density_orders[i], self.density_urls[i]))
+
+        j = bisect_left(self.widths, target) if self.widths else 0
+        if j == len(self.widths) and j:
+            j = j - 1
+        if j < len(self.widths):
+            found.append((float(self.widths[j]) / width, self.width_orders[j], self.width_urls[j]))
+
+        if not found:
+            return None
+        if len(found) == 2 and (found[0][0] >= density) != (found[1][0] >= density):
+            # Only one of them is big enough
+            return found[0] if found[0][0] >= density else found[1]
+        if found[0][0] < density:
+            # Neither is big enough, the largest wins
+            return max(found, key=lambda item: (item[0], -item[1]))
+        return min(found)
+
+    def normalize(self, width=None):
+        """
+        Returns a list of (url, density) in the order of the srcset without
+        candidates with a duplicate density. `width` is the slot width in CSS
+        pixels, required if there are `w` candidates
+        """
+        items = list(zip(self.density_orders, self.density_urls, self.densities))
+        if self.widths:
+            check_width(width)
+            items.extend(zip(self.width_orders, self.width_urls, [float(w) / width for w in self.widths]))
+        items.sort()
+        seen = set()
+        result = []
+        for _, url, density in items:
+            if density not in seen:
+                seen.add(density)
+                result.append((url, density))
+        return result
+
+
+def unique(items):
+    """
+    Sorts (key, order, url) items and drops all but the first of items with
+    the same key. Returns lists of keys, orders and urls
+    """
+    keys = []
+    orders = []
+    urls = []
+    for key, order, url in sorted(items):
+        if keys and keys[-1] == key:
+            continue
+        keys.append(key)
+        orders.append(order)
+        urls.append(url)
+    return keys, orders, urls
+
+
+def check_width(width):
+    if width is None or width <= 0:
+        raise ValueError("Positive slot width is required for width descriptors")
+
+
+def select_many(srcsets, densities, widths=None, vectorized=None, **options):
+    """
+    Selects a candidate of each of `srcsets` for every device profile given
+    by `densities` (device pixel ratios) and `widths` (slot widths in CSS
+    pixels, one per profile or a row of them per srcset). `srcsets` are
+    strings or `SRCSet`, `options` are passed to `SRCSet` for strings.
+
+    Returns a (srcset x profile) matrix of indices of selected candidates,
+    -1 where a srcset has no candidates. With NumPy the matrix is a
+    `numpy.ndarray` computed by a few array operations for all srcsets at
+    once, otherwise (or with `vectorized=False`) it is a list of lists
+    computed by `Selector`
+    """
+    if vectorized is None:
+        vectorized = numpy is not None
+    if vectorized and numpy is None:
+        raise ImportError("NumPy is required for vectorized selection")
+    candidates = [parsed_candidates(srcset, options) for srcset in srcsets]
+    if vectorized:
+        return select_many_numpy(candidates, densities, widths)
+
+    matrix = []
+    for row, items in enumerate(candidates):
+        selector = Selector(items)
+        row_widths = widths
+        if widths is not None and len(widths) and hasattr(widths[0], "__len__"):
+            row_widths = widths[row]
+        matrix.append([
+            selector.select_index(density, row_widths[column] if row_widths is not None else None)
+            for column, density in enumerate(densities)
+        ])
+    return matrix
+
+
+def select_many_numpy(candidates, densities, widths):
+    """
+    Candidates of all srcsets are packed into flat arrays and their
+    densities for every profile make a (candidate x profile) array. The
+    selected candidates are found by segmented reductions over the rows of
+    every srcset, first among big enough densities, then among the others
+    """
+    densities = numpy.asarray(densities, dtype=float)
+    counts = numpy.array([len(items) for items in candidates], dtype=numpy.intp)
+    result = numpy.full((len(candidates), len(densities)), -1, dtype=numpy.intp)
+    total = int(counts.sum())
+    if not total or not len(densities):
+        return result
+
+    values = []
+    is_width = []
+    for items in candidates:
+        for item in items:
+            if item["w"] is not None:
+                values.append(int(item["w"]))
+                is_width.append(True)
+            else:
+                values.append(float(item["x"]) if item["x"] is not None else 1.0)
+                is_width.append(False)
+    values = numpy.array(values, dtype=float)
+    is_width = numpy.array(is_width, dtype=bool)
+    owners = numpy.repeat(numpy.arange(len(candidates)), counts)
+    starts = numpy.cumsum(counts) - counts
+    indices = (numpy.arange(total) - starts[owners])[:, None]
+
+    matrix = numpy.repeat(values[:, None], len(densities), axis=1)
+    if is_width.any():
+        if widths is None:
+            raise ValueError("Positive slot width is required for width descriptors")
+        widths = numpy.broadcast_to(numpy.asarray(widths, dtype=float), result.shape)
+        slot_widths = widths[owners[is_width]]
+        if (slot_widths <= 0).any():
+            raise ValueError("Positive slot width is required for width descriptors")
+        matrix[is_width] = values[is_width, None] / slot_widths
+
+    rows = numpy.flatnonzero(counts)
+    starts = starts[rows]
+    owners = numpy.repeat(numpy.arange(len(rows)), counts[rows])
+    big_enough = matrix >= densities
+
+    # The smallest of big enough densities, the first one of equal densities
+    smallest = numpy.where(big_enough, matrix, numpy.inf)
+    best = numpy.minimum.reduceat(smallest, starts, axis=0)
+    first = numpy.where(smallest == best[owners], indices, total)
+    selected = numpy.minimum.reduceat(first, starts, axis=0)
+
+    # The largest density if none is big enough
+    largest = numpy.where(big_enough, -numpy.inf, matrix)
+    fallback = numpy.maximum.reduceat(largest, starts, axis=0)
+    first = numpy.where(largest == fallback[owners], indices, total)
+    result[rows] = numpy.where(best == numpy.inf, numpy.minimum.reduceat(first, starts, axis=0), selected)
+    return result
+
+
+def parsed_candidates(srcset, options):
+    if not isinstance(srcset, SRCSet):
+        srcset = SRCSet(srcset, **options)
+    if srcset.candidates is None:
+        return srcset.parse()
+    return srcset.candidates
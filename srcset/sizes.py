@@ -0,0 +1,688 @@
+"""
+Parser and evaluator of the `sizes` attribute, based on
+https://html.spec.whatwg.org/multipage/images.html#parsing-a-sizes-attribute
+
+Media conditions and the media query lists of `<source media>` follow
+https://drafts.csswg.org/mediaqueries/#mq-syntax, the device is a screen.
+Supported features are width, height, orientation, resolution and
+-webkit-device-pixel-ratio with their min- and max- forms and the range
+syntax. Other features are unknown and never match
+"""
+from __future__ import unicode_literals
+
+import re
+from collections import namedtuple
+
+try:
+    from .srcset import binary_types
+except (ImportError, ValueError):  # modules of the package are imported directly by tests.py
+    from srcset import binary_types
+
+TOKEN_RE = re.compile(
+    r"(?P<space>[\t\n\f\r ]+|/\*.*?(?:\*/|\Z))"
+    r"|(?P<number>[+-]?(?:[0-9]+(?:\.[0-9]+)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?)(?P<unit>%|[a-zA-Z]+)?"
+    r"|(?P<function>-?[a-zA-Z_][a-zA-Z0-9_-]*)\("
+    r"|(?P<ident>-?[a-zA-Z_][a-zA-Z0-9_-]*)"
+    r"|(?P<delim><=|>=|[(),:<>=+*/-])"
+    r"|(?P<bad>.)",
+    re.S
+)
+
+# Pixels per unit, relative units are resolved by `length_px`
+ABSOLUTE_UNITS = {
+    "px": 1.0,
+    "in": 96.0,
+    "cm": 96.0 / 2.54,
+    "mm": 96.0 / 25.4,
+    "q": 96.0 / 101.6,
+    "pt": 96.0 / 72,
+    "pc": 16.0,
+}
+RELATIVE_UNITS = ("em", "rem", "ex", "ch", "vw", "vh", "vmin", "vmax")
+# Dots per CSS pixel
+RESOLUTION_UNITS = {
+    "dppx": 1.0,
+    "x": 1.0,
+    "dpi": 1.0 / 96,
+    "dpcm": 2.54 / 96,
+}
+COMPARISONS = {
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "=": lambda a, b: a == b,
+}
+FLIPPED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "="}
+SCREEN_MEDIA_TYPES = ("all", "screen")
+# A media query which never matches
+NOT_ALL = (True, "all", None)
+
+
+class Viewport(namedtuple("Viewport", ("width", "height", "density", "font_size"))):
+    """
+    Device profile. `width` and `height` are in CSS pixels, `density` is the
+    device pixel ratio, `font_size` is the initial font size in pixels
+    """
+    __slots__ = ()
+
+    def __new__(cls, width, height, density=1.0, font_size=16.0):
+        return super(Viewport, cls).__new__(cls, width, height, density, font_size)
+
+
+class SizesCache(object):
+    """
+    Memoizes parsed `sizes` attributes, media conditions evaluated for a
+    `Viewport` and the resulting slot widths, and the same for media query
+    lists. Each table is cleared when it grows over `max_entries`
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.parsed = {}
+        self.conditions = {}
+        self.widths = {}
+        self.media = {}
+
+    def parse(self, string):
+        try:
+            return self.parsed[string]
+        except KeyError:
+            pass
+        sizes = parse_sizes(string)
+        store(self.parsed, string, sizes, self.max_entries)
+        return sizes
+
+    def matches(self, condition, viewport):
+        key = (condition, viewport)
+        try:
+            return self.conditions[key]
+        except KeyError:
+            pass
+        result = evaluate_condition(condition, viewport) is True
+        store(self.conditions, key, result, self.max_entries)
+        return result
+
+    def evaluate(self, string, viewport):
+        """
+        Returns the slot width in CSS pixels
+        """
+        key = (string, viewport)
+        try:
+            return self.widths[key]
+        except KeyError:
+            pass
+        width = float(viewport.width)
+        for condition, length in self.parse(string):
+            if condition is None or self.matches(condition, viewport):
+                width = length_px(length, viewport)
+                break
+        store(self.widths, key, width, self.max_entries)
+        return width
+
+    def matches_media(self, string, viewport):
+        """
+        Checks a media query list like the `media` attribute of `<source>`
+        """
+        key = (string, viewport)
+        try:
+            return self.media[key]
+        except KeyError:
+            pass
+        result = False
+        for negated, media_type, condition in parse_media(string):
+            matches = media_type in SCREEN_MEDIA_TYPES and (
+                condition is None or self.matches(condition, viewport)
+            )
+            if matches != negated:
+                result = True
+                break
+        store(self.media, key, result, self.max_entries)
+        return result
+
+    def clear(self):
+        self.parsed.clear()
+        self.conditions.clear()
+        self.widths.clear()
+        self.media.clear()
+
+
+def store(table, key, value, max_entries):
+    if len(table) >= max_entries:
+        table.clear()
+    table[key] = value
+
+
+DEFAULT_CACHE = SizesCache()
+
+
+def evaluate_sizes(string, viewport, cache=DEFAULT_CACHE):
+    """
+    Returns the slot width in CSS pixels which `string` gives for `viewport`,
+    `100vw` if no entry matches
+    """
+    return cache.evaluate(string, viewport)
+
+
+def parse_sizes(string):
+    """
+    Returns a tuple of (condition, length) for valid entries of `string`,
+    `condition` is None for entries without a media condition. Both are
+    hashable tuples for `evaluate_condition` and `length_px`
+    """
+    if isinstance(string, binary_types):
+        string = string.decode("latin-1")
+    sizes = []
+    for tokens in split_commas(tokenize(string)):
+        # Step 2.2, an empty entry is skipped
+        if not tokens:
+            continue
+        # Step 2.3, the last component value is the size
+        start = block_start(tokens)
+        if start is None:
+            continue
+        length = parse_length(tokens[start:])
+        if length is None:
+            continue
+        # Step 2.4, 2.5
+        if start == 0:
+            sizes.append((None, length))
+            continue
+        condition = parse_condition(tokens[:start])
+        if condition is not None:
+            sizes.append((condition, length))
+    return tuple(sizes)
+
+
+def tokenize(string):
+    """
+    Returns a list of (type, value) tokens without whitespaces and comments.
+    Numbers are (number, (value, unit)), names are lowercased
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(string):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        if kind == "unit" or kind == "number":
+            unit = match.group("unit")
+            tokens.append(("number", (float(match.group("number")), unit.lower() if unit else "")))
+        elif kind == "function" or kind == "ident":
+            tokens.append((kind, match.group(kind).lower()))
+        else:
+            tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+def split_commas(tokens):
+    """
+    Splits `tokens` on commas outside of parentheses
+    """
+    entries = []
+    entry = []
+    depth = 0
+    for token in tokens:
+        if token == ("delim", ",") and depth == 0:
+            entries.append(entry)
+            entry = []
+            continue
+        if token[0] == "function" or token == ("delim", "("):
+            depth = depth + 1
+        elif token == ("delim", ")") and depth:
+            depth = depth - 1
+        entry.append(token)
+    entries.append(entry)
+    return entries
+
+
+def block_start(tokens):
+    """
+    Returns the index of the first token of the last component value
+    """
+    if tokens[-1] != ("delim", ")"):
+        return len(tokens) - 1
+    depth = 0
+    for i in range(len(tokens) - 1, -1, -1):
+        if tokens[i] == ("delim", ")"):
+            depth = depth + 1
+        elif tokens[i][0] == "function" or tokens[i] == ("delim", "("):
+            depth = depth - 1
+            if depth == 0:
+                return i
+    return None
+
+
+def parse_length(tokens):
+    """
+    Returns a non-negative length or None. Lengths are (value, unit) or
+    ("calc", expression)
+    """
+    if len(tokens) == 1 and tokens[0][0] == "number":
+        value, unit = tokens[0][1]
+        if value < 0:
+            return None
+        if unit == "" and value == 0:
+            return (0.0, "px")
+        if unit in ABSOLUTE_UNITS or unit in RELATIVE_UNITS:
+            return (value, unit)
+        return None
+    if tokens and tokens[0] == ("function", "calc"):
+        parser = CalcParser(tokens)
+        expression = parser.parse()
+        if expression is None or expression[0] != "length":
+            return None
+        return ("calc", expression[1])
+    return None
+
+
+class CalcParser(object):
+    """
+    Recursive descent parser of `calc()`. Nodes are ("value", number, unit)
+    and (operator, left, right), every node is returned with its type
+    "number" or "length"
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        self.pos = 1
+        result = self.sum()
+        if result is None or not self.take(("delim", ")")) or self.pos != len(self.tokens):
+            return None
+        return result
+
+    def take(self, token):
+        if self.pos < len(self.tokens) and self.tokens[self.pos] == token:
+            self.pos = self.pos + 1
+            return True
+        return False
+
+    def sum(self):
+        left = self.product()
+        while left is not None:
+            for operator in ("+", "-"):
+                if self.take(("delim", operator)):
+                    break
+            else:
+                return left
+            right = self.product()
+            if right is None or right[0] != left[0]:
+                return None
+            left = (left[0], (operator, left[1], right[1]))
+        return None
+
+    def product(self):
+        left = self.value()
+        while left is not None:
+            for operator in ("*", "/"):
+                if self.take(("delim", operator)):
+                    break
+            else:
+                return left
+            right = self.value()
+            if right is None:
+                return None
+            if operator == "/" or left[0] == "length":
+                if right[0] != "number":
+                    return None
+                kind = left[0]
+            else:
+                kind = right[0]
+            left = (kind, (operator, left[1], right[1]))
+        return None
+
+    def value(self):
+        if self.pos >= len(self.tokens):
+            return None
+        kind, value = self.tokens[self.pos]
+        self.pos = self.pos + 1
+        if kind == "number":
+            number, unit = value
+            if unit == "":
+                return ("number", ("value", number, unit))
+            if unit in ABSOLUTE_UNITS or unit in RELATIVE_UNITS:
+                return ("length", ("value", number, unit))
+            return None
+        if (kind, value) == ("delim", "(") or (kind, value) == ("function", "calc"):
+            result = self.sum()
+            if result is None or not self.take(("delim", ")")):
+                return None
+            return result
+        return None
+
+
+def length_px(length, viewport):
+    """
+    Returns `length` in CSS pixels, negative `calc()` results are clamped to 0
+    """
+    if length[0] == "calc":
+        return max(0.0, float(evaluate_calc(length[1], viewport)))
+    value, unit = length
+    return value * unit_px(unit, viewport)
+
+
+def unit_px(unit, viewport):
+    try:
+        return ABSOLUTE_UNITS[unit]
+    except KeyError:
+        pass
+    if unit == "em" or unit == "rem":
+        return float(viewport.font_size)
+    if unit == "ex" or unit == "ch":
+        return viewport.font_size / 2.0
+    if unit == "vw":
+        return viewport.width / 100.0
+    if unit == "vh":
+        return viewport.height / 100.0
+    if unit == "vmin":
+        return min(viewport.width, viewport.height) / 100.0
+    if unit == "vmax":
+        return max(viewport.width, viewport.height) / 100.0
+    raise ValueError("Unknown unit %r" % unit)
+
+
+def evaluate_calc(node, viewport):
+    operator = node[0]
+    if operator == "value":
+        if node[2] == "":
+            return node[1]
+        return node[1] * unit_px(node[2], viewport)
+    left = evaluate_calc(node[1], viewport)
+    right = evaluate_calc(node[2], viewport)
+    if operator == "+":
+        return left + right
+    if operator == "-":
+        return left - right
+    if operator == "*":
+        return left * right
+    if right == 0:
+        return 0.0
+    return left / right
+
+
+def parse_media(string):
+    """
+    Returns a tuple of (negated, media type, condition) for the queries of
+    a media query list. `condition` is None if there is no condition,
+    invalid queries are `NOT_ALL`. An empty list matches everything
+    """
+    if isinstance(string, binary_types):
+        string = string.decode("latin-1")
+    tokens = tokenize(string)
+    if not tokens:
+        return ((False, "all", None),)
+    return tuple(parse_media_query(query) for query in split_commas(tokens))
+
+
+def parse_media_query(tokens):
+    if not tokens:
+        return NOT_ALL
+    kind, value = tokens[0]
+    if kind != "ident" or (value == "not" and tokens[1:2] and tokens[1][0] != "ident"):
+        # <media-condition>
+        condition = parse_condition(tokens)
+        return NOT_ALL if condition is None else (False, "all", condition)
+
+    negated = value == "not"
+    if value in ("not", "only"):
+        tokens = tokens[1:]
+        if not tokens or tokens[0][0] != "ident":
+            return NOT_ALL
+    media_type = tokens[0][1]
+    if media_type in ("only", "not", "and", "or", "layer"):
+        return NOT_ALL
+    if len(tokens) == 1:
+        return (negated, media_type, None)
+    if tokens[1] != ("ident", "and"):
+        return NOT_ALL
+    condition = parse_condition(tokens[2:])
+    if condition is None or condition[0] == "or":
+        return NOT_ALL
+    return (negated, media_type, condition)
+
+
+def parse_condition(tokens):
+    """
+    Returns a media condition or None if `tokens` are not valid. Conditions
+    are ("not", condition), ("and", conditions), ("or", conditions),
+    ("feature", name, comparisons) or ("unknown",)
+    """
+    parser = ConditionParser(tokens)
+    condition = parser.condition()
+    if condition is None or parser.pos != len(tokens):
+        return None
+    return condition
+
+
+class ConditionParser(object):
+    """
+    Recursive descent parser of <media-condition>
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def take(self, token):
+        if self.peek() == token:
+            self.pos = self.pos + 1
+            return True
+        return False
+
+    def condition(self):
+        if self.take(("ident", "not")):
+            condition = self.in_parens()
+            return None if condition is None else ("not", condition)
+        first = self.in_parens()
+        if first is None:
+            return None
+        for keyword in ("and", "or"):
+            if self.peek() == ("ident", keyword):
+                break
+        else:
+            return first
+        conditions = [first]
+        while self.take(("ident", keyword)):
+            condition = self.in_parens()
+            if condition is None:
+                return None
+            conditions.append(condition)
+        return (keyword, tuple(conditions))
+
+    def in_parens(self):
+        start = self.pos
+        token = self.peek()
+        if token is not None and token[0] == "function":
+            return self.general_enclosed(start)
+        if not self.take(("delim", "(")):
+            return None
+        # <media-feature>
+        feature = self.feature()
+        if feature is not None and self.take(("delim", ")")):
+            return feature
+        # ( <media-condition> )
+        self.pos = start + 1
+        condition = self.condition()
+        if condition is not None and self.take(("delim", ")")):
+            return condition
+        return self.general_enclosed(start)
+
+    def general_enclosed(self, start):
+        """
+        Anything in matching parentheses is valid but unknown
+        """
+        self.pos = start
+        depth = 0
+        while self.pos < len(self.tokens):
+            token = self.tokens[self.pos]
+            self.pos = self.pos + 1
+            if token[0] == "function" or token == ("delim", "("):
+                depth = depth + 1
+            elif token == ("delim", ")"):
+                depth = depth - 1
+                if depth == 0:
+                    return ("unknown",)
+            elif token[0] == "bad":
+                return None
+        return None
+
+    def feature(self):
+        """
+        Returns ("feature", name, comparisons), `comparisons` is a tuple of
+        (operator, value) applied as `feature operator value`, empty for a
+        boolean feature
+        """
+        token = self.peek()
+        if token is None:
+            return None
+        if token[0] == "ident":
+            name = token[1]
+            self.pos = self.pos + 1
+            # <mf-plain>
+            if self.take(("delim", ":")):
+                value = self.feature_value()
+                if value is None:
+                    return None
+                for prefix, operator in (("min-", ">="), ("max-", "<=")):
+                    if name.startswith(prefix):
+                        return ("feature", name[len(prefix):], ((operator, value),))
+                return ("feature", name, (("=", value),))
+            # <mf-boolean>
+            operator = self.comparison()
+            if operator is None:
+                return ("feature", name, ())
+            # <mf-range> name op value
+            value = self.feature_value()
+            if value is None:
+                return None
+            return ("feature", name, ((operator, value),))
+
+        # <mf-range> value op name [op value]
+        value = self.feature_value()
+        operator = self.comparison()
+        token = self.peek()
+        if value is None or operator is None or token is None or token[0] != "ident":
+            return None
+        name = token[1]
+        self.pos = self.pos + 1
+        comparisons = [(FLIPPED[operator], value)]
+        second = self.comparison()
+        if second is not None:
+            if (operator[0] == "<") != (second[0] == "<") or "=" in (operator, second):
+                return None
+            value = self.feature_value()
+            if value is None:
+                return None
+            comparisons.append((second, value))
+        return ("feature", name, tuple(comparisons))
+
+    def comparison(self):
+        token = self.peek()
+        if token is not None and token[0] == "delim" and token[1] in COMPARISONS:
+            self.pos = self.pos + 1
+            return token[1]
+        return None
+
+    def feature_value(self):
+        """
+        Returns ("length", length), ("resolution", dppx), ("number", value)
+        or ("ident", name)
+        """
+        token = self.peek()
+        if token is None:
+            return None
+        kind, value = token
+        if kind == "ident":
+            self.pos = self.pos + 1
+            return ("ident", value)
+        if kind == "number":
+            self.pos = self.pos + 1
+            number, unit = value
+            if unit == "":
+                return ("number", number)
+            if unit in RESOLUTION_UNITS:
+                return ("resolution", number * RESOLUTION_UNITS[unit])
+            if unit in ABSOLUTE_UNITS or unit in RELATIVE_UNITS:
+                return ("length", (number, unit))
+            return None
+        if token == ("function", "calc"):
+            depth = 0
+            for end in range(self.pos, len(self.tokens)):
+                if self.tokens[end][0] == "function" or self.tokens[end] == ("delim", "("):
+                    depth = depth + 1
+                elif self.tokens[end] == ("delim", ")"):
+                    depth = depth - 1
+                    if depth == 0:
+                        break
+            length = parse_length(self.tokens[self.pos:end + 1])
+            if length is None:
+                return None
+            self.pos = end + 1
+            return ("length", length)
+        return None
+
+
+def evaluate_condition(condition, viewport):
+    """
+    Returns True, False or None for unknown, which is false in the end
+    """
+    kind = condition[0]
+    if kind == "not":
+        result = evaluate_condition(condition[1], viewport)
+        return None if result is None else not result
+    if kind == "and":
+        results = [evaluate_condition(item, viewport) for item in condition[1]]
+        if False in results:
+            return False
+        return None if None in results else True
+    if kind == "or":
+        results = [evaluate_condition(item, viewport) for item in condition[1]]
+        if True in results:
+            return True
+        return None if None in results else False
+    if kind == "feature":
+        return evaluate_feature(condition[1], condition[2], viewport)
+    return None
+
+
+def evaluate_feature(name, comparisons, viewport):
+    if name in ("width", "height"):
+        actual = float(viewport.width if name == "width" else viewport.height)
+        kind = "length"
+    elif name == "resolution":
+        actual = float(viewport.density)
+        kind = "resolution"
+    elif name == "-webkit-device-pixel-ratio":
+        actual = float(viewport.density)
+        kind = "number"
+    elif name == "orientation":
+        if not comparisons:
+            return True
+        if len(comparisons) != 1 or comparisons[0][0] != "=" or comparisons[0][1][0] != "ident":
+            return None
+        orientation = "portrait" if viewport.height >= viewport.width else "landscape"
+        return comparisons[0][1][1] == orientation
+    else:
+        return None
+
+    if not comparisons:
+        return actual != 0
+    for operator, value in comparisons:
+        if value[0] == "number" and kind == "length" and value[1] == 0:
+            expected = 0.0
+        elif value[0] != kind:
+            return None
+        elif kind == "length":
+            expected = length_px(value[1], viewport)
+        else:
+            expected = value[1]
+        if not COMPARISONS[operator](actual, expected):
+            return False
+    return True
@@ -1,6 +1,28 @@
 from __future__ import unicode_literals
 
+import codecs
 import math
+import multiprocessing
+import re
+import sys
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+
+try:
+    string_types = basestring  # noqa: F821
+except NameError:
+    string_types = str
+
+# Python 2 parses `str` as it is, Python 3 accepts bytes-like input as well
+if str is bytes:
+    binary_types = ()
+else:
+    binary_types = (bytes, bytearray, memoryview)
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:  # Python 2 without the `futures` backport
+    ProcessPoolExecutor = None
 
 # See https://infra.spec.whatwg.org/#ascii-whitespace
 WHITESPACES = (
@@ -10,198 +32,887 @@ WHITESPACES = (
     "\u000D",
     "\u0020"  # " "
 )
+WHITESPACES_AND_COMMA = WHITESPACES + (",", )
 
 STATE_IN_DESCRIPTOR = 1
 STATE_AFTER_DESCRIPTOR = 2
 STATE_IN_PARENS = 3
 
+ENGINE_STATE_MACHINE = "state_machine"
+ENGINE_REGEX = "regex"
+
+# Long runs of digits are validated without int(), which is quadratic in
+# the number of digits
+MAX_INT_DIGITS = 18
+
+# Descriptor values are ASCII, float() and int() also take other Unicode
+# digits and whitespaces, which the bytes path never sees
+try:
+    is_ascii = str.isascii
+except AttributeError:  # Python 2 and before 3.7
+    ASCII_RE = re.compile(r"[\x00-\x7f]*\Z")
+
+    def is_ascii(value):
+        return ASCII_RE.match(value) is not None
+
+# Step 4 - 8, a whole candidate in one match. Whitespaces and commas are
+# skipped and group 1 collects the URL. If it ends with a comma there are no
+# descriptors (step 8.1). Otherwise group 2 is the only descriptor in the
+# common case, or group 3 is everything up to the first comma which is not
+# inside of parens (step 8.e). No match means the end of the string
+CANDIDATE_RE = re.compile(
+    r"[\t\n\f\r ,]*([^\t\n\f\r ,][^\t\n\f\r ]*)"
+    r"(?:(?<=,)"
+    r"|[\t\n\f\r ]*(?:([^\t\n\f\r ,(]+)[\t\n\f\r ]*(?:,|\Z)|((?:[^,(]+|\([^)]*\)?)*),?))"
+)
+# A single descriptor inside of group 3 of CANDIDATE_RE
+DESCRIPTOR_RE = re.compile(r"(?:[^\t\n\f\r ,(]+|\([^)]*\)?)+")
+# Same expressions for bytes-like input, all delimiters are ASCII
+CANDIDATE_RE_BINARY = re.compile(CANDIDATE_RE.pattern.encode("ascii"))
+DESCRIPTOR_RE_BINARY = re.compile(DESCRIPTOR_RE.pattern.encode("ascii"))
+
+# Results of validating a single descriptor by the regex engine, keyed on
+# the descriptor. Real srcsets repeat a few hundred of them, the memos are
+# cleared when they grow over MAX_DESCRIPTOR_VALUES
+DESCRIPTOR_VALUES = {}
+TYPED_DESCRIPTOR_VALUES = {}
+MAX_DESCRIPTOR_VALUES = 1024
+
+# Separator and descriptor formats of `stringify`
+TEXT_FORMATS = (", ", "%s %sw", "%s %sx", "%s %sh")
+BINARY_FORMATS = (b", ", b"%s %sw", b"%s %sx", b"%s %sh")
+
+
+class LimitExceeded(ValueError):
+    """
+    Raised as soon as the input goes over one of the configured limits
+    """
+
+
+class Candidate(namedtuple("Candidate", ("url", "w", "x", "h"))):
+    """
+    Immutable and compact alternative to the candidate dict. Fields can be
+    read by name (`candidate.url`), by key (`candidate["url"]`) or by index.
+    Use `candidate._replace(url=...)` to get a modified copy
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, string_types):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+
+class TypedCandidate(namedtuple("TypedCandidate", ("url", "w", "x", "h", "width", "density", "height"))):
+    """
+    `Candidate` which also has numbers of its descriptors: int `width` and
+    `height` and float `density`, None if missing. A `width` or `height`
+    with more than MAX_INT_DIGITS digits is an approximate float instead of
+    an int. They are computed once while validating, `w`, `x` and `h` keep
+    the original text for `stringify`
+    """
+    __slots__ = ()
+
+    __getitem__ = Candidate.__dict__["__getitem__"]
+
+
+class SpanCandidate(object):
+    """
+    Candidate which keeps `start` and `end` offsets of its URL in the parsed
+    string instead of a copy of it. The URL is sliced out only when it is
+    accessed, `url_startswith` and `url_length` do not copy it at all
+    """
+    __slots__ = ("raw", "start", "end", "w", "x", "h")
+
+    def __init__(self, raw, start, end, w, x, h):
+        self.raw = raw
+        self.start = start
+        self.end = end
+        self.w = w
+        self.x = x
+        self.h = h
+
+    @property
+    def url(self):
+        return self.raw[self.start:self.end]
+
+    @property
+    def url_length(self):
+        return self.end - self.start
+
+    def url_startswith(self, prefix):
+        if isinstance(self.raw, memoryview):
+            # memoryview has no startswith(), comparing a slice of it does not copy
+            return (
+                len(prefix) <= self.end - self.start and
+                self.raw[self.start:self.start + len(prefix)] == prefix
+            )
+        return self.raw.startswith(prefix, self.start, self.end)
+
+    def __getitem__(self, key):
+        if key not in ("url", "w", "x", "h"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if not isinstance(other, SpanCandidate):
+            return NotImplemented
+        return (self.url, self.w, self.x, self.h) == (other.url, other.w, other.x, other.h)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "SpanCandidate(start=%r, end=%r, w=%r, x=%r, h=%r)" % (
+            self.start, self.end, self.w, self.x, self.h
+        )
+
+
+def candidate_dict(string, start, end, w, x, h):
+    return {
+        "url": string[start:end],
+        "w": w,
+        "x": x,
+        "h": h
+    }
+
+
+def compact_candidate(string, start, end, w, x, h):
+    return Candidate(string[start:end], w, x, h)
+
+
+def candidate_values(string, start, end, w, x, h):
+    return start, end, w, x, h
+
+
+def typed_candidate(string, start, end, w, x, h, width, density, height):
+    return TypedCandidate(string[start:end], w, x, h, width, density, height)
+
+
+def typed_values(string, start, end, w, x, h, width, density, height):
+    return start, end, w, x, h, width, density, height
+
+
+# Factories which take numbers of descriptors after their text
+TYPED_FACTORIES = frozenset((typed_candidate, typed_values))
+
+
+class ParseCache(object):
+    """
+    Bounded LRU cache of parse results keyed on the raw attribute string.
+
+    Entries keep only offsets and descriptor values, every hit builds new
+    candidates, so callers are free to mutate what they get
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def parse(self, string, engine, max_candidates, max_descriptors, factory):
+        typed = factory in TYPED_FACTORIES
+        # bytearray and writable memoryview are not hashable, their offsets
+        # are the same as of their bytes
+        if isinstance(string, (bytearray, memoryview)):
+            key = (bytes(string), engine, max_candidates, max_descriptors, typed)
+        else:
+            key = (string, engine, max_candidates, max_descriptors, typed)
+        try:
+            values, size = self.entries.pop(key)
+        except KeyError:
+            self.misses = self.misses + 1
+            values = tuple(PARSERS[engine](
+                string, max_candidates, max_descriptors, typed_values if typed else candidate_values
+            ))
+            size = sys.getsizeof(key[0]) + sum(sys.getsizeof(value) for value in values)
+            self.size = self.size + size
+        else:
+            self.hits = self.hits + 1
+        # The most recently used entry is always the last one
+        self.entries[key] = (values, size)
+        self.evict()
+        return [factory(string, *value) for value in values]
+
+    def evict(self):
+        while self.entries and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries) or
+            (self.max_bytes is not None and self.size > self.max_bytes)
+        ):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size = self.size - size
+            self.evictions = self.evictions + 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
 
 class SRCSet(object):
     raw = None
     candidates = None
+    engine = ENGINE_STATE_MACHINE
+    # Produce `Candidate` instead of dicts
+    compact = False
+    # Produce `SpanCandidate` instead of dicts
+    spans = False
+    # Produce `TypedCandidate` instead of dicts
+    typed = False
+    # Limits for untrusted input, None means unlimited
+    max_length = None
+    max_candidates = None
+    max_descriptors = None
+    # `ParseCache` shared between instances
+    cache = None
 
-    def __init__(self, string):
+    def __init__(self, string, engine=None, max_length=None, max_candidates=None, max_descriptors=None,
+                 compact=None, spans=None, cache=None, typed=None):
         self.raw = string
+        if cache is not None:
+            self.cache = cache
+        if engine is not None:
+            self.engine = engine
+        if compact is not None:
+            self.compact = compact
+        if spans is not None:
+            self.spans = spans
+        if typed is not None:
+            self.typed = typed
+        if max_length is not None:
+            self.max_length = max_length
+        if max_candidates is not None:
+            self.max_candidates = max_candidates
+        if max_descriptors is not None:
+            self.max_descriptors = max_descriptors
 
     def parse(self):
         """
         Based on algorithm from https://html.spec.whatwg.org/multipage/images.html#parse-a-srcset-attribute
         """
-        # Step 1, 2, 3
+        check_length(self.raw, self.max_length)
+        if self.cache is None:
+            # Same as list(self.iter_candidates()) without resuming a generator
+            # for every candidate
+            candidates = PARSERS[self.engine](
+                self.raw,
+                self.max_candidates,
+                self.max_descriptors,
+                self.factory
+            )
+        else:
+            candidates = self.cache.parse(
+                self.raw,
+                self.engine,
+                self.max_candidates,
+                self.max_descriptors,
+                self.factory
+            )
+        self.candidates = candidates
+        return candidates
+
+    def iter_candidates(self):
+        """
+        Yields candidates one by one as soon as their descriptors are validated.
+        The rest of the string is not tokenized until the next candidate is requested
+        """
+        return self.iter_with(self.factory)
+
+    def iter_with(self, factory):
+        """
+        Same as `iter_candidates`, but candidates are built by `factory`
+        """
+        check_length(self.raw, self.max_length)
+        return ENGINES[self.engine](
+            self.raw,
+            self.max_candidates,
+            self.max_descriptors,
+            factory
+        )
+
+    def rewrite_urls(self, callback):
+        """
+        Returns `raw` with the URL of every valid candidate replaced by
+        `callback(url)`. Everything else, including whitespaces and invalid
+        candidates, is copied as it is. If no URL is changed, `raw` itself
+        is returned
+        """
+        raw = self.raw
+        if self.cache is None:
+            values = self.iter_with(candidate_values)
+        else:
+            check_length(raw, self.max_length)
+            values = self.cache.parse(
+                raw,
+                self.engine,
+                self.max_candidates,
+                self.max_descriptors,
+                candidate_values
+            )
+        parts = []
         pos = 0
-        candidates = []
-        state = None
+        for start, end, _, _, _ in values:
+            url = raw[start:end]
+            new_url = callback(url)
+            if new_url != url:
+                parts.append(raw[pos:start])
+                parts.append(new_url)
+                pos = end
+        if not parts:
+            return raw
+        parts.append(raw[pos:])
+        if isinstance(raw, binary_types):
+            return b"".join(parts)
+        return raw[:0].join(parts)
 
-        # Step 4
+    @property
+    def factory(self):
+        if not (self.spans or self.typed or self.compact):
+            return candidate_dict
+        if bool(self.spans) + bool(self.typed) + bool(self.compact) > 1:
+            raise ValueError("Only one of compact, spans and typed can be set")
+        if self.spans:
+            return SpanCandidate
+        if self.typed:
+            return typed_candidate
+        if self.compact:
+            return compact_candidate
+        return candidate_dict
+
+    @property
+    def formats(self):
+        if isinstance(self.raw, binary_types):
+            return BINARY_FORMATS
+        return TEXT_FORMATS
+
+    def stringify(self):
+        """
+        Returns string which is a valid srcset attribute, bytes for bytes-like input
+        """
+        formats = self.formats
+        return formats[0].join([stringify_candidate(item, formats) for item in self.candidates])
+
+    def write_to(self, writer):
+        """
+        Writes the same string as `stringify` into `writer` piece by piece.
+        `writer` is a file-like object or a list of chunks
+        """
+        if isinstance(writer, list):
+            write = writer.append
+        else:
+            write = writer.write
+        formats = self.formats
+        separator = None
+        for item in self.candidates:
+            if separator:
+                write(separator)
+            else:
+                separator = formats[0]
+            write(stringify_candidate(item, formats))
+
+
+def stringify_candidate(item, formats=TEXT_FORMATS):
+    """
+    Returns a single candidate of the srcset attribute
+    """
+    result = item["url"]
+    if item["w"]:
+        result = formats[1] % (result, item["w"])
+    if item["x"]:
+        result = formats[2] % (result, item["x"])
+    if item["h"]:
+        result = formats[3] % (result, item["h"])
+    return result
+
+
+def parse_many(strings, instances=False, **options):
+    """
+    Parses all `strings` in one loop. `options` are the same as for `SRCSet`,
+    they are resolved once for the whole batch. Returns a list of candidate
+    lists, or a list of parsed `SRCSet` objects if `instances` is set
+    """
+    result = []
+    append = result.append
+    if instances:
+        for string in strings:
+            obj = SRCSet(string, **options)
+            obj.parse()
+            append(obj)
+        return result
+
+    template = SRCSet(None, **options)
+    max_length = template.max_length
+    max_candidates = template.max_candidates
+    max_descriptors = template.max_descriptors
+    factory = template.factory
+    if template.cache is not None:
+        engine = template.engine
+        cached_parse = template.cache.parse
+        for string in strings:
+            check_length(string, max_length)
+            append(cached_parse(string, engine, max_candidates, max_descriptors, factory))
+        return result
+
+    parse = PARSERS[template.engine]
+    for string in strings:
+        check_length(string, max_length)
+        append(parse(string, max_candidates, max_descriptors, factory))
+    return result
+
+
+def parse_parallel(strings, workers=None, chunk_size=1000, **options):
+    """
+    Same as `parse_many`, but the work is spread over a pool of processes
+    """
+    return list(iter_parse_parallel(strings, workers, chunk_size, **options))
+
+
+def iter_parse_parallel(strings, workers=None, chunk_size=1000, **options):
+    """
+    Parses `strings` in chunks of `chunk_size` in a `ProcessPoolExecutor` with
+    `workers` processes and yields candidate lists in the input order.
+
+    Workers send back only URL offsets and descriptor values, candidates are
+    built from the original strings in the calling process. Only a couple of
+    chunks per worker are in flight, so `strings` can be an endless iterator
+    """
+    if ProcessPoolExecutor is None:
+        raise ImportError("parallel parsing requires concurrent.futures")
+    if options.get("cache") is not None:
+        raise ValueError("cache can not be shared between processes")
+    template = SRCSet(None, **options)
+    factory = template.factory
+    limits = (
+        template.engine,
+        template.max_length,
+        template.max_candidates,
+        template.max_descriptors,
+        factory in TYPED_FACTORIES
+    )
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    strings = iter(strings)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        max_pending = 2 * workers
         while True:
-            pos, _ = collect_characters_in(self.raw, pos, WHITESPACES + (",", ))
+            while len(pending) < max_pending:
+                chunk = list(islice(strings, chunk_size))
+                if not chunk:
+                    break
+                pending.append((chunk, executor.submit(parse_chunk, chunk, *limits)))
+            if not pending:
+                return
+            chunk, future = pending.popleft()
+            for string, values in zip(chunk, future.result()):
+                yield [factory(string, *value) for value in values]
 
-            # Step 5
-            if pos >= len(self.raw):
-                # The only one place where we leave the loop
-                self.candidates = candidates
-                return candidates
 
-            # Step 6
-            pos, url = collect_characters_out(self.raw, pos, WHITESPACES)
+def parse_chunk(strings, engine, max_length, max_candidates, max_descriptors, typed=False):
+    """
+    Runs in a worker process of `iter_parse_parallel`
+    """
+    parse = PARSERS[engine]
+    factory = typed_values if typed else candidate_values
+    result = []
+    for string in strings:
+        check_length(string, max_length)
+        result.append(tuple(parse(string, max_candidates, max_descriptors, factory)))
+    return result
 
-            # Step 7
-            descriptors = []
 
-            # Step 8.1
-            if url[-1] == ",":
-                while len(url) and url[-1] == ",":
-                    url = url[:-1]
-                # JUMP to descriptor parser
-            else:
-                # Step 8.e.1
-                pos, _ = collect_characters_in(self.raw, pos, WHITESPACES)
+def check_length(string, max_length):
+    if max_length is not None and len(string) > max_length:
+        raise LimitExceeded("srcset is longer than %s characters" % max_length)
 
-                # Step 8.e.2
-                current_descriptor = ""
-                state = STATE_IN_DESCRIPTOR
 
-                # Step 8.e.4
-                while True:
-                    if pos < len(self.raw):
-                        cc = self.raw[pos]
-                    else:
-                        cc = None
-                    if state == STATE_IN_DESCRIPTOR:
-                        if cc in WHITESPACES:
-                            if current_descriptor:
-                                descriptors.append(current_descriptor)
-                                current_descriptor = ""
-                                state = STATE_AFTER_DESCRIPTOR
-                        elif cc == ",":
-                            pos = pos + 1
-                            if current_descriptor:
-                                descriptors.append(current_descriptor)
-                                # JUMP to descriptor parser
-                            break
-                        elif cc == "(":
-                            current_descriptor = current_descriptor + cc
-                            state = STATE_IN_PARENS
-                        elif cc is None:
-                            if current_descriptor:
-                                descriptors.append(current_descriptor)
-                            # JUMP to descriptor parser
-                            break
-                        else:
-                            current_descriptor = current_descriptor + cc
-                    elif state == STATE_IN_PARENS:
-                        if cc == ")":
-                            current_descriptor = current_descriptor + cc
-                            state = STATE_IN_DESCRIPTOR
-                        elif cc is None:
-                            descriptors.append(current_descriptor)
-                            # JUMP to descriptor parser
-                            break
-                        else:
-                            current_descriptor = current_descriptor + cc
-                    elif state == STATE_AFTER_DESCRIPTOR:
-                        if cc in WHITESPACES:
-                            pass
-                        elif cc is None:
+def iter_state_machine(string, max_candidates=None, max_descriptors=None, factory=candidate_dict):
+    """
+    Character by character implementation of the spec algorithm
+    """
+    # Bytes-like input is scanned as latin-1 text, offsets are the same.
+    # URLs are still sliced out of `raw`
+    raw = string
+    binary = isinstance(raw, binary_types)
+    if binary:
+        string = codecs.latin_1_decode(raw)[0]
+    typed = factory in TYPED_FACTORIES
+
+    # Step 1, 2, 3
+    pos = 0
+    state = None
+    count = 0
+    length = len(string)
+
+    # Step 4
+    while True:
+        pos, _ = collect_characters_in(string, pos, WHITESPACES_AND_COMMA)
+
+        # Step 5
+        if pos >= length:
+            # The only one place where we leave the loop
+            return
+
+        count = count + 1
+        if max_candidates is not None and count > max_candidates:
+            raise LimitExceeded("srcset has more than %s candidates" % max_candidates)
+
+        # Step 6
+        url_start = pos
+        pos, _ = collect_characters_out(string, pos, WHITESPACES)
+        url_end = pos
+
+        # Step 7
+        descriptors = []
+
+        # Step 8.1
+        if string[url_end - 1] == ",":
+            url_end = rstrip_commas(string, url_start, url_end)
+            # JUMP to descriptor parser
+        else:
+            # Step 8.e.1
+            pos, _ = collect_characters_in(string, pos, WHITESPACES)
+
+            # Step 8.e.2
+            # The current descriptor is always string[start:pos], it is sliced
+            # out once instead of being built one character at a time
+            start = pos
+            state = STATE_IN_DESCRIPTOR
+
+            # Step 8.e.4
+            while True:
+                if pos < length:
+                    cc = string[pos]
+                else:
+                    cc = None
+                if state == STATE_IN_DESCRIPTOR:
+                    if cc in WHITESPACES:
+                        if pos > start:
+                            descriptors.append(string[start:pos])
+                            state = STATE_AFTER_DESCRIPTOR
+                        start = pos + 1
+                    elif cc == ",":
+                        if pos > start:
+                            descriptors.append(string[start:pos])
                             # JUMP to descriptor parser
-                            break
-                        else:
-                            state = STATE_IN_DESCRIPTOR
-                            pos = pos - 1
-                    pos = pos + 1
-
-            # Step 9, 10, 11, 12 (descriptor parser)
-            error = False
-            width = None
-            density = None
-            h = None
-
-            # Step 13
-            # print("Descriptors", descriptors)
-            for descriptor in descriptors:
-                if len(descriptor) >= 2:
-                    last_char = descriptor[-1]
-                    value = descriptor[:-1]
-                    if last_char == "w":
-                        try:
-                            conv_value = int(value)
-                        except ValueError:
-                            error = True
-                        else:
-                            if width or density:
-                                error = True
-                            elif conv_value <= 0:
-                                error = True
-                            elif not value.isdigit():
-                                error = True
-                            else:
-                                width = value
-                    elif last_char == "x":
-                        try:
-                            conv_value = float(value)
-                        except ValueError:
-                            error = True
-                        else:
-                            if width or density or h:
-                                error = True
-                            elif conv_value < 0:
-                                error = True
-                            elif value[-1] == ".":
-                                error = True
-                            elif value[0] == "+":
-                                error = True
-                            elif math.isinf(conv_value):
-                                error = True
-                            elif math.isnan(conv_value):
-                                error = True
-                            else:
-                                density = value
-                    elif last_char == "h":
-                        try:
-                            conv_value = int(value)
-                        except ValueError:
-                            error = True
-                        else:
-                            if h or density:
-                                error = True
-                            elif conv_value <= 0:
-                                error = True
-                            elif not value.isdigit():
-                                error = True
-                            else:
-                                h = value
+                        pos = pos + 1
+                        break
+                    elif cc == "(":
+                        state = STATE_IN_PARENS
+                    elif cc is None:
+                        if pos > start:
+                            descriptors.append(string[start:pos])
+                        # JUMP to descriptor parser
+                        break
+                elif state == STATE_IN_PARENS:
+                    if cc == ")":
+                        state = STATE_IN_DESCRIPTOR
+                    elif cc is None:
+                        descriptors.append(string[start:pos])
+                        # JUMP to descriptor parser
+                        break
+                elif state == STATE_AFTER_DESCRIPTOR:
+                    if cc in WHITESPACES:
+                        pass
+                    elif cc is None:
+                        # JUMP to descriptor parser
+                        break
                     else:
-                        error = True
-                else:
-                    error = True
+                        state = STATE_IN_DESCRIPTOR
+                        start = pos
+                        pos = pos - 1
+                pos = pos + 1
 
-            if h and not width:
-                error = True
+            if max_descriptors is not None and len(descriptors) > max_descriptors:
+                raise LimitExceeded("candidate has more than %s descriptors" % max_descriptors)
 
-            if not error:
-                candidates.append({
-                    "url": url,
-                    "w": width,
-                    "x": density,
-                    "h": h
-                })
+        values = parse_descriptors(descriptors, typed)
+        if values is not None:
+            if binary:
+                values = encode_values(values)
+            yield factory(raw, url_start, url_end, *values)
 
-    def stringify(self):
-        """
-        Returns string which is a valid srcset attribute
-        """
-        result = ""
-        for item in self.candidates:
-            if result:
-                result = result + ", "
-            result = result + item["url"]
-            if item["w"]:
-                result = result + " %sw" % item["w"]
-            if item["x"]:
-                result = result + " %sx" % item["x"]
-            if item["h"]:
-                result = result + " %sh" % item["h"]
-        return result
+
+def iter_regex(string, max_candidates=None, max_descriptors=None, factory=candidate_dict):
+    """
+    Same algorithm as `iter_state_machine`, but token boundaries are found
+    by precompiled regular expressions instead of a loop over characters
+    """
+    if isinstance(string, binary_types):
+        candidate_re = CANDIDATE_RE_BINARY
+        descriptor_re = DESCRIPTOR_RE_BINARY
+        validate = parse_binary_descriptors
+        comma = b","
+    else:
+        candidate_re = CANDIDATE_RE
+        descriptor_re = DESCRIPTOR_RE
+        validate = parse_descriptors
+        comma = ","
+    typed = factory in TYPED_FACTORIES
+    memo = TYPED_DESCRIPTOR_VALUES if typed else DESCRIPTOR_VALUES
+    pos = 0
+    count = 0
+
+    while True:
+        # Step 4 - 8
+        match = candidate_re.match(string, pos)
+        if match is None:
+            return
+        pos = match.end()
+        url_start, url_end = match.span(1)
+
+        count = count + 1
+        if max_candidates is not None and count > max_candidates:
+            raise LimitExceeded("srcset has more than %s candidates" % max_candidates)
+
+        group = match.lastindex
+        if group == 2:
+            if max_descriptors is not None and max_descriptors < 1:
+                raise LimitExceeded("candidate has more than %s descriptors" % max_descriptors)
+            descriptor = match.group(2)
+            try:
+                values = memo[descriptor]
+            except KeyError:
+                values = validate([descriptor], typed)
+                if len(memo) >= MAX_DESCRIPTOR_VALUES:
+                    memo.clear()
+                memo[descriptor] = values
+        else:
+            if group == 1:
+                # Step 8.1
+                url_end = rstrip_commas(string, url_start, url_end, comma)
+                descriptors = []
+            else:
+                descriptors = descriptor_re.findall(string, match.start(3), match.end(3))
+                if max_descriptors is not None and len(descriptors) > max_descriptors:
+                    raise LimitExceeded("candidate has more than %s descriptors" % max_descriptors)
+            values = validate(descriptors, typed)
+
+        if values is not None:
+            yield factory(string, url_start, url_end, *values)
+
+
+def parse_descriptors(descriptors, typed=False):
+    """
+    Steps 9 - 15 of the algorithm. Returns (width, density, height) or None
+    if `descriptors` are not valid. With `typed` the values are followed by
+    the numbers computed while validating them: int width and height, float
+    density
+    """
+    error, values = check_descriptors(descriptors)
+    if error is not None:
+        return None
+    if typed:
+        return values
+    return values[:3]
+
+
+def check_descriptors(descriptors):
+    """
+    Validates `descriptors` like `parse_descriptors` and returns (error,
+    values). `error` names the first failing check or is None, then
+    `values` are the typed values of `parse_descriptors`
+    """
+    # Step 9, 10, 11, 12 (descriptor parser)
+    width = None
+    density = None
+    h = None
+    width_value = None
+    density_value = None
+    height_value = None
+
+    # Step 13, the first error decides the result, so the rest of the
+    # descriptors is not looked at
+    for descriptor in descriptors:
+        if len(descriptor) >= 2:
+            last_char = descriptor[-1]
+            value = descriptor[:-1]
+            if last_char == "w":
+                if width or density:
+                    return "conflicting_descriptors", None
+                width_value = parse_positive_integer(value)
+                if width_value is None:
+                    return "invalid_width", None
+                width = value
+            elif last_char == "x":
+                try:
+                    conv_value = float(value)
+                except ValueError:
+                    return "invalid_density", None
+                if width or density or h:
+                    return "conflicting_descriptors", None
+                elif conv_value < 0:
+                    return "invalid_density", None
+                elif value[-1] == ".":
+                    return "invalid_density", None
+                elif value[0] == "+":
+                    return "invalid_density", None
+                elif not is_ascii(value):
+                    return "invalid_density", None
+                elif math.isinf(conv_value):
+                    return "invalid_density", None
+                elif math.isnan(conv_value):
+                    return "invalid_density", None
+                density = value
+                density_value = conv_value
+            elif last_char == "h":
+                if h or density:
+                    return "conflicting_descriptors", None
+                height_value = parse_positive_integer(value)
+                if height_value is None:
+                    return "invalid_height", None
+                h = value
+            else:
+                return "unknown_descriptor", None
+        else:
+            return "unknown_descriptor", None
+
+    if h and not width:
+        return "height_without_width", None
+
+    return None, (width, density, h, width_value, density_value, height_value)
+
+
+def parse_binary_descriptors(descriptors, typed=False):
+    """
+    `parse_descriptors` for bytes descriptors, values are returned as bytes
+    """
+    values = parse_descriptors([descriptor.decode("latin-1") for descriptor in descriptors], typed)
+    if values is None:
+        return None
+    return encode_values(values)
+
+
+def encode_values(values):
+    """
+    Encodes descriptor values back to bytes, numbers are kept as they are
+    """
+    return tuple(value if value is None else value.encode("latin-1") for value in values[:3]) + values[3:]
+
+
+def parse_positive_integer(value):
+    """
+    Returns `value` as a positive number or None if it is not valid. Values
+    with more than MAX_INT_DIGITS digits are approximated by float
+    """
+    if not value.isdigit() or not is_ascii(value):
+        return None
+    if len(value) > MAX_INT_DIGITS:
+        value = value.lstrip("0")
+        if not value:
+            return None
+        if len(value) > MAX_INT_DIGITS:
+            return float(value)
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    if number > 0:
+        return number
+    return None
+
+
+def parse_state_machine(string, max_candidates=None, max_descriptors=None, factory=candidate_dict):
+    return list(iter_state_machine(string, max_candidates, max_descriptors, factory))
+
+
+def parse_regex(string, max_candidates=None, max_descriptors=None, factory=candidate_dict):
+    """
+    `iter_regex` which builds the list itself, without resuming a generator
+    and calling the factory of dicts for every candidate
+    """
+    if max_candidates is not None or max_descriptors is not None:
+        return list(iter_regex(string, max_candidates, max_descriptors, factory))
+    if isinstance(string, binary_types):
+        candidate_re = CANDIDATE_RE_BINARY
+        descriptor_re = DESCRIPTOR_RE_BINARY
+        validate = parse_binary_descriptors
+        comma = b","
+    else:
+        candidate_re = CANDIDATE_RE
+        descriptor_re = DESCRIPTOR_RE
+        validate = parse_descriptors
+        comma = ","
+    typed = factory in TYPED_FACTORIES
+    memo = TYPED_DESCRIPTOR_VALUES if typed else DESCRIPTOR_VALUES
+    dicts = factory is candidate_dict
+    result = []
+    append = result.append
+    pos = 0
+
+    while True:
+        match = candidate_re.match(string, pos)
+        if match is None:
+            return result
+        pos = match.end()
+        url_start, url_end = match.span(1)
+
+        group = match.lastindex
+        if group == 2:
+            descriptor = match.group(2)
+            try:
+                values = memo[descriptor]
+            except KeyError:
+                values = validate([descriptor], typed)
+                if len(memo) >= MAX_DESCRIPTOR_VALUES:
+                    memo.clear()
+                memo[descriptor] = values
+        else:
+            if group == 1:
+                url_end = rstrip_commas(string, url_start, url_end, comma)
+                descriptors = []
+            else:
+                descriptors = descriptor_re.findall(string, match.start(3), match.end(3))
+            values = validate(descriptors, typed)
+
+        if values is None:
+            continue
+        if dicts:
+            append({"url": string[url_start:url_end], "w": values[0], "x": values[1], "h": values[2]})
+        else:
+            append(factory(string, url_start, url_end, *values))
+
+
+# Generators of candidates, `iter_candidates` and `iter_with` use them
+ENGINES = {
+    ENGINE_STATE_MACHINE: iter_state_machine,
+    ENGINE_REGEX: iter_regex,
+}
+# Same results as lists, for `parse` and `parse_many`
+PARSERS = {
+    ENGINE_STATE_MACHINE: parse_state_machine,
+    ENGINE_REGEX: parse_regex,
+}
+
+
+def rstrip_commas(string, start, end, comma=","):
+    """
+    Returns the end of `string[start:end]` without trailing commas
+    """
+    while end > start and string[end - 1:end] == comma:
+        end = end - 1
+    return end
 
 
 def collect_characters_in(string, start, charset):
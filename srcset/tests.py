@@ -2,14 +2,50 @@
 Reference https://chromium.googlesource.com/chromium/src/+/66.0.3359.158/third_party/WebKit/LayoutTests/external/wpt/html/semantics/embedded-content/the-img-element/srcset/parse-a-srcset-attribute.html
 """
 
-import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-import timeit
 
-from srcset import SRCSet
-
-LOOP_SIZE = 10000
-REPEAT = 3
+import benchmark
+import corpus
+import srcset
+from scanner import Attribute, StreamRewriter, scan
+from columnar import Columns, parse_columnar
+from instrumentation import Instrumentation
+from picture import Device, Picture, Resolver, Source
+from selection import Selector, numpy, select_many
+from sizes import SizesCache, Viewport, evaluate_sizes, parse_media, parse_sizes
+from srcset import (
+    ENGINE_REGEX,
+    ENGINE_STATE_MACHINE,
+    Candidate,
+    LimitExceeded,
+    ParseCache,
+    ProcessPoolExecutor,
+    SRCSet,
+    SpanCandidate,
+    TypedCandidate,
+    parse_many,
+    parse_parallel,
+)
+
+try:
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from aio import SLICE_SIZE, rewrite_stream
+except (ImportError, SyntaxError):  # Python 2
+    rewrite_stream = None
+
+STRESS_SIZE = 2 * 1024 * 1024
+STRESS_BUDGET = 15
 
 
 class TestLoop(unittest.TestCase):
@@ -1433,30 +1469,1429 @@ class TestSpecific(unittest.TestCase):
         self.assertEqual(obj.parse(), expected)
         self.assertEqual(obj.stringify(), result)
 
+    def test_descriptor_memo(self):
+        # The regex engine keeps results of single descriptors, up to a limit
+        self.addCleanup(setattr, srcset, "MAX_DESCRIPTOR_VALUES", srcset.MAX_DESCRIPTOR_VALUES)
+        srcset.MAX_DESCRIPTOR_VALUES = 2
+        srcset.DESCRIPTOR_VALUES.clear()
+        string = "a.png 100w, b.png 200w, c.png 100w, d.png foo, e.png 2x"
+        for _ in range(2):
+            self.assertEqual(
+                [(c["url"], c["w"], c["x"]) for c in SRCSet(string, ENGINE_REGEX).parse()],
+                [("a.png", "100", None), ("b.png", "200", None), ("c.png", "100", None), ("e.png", None, "2")]
+            )
+            self.assertLessEqual(len(srcset.DESCRIPTOR_VALUES), 2)
+        self.assertEqual(SRCSet("a.png 100w", ENGINE_REGEX, typed=True).parse()[0].width, 100)
+
+    def test_non_ascii_descriptors(self):
+        # Only ASCII digits are digits, and only ASCII whitespaces separate descriptors
+        self.assertEqual(SRCSet(u"a.png \u0661x").parse(), [])
+        self.assertEqual(SRCSet(u"a.png \xa01x").parse(), [])
+        self.assertEqual(SRCSet(u"a.png \u0661\u0660w").parse(), [])
+        self.assertEqual(SRCSet(u"a.png 10w \uff11h").parse(), [])
+        self.assertEqual(len(SRCSet(u"\u20ac.png 1x").parse()), 1)
 
-def benchmark():
-    SRCSet("  data:,a  1x  , data:c qw").parse()
 
+class TestLimits(unittest.TestCase):
+    def test_length(self):
+        obj = SRCSet("data:,a 1x, data:,b 2x", max_length=10)
+        self.assertRaises(LimitExceeded, obj.parse)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "-b", "--benchmark",
-        default=False,
-        action="store_true",
-        help="Run benchmark"
+    def test_candidates(self):
+        obj = SRCSet("data:,a 1x, data:,b 2x, data:,c 3x", max_candidates=2)
+        self.assertRaises(LimitExceeded, obj.parse)
+
+    def test_candidates_invalid(self):
+        obj = SRCSet("data:,a foo, data:,b bar, data:,c baz", max_candidates=2)
+        self.assertRaises(LimitExceeded, obj.parse)
+
+    def test_descriptors(self):
+        obj = SRCSet("data:,a 1x 1x 1x", max_descriptors=2)
+        self.assertRaises(LimitExceeded, obj.parse)
+
+    def test_within_limits(self):
+        string = "data:,a 1x, data:,b 2x"
+        expected = [{
+            "url": "data:,a",
+            "x": "1",
+            "w": None,
+            "h": None
+        }, {
+            "url": "data:,b",
+            "x": "2",
+            "w": None,
+            "h": None
+        }]
+        obj = SRCSet(string, max_length=len(string), max_candidates=2, max_descriptors=1)
+        self.assertEqual(obj.parse(), expected)
+
+
+class TestCompact(unittest.TestCase):
+    def test_candidates(self):
+        string = "data:,a 1x, data:,b 100w 50h"
+        expected = [
+            Candidate("data:,a", None, "1", None),
+            Candidate("data:,b", "100", None, "50"),
+        ]
+        obj = SRCSet(string, compact=True)
+        self.assertEqual(obj.parse(), expected)
+        self.assertEqual(obj.stringify(), "data:,a 1x, data:,b 100w 50h")
+
+    def test_access(self):
+        candidate = SRCSet("data:,a 100w", compact=True).parse()[0]
+        self.assertEqual(candidate["url"], "data:,a")
+        self.assertEqual(candidate.w, "100")
+        self.assertEqual(candidate[2], None)
+        self.assertRaises(KeyError, lambda: candidate["foo"])
+
+    def test_immutable(self):
+        obj = SRCSet("data:,a 100w", compact=True)
+        obj.parse()
+
+        def assign():
+            obj.candidates[0]["w"] = "200"
+        self.assertRaises(TypeError, assign)
+        obj.candidates[0] = obj.candidates[0]._replace(w="200")
+        self.assertEqual(obj.stringify(), "data:,a 200w")
+
+    def test_slots(self):
+        candidate = SRCSet("data:,a 100w", compact=True).parse()[0]
+        self.assertRaises(AttributeError, setattr, candidate, "foo", "bar")
+
+
+class TestTyped(unittest.TestCase):
+    def test_values(self):
+        obj = SRCSet("a.png 100w 50h, b.png 1.5x, c.png, d.png 02w", typed=True)
+        self.assertEqual(obj.parse(), [
+            TypedCandidate("a.png", "100", None, "50", 100, None, 50),
+            TypedCandidate("b.png", None, "1.5", None, None, 1.5, None),
+            TypedCandidate("c.png", None, None, None, None, None, None),
+            TypedCandidate("d.png", "02", None, None, 2, None, None),
+        ])
+        self.assertIsInstance(obj.candidates[0].width, int)
+        self.assertIsInstance(obj.candidates[1].density, float)
+        self.assertEqual(obj.candidates[0]["width"], 100)
+        self.assertEqual(obj.candidates[0]["url"], "a.png")
+
+    def test_round_trip(self):
+        string = "a.png 100w 50h, b.png 1.50x, c.png, d.png 02w, e.png 1e1x"
+        obj = SRCSet(string, typed=True)
+        obj.parse()
+        self.assertEqual(obj.stringify(), string)
+        self.assertEqual(obj.candidates[4].density, 10.0)
+
+    def test_conflicting_types(self):
+        self.assertRaises(ValueError, SRCSet("a.png", typed=True, spans=True).parse)
+        self.assertRaises(ValueError, SRCSet("a.png", typed=True, compact=True).parse)
+        self.assertRaises(ValueError, parse_many, ["a.png"], spans=True, compact=True)
+
+    def test_long_values(self):
+        candidates = SRCSet("a.png " + "0" * 30 + "7w, b.png 1" + "0" * 30 + "w", typed=True).parse()
+        self.assertEqual(candidates[0].width, 7)
+        self.assertEqual(candidates[1].width, 1e30)
+        self.assertIsInstance(candidates[1].width, float)
+
+    def test_same_as_untyped(self):
+        string = "a.png 100w 50h, b.png 1.5x, bad.png 1x 2x, c.png, d.png 0w"
+        self.assertEqual(
+            [candidate[:4] for candidate in SRCSet(string, typed=True).parse()],
+            list(SRCSet(string, compact=True).parse())
+        )
+
+    def test_cache(self):
+        cache = ParseCache()
+        string = "a.png 100w, b.png 200w"
+        self.assertEqual(SRCSet(string, cache=cache, compact=True).parse()[0], Candidate("a.png", "100", None, None))
+        self.assertEqual(SRCSet(string, cache=cache, typed=True).parse()[0].width, 100)
+        self.assertEqual(SRCSet(string, cache=cache, typed=True).parse()[1].width, 200)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    @unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+    def test_binary(self):
+        candidate = SRCSet(b"a.png 100w 50h", typed=True).parse()[0]
+        self.assertEqual(candidate, TypedCandidate(b"a.png", b"100", None, b"50", 100, None, 50))
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "concurrent.futures is not available")
+    def test_parallel(self):
+        strings = ["a.png %sw" % i for i in range(1, 50)]
+        result = parse_parallel(strings, workers=2, chunk_size=10, typed=True)
+        self.assertEqual([candidates[0].width for candidates in result], list(range(1, 50)))
+
+
+class TestSpans(unittest.TestCase):
+    def test_offsets(self):
+        string = "  data:,a,, 1x, data:,b 100w 50h"
+        obj = SRCSet(string, spans=True)
+        candidates = obj.parse()
+        self.assertEqual([(c.start, c.end) for c in candidates], [(2, 9), (12, 14), (16, 23)])
+        self.assertEqual([c["url"] for c in candidates], ["data:,a", "1x", "data:,b"])
+        self.assertEqual(candidates[2].w, "100")
+        self.assertEqual(candidates[2]["h"], "50")
+        self.assertRaises(KeyError, lambda: candidates[2]["start"])
+        self.assertEqual(obj.stringify(), "data:,a, 1x, data:,b 100w 50h")
+
+    def test_same_as_dicts(self):
+        strings = (
+            "data:,a 1x, data:,b 2x",
+            "data:,a (x y) 1w, data:,b",
+            ",,data:,a,,,data:,b 1h 1w",
+            "data:,a 1w 1h, data:,b foo, data:,c 0.5x",
+        )
+        for string in strings:
+            spans = SRCSet(string, spans=True).parse()
+            dicts = SRCSet(string).parse()
+            self.assertEqual(
+                [{"url": c.url, "w": c.w, "x": c.x, "h": c.h} for c in spans],
+                dicts
+            )
+
+    def test_no_copy(self):
+        candidate = SRCSet("data:image/png;base64,AAAA 2x", spans=True).parse()[0]
+        self.assertTrue(candidate.url_startswith("data:"))
+        self.assertFalse(candidate.url_startswith("https:"))
+        self.assertEqual(candidate.url_length, 26)
+        self.assertEqual(candidate, SpanCandidate(candidate.raw, 0, 26, None, "2", None))
+
+
+class TestIterCandidates(unittest.TestCase):
+    def test_iter(self):
+        string = "data:,a 1x, data:,b foo, data:,c 2x"
+        obj = SRCSet(string)
+        self.assertEqual([c["url"] for c in obj.iter_candidates()], ["data:,a", "data:,c"])
+        self.assertEqual(obj.candidates, None)
+
+    def test_early_termination(self):
+        # The third candidate goes over the limit, but it is never tokenized
+        obj = SRCSet("data:,a 100w, data:,b 500w, data:,c 1000w", max_candidates=2)
+        first = next(c for c in obj.iter_candidates() if int(c["w"]) >= 300)
+        self.assertEqual(first["url"], "data:,b")
+        self.assertRaises(LimitExceeded, obj.parse)
+
+    def test_length_limit(self):
+        obj = SRCSet("data:,a 1x", max_length=5)
+        self.assertRaises(LimitExceeded, obj.iter_candidates)
+
+    def test_same_as_parse(self):
+        # parse() builds its list without the generator
+        string = " data:,a 1x,, data:,b foo, /c.png,/d.png 100w 50h , /e.png (x, y) 2x, /f.png"
+        for options in ({}, {"compact": True}, {"typed": True}, {"spans": True}, {"max_candidates": 10},
+                        {"max_descriptors": 3}):
+            self.assertEqual(SRCSet(string, **options).parse(), list(SRCSet(string, **options).iter_candidates()))
+        self.assertEqual(len(SRCSet(string).parse()), 3)
+
+
+class TestParseMany(unittest.TestCase):
+    strings = ("data:,a 1x, data:,b 2x", "", "data:,c foo", "data:,d 100w")
+
+    def test_lists(self):
+        expected = [SRCSet(string).parse() for string in self.strings]
+        self.assertEqual(parse_many(self.strings), expected)
+        self.assertEqual(parse_many(iter(self.strings)), expected)
+
+    def test_instances(self):
+        result = parse_many(self.strings, instances=True, compact=True)
+        self.assertEqual([obj.raw for obj in result], list(self.strings))
+        self.assertEqual(result[0].candidates[1], Candidate("data:,b", None, "2", None))
+        self.assertEqual(result[0].stringify(), "data:,a 1x, data:,b 2x")
+
+    def test_options(self):
+        result = parse_many(self.strings, compact=True)
+        self.assertEqual(result[3], [Candidate("data:,d", "100", None, None)])
+        self.assertRaises(LimitExceeded, parse_many, self.strings, max_candidates=1)
+        self.assertRaises(LimitExceeded, parse_many, self.strings, max_length=11)
+
+    def test_engine(self):
+        self.assertEqual(
+            parse_many(self.strings, engine=ENGINE_REGEX),
+            parse_many(self.strings, engine=ENGINE_STATE_MACHINE)
+        )
+
+
+class TestColumnar(unittest.TestCase):
+    strings = [
+        "a.png 100w, b.png 200w 50h",
+        "",
+        "c.png, d.png 1.5x, bad.png 1x 2x",
+        u"data:,\u20ac 1x",
+    ]
+
+    def test_columns(self):
+        columns = parse_columnar(self.strings)
+        self.assertIsInstance(columns, Columns)
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(columns.candidate_count, 5)
+        self.assertEqual(list(columns.row_offsets), [0, 2, 2, 4, 5])
+        self.assertEqual(list(columns.widths), [100, 200, 0, 0, 0])
+        self.assertEqual(list(columns.has_width), [1, 1, 0, 0, 0])
+        self.assertEqual(list(columns.heights), [0, 50, 0, 0, 0])
+        self.assertEqual(list(columns.has_height), [0, 1, 0, 0, 0])
+        self.assertEqual([d == d for d in columns.densities], [False, False, False, True, True])
+        self.assertEqual(list(columns.densities)[3:], [1.5, 1.0])
+
+    def test_urls(self):
+        columns = parse_columnar(self.strings)
+        self.assertEqual(columns.urls(0), ["a.png", "b.png"])
+        self.assertEqual(columns.urls(1), [])
+        self.assertEqual(columns.url(4), u"data:,\u20ac")
+        self.assertEqual(list(columns.url_offsets), [0, 5, 10, 15, 20, 29])
+        self.assertEqual(len(columns.url_buffer), 29)
+
+    def test_same_as_parse(self):
+        columns = parse_columnar(self.strings, compact=True)
+        for row, candidates in enumerate(parse_many(self.strings, compact=True)):
+            self.assertEqual(columns.urls(row), [candidate.url for candidate in candidates])
+
+    def test_saturated(self):
+        columns = parse_columnar(["a.png " + "9" * 40 + "w"])
+        maximum = 2 ** (8 * columns.widths.itemsize - 1) - 1
+        self.assertEqual(columns.widths[0], maximum)
+        # array("l") is 32-bit on Windows
+        for value in (2 ** 31, 2 ** 40, 10 ** 18 - 1):
+            columns = parse_columnar(["a.png %sw %sh" % (value, value)])
+            self.assertEqual((columns.widths[0], columns.heights[0]), (min(value, maximum),) * 2)
+
+    @unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+    def test_binary(self):
+        columns = parse_columnar([string.encode("utf-8") for string in self.strings])
+        self.assertEqual(columns.url(4), u"data:,\u20ac".encode("utf-8"))
+        self.assertEqual(list(columns.widths), list(parse_columnar(self.strings).widths))
+        views = [memoryview(bytearray(string.encode("utf-8"))) for string in self.strings]
+        for options in ({}, {"cache": ParseCache()}):
+            views_columns = parse_columnar(views, **options)
+            self.assertEqual(views_columns.url(4), u"data:,\u20ac".encode("utf-8"))
+            self.assertEqual(bytes(views_columns.url_buffer), bytes(columns.url_buffer))
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        columns = parse_columnar(self.strings)
+        arrays = columns.to_numpy()
+        self.assertEqual(arrays["widths"][arrays["has_width"]].tolist(), [100, 200])
+        self.assertEqual(arrays["densities"][3:].tolist(), [1.5, 1.0])
+        self.assertEqual(arrays["row_offsets"].tolist(), [0, 2, 2, 4, 5])
+        # Arrays share memory with the columns
+        arrays["widths"][0] = 7
+        self.assertEqual(columns.widths[0], 7)
+        self.assertEqual(bytes(arrays["url_buffer"][:5]), b"a.png")
+        self.assertRaises(BufferError, columns.append, "e.png", [(0, 5, None, None, None, None, None, None)])
+
+
+class TestParseCache(unittest.TestCase):
+    def test_hits(self):
+        cache = ParseCache()
+        string = "data:,a 1x, data:,b 2x"
+        first = SRCSet(string, cache=cache).parse()
+        second = SRCSet(string, cache=cache).parse()
+        self.assertEqual(first, SRCSet(string).parse())
+        self.assertEqual(second, first)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_mutation(self):
+        cache = ParseCache()
+        obj = SRCSet("data:,a 1x", cache=cache)
+        obj.parse()
+        obj.candidates[0]["url"] = "data:,b"
+        obj.candidates.append({"url": "data:,c", "w": None, "x": None, "h": None})
+        obj = SRCSet("data:,a 1x", cache=cache)
+        self.assertEqual(obj.parse(), [{"url": "data:,a", "w": None, "x": "1", "h": None}])
+
+    def test_modes(self):
+        cache = ParseCache()
+        SRCSet("data:,a 1x", cache=cache).parse()
+        candidates = SRCSet("data:,a 1x", cache=cache, compact=True).parse()
+        self.assertEqual(candidates, [Candidate("data:,a", None, "1", None)])
+        self.assertEqual(cache.hits, 1)
+
+    def test_max_entries(self):
+        cache = ParseCache(max_entries=2)
+        for string in ("data:,a", "data:,b", "data:,a", "data:,c"):
+            SRCSet(string, cache=cache).parse()
+        self.assertEqual(cache.evictions, 1)
+        # data:,b was the least recently used one
+        self.assertEqual([key[0] for key in cache.entries], ["data:,a", "data:,c"])
+
+    def test_max_bytes(self):
+        cache = ParseCache(max_entries=None, max_bytes=1)
+        SRCSet("data:,a 1x", cache=cache).parse()
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.stats()["bytes"], 0)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_clear(self):
+        cache = ParseCache()
+        parse_many(["data:,a", "data:,b", "data:,a"], cache=cache)
+        self.assertEqual(cache.stats(), {"entries": 2, "bytes": cache.size, "hits": 1, "misses": 2, "evictions": 0})
+        cache.clear()
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_limits(self):
+        cache = ParseCache()
+        SRCSet("data:,a 1x, data:,b 2x", cache=cache).parse()
+        obj = SRCSet("data:,a 1x, data:,b 2x", cache=cache, max_candidates=1)
+        self.assertRaises(LimitExceeded, obj.parse)
+
+
+@unittest.skipIf(ProcessPoolExecutor is None, "concurrent.futures is not available")
+class TestParseParallel(unittest.TestCase):
+    strings = ["data:,a 1x, data:,b 2x", "", "data:,c foo", "data:,d 100w"] * 10
+
+    def test_order(self):
+        self.assertEqual(
+            parse_parallel(self.strings, workers=2, chunk_size=3),
+            parse_many(self.strings)
+        )
+
+    def test_options(self):
+        self.assertEqual(
+            parse_parallel(self.strings, workers=2, chunk_size=7, compact=True, engine=ENGINE_REGEX),
+            parse_many(self.strings, compact=True)
+        )
+
+    def test_limits(self):
+        self.assertRaises(LimitExceeded, parse_parallel, self.strings, workers=2, max_candidates=1)
+        self.assertRaises(ValueError, parse_parallel, self.strings, cache=ParseCache())
+
+
+class TestWriteTo(unittest.TestCase):
+    string = "data:,a 1x, data:,b 100w 50h, data:,c"
+
+    def test_list(self):
+        obj = SRCSet(self.string)
+        obj.parse()
+        chunks = []
+        obj.write_to(chunks)
+        self.assertEqual(chunks, ["data:,a 1x", ", ", "data:,b 100w 50h", ", ", "data:,c"])
+        self.assertEqual("".join(chunks), obj.stringify())
+
+    def test_file(self):
+        obj = SRCSet(u"data:,a 1x, data:,b 100w 50h, data:,c", compact=True)
+        obj.parse()
+        output = io.StringIO()
+        obj.write_to(output)
+        self.assertEqual(output.getvalue(), obj.stringify())
+
+    def test_empty(self):
+        obj = SRCSet("")
+        obj.parse()
+        chunks = []
+        obj.write_to(chunks)
+        self.assertEqual(chunks, [])
+
+    def test_values(self):
+        # README example, numbers are assigned to parsed candidates
+        obj = SRCSet("/q_auto,f_auto/image.png?a 1w, image2.png")
+        obj.parse()
+        obj.candidates[1]["w"] = 2
+        self.assertEqual(obj.stringify(), "/q_auto,f_auto/image.png?a 1w, image2.png 2w")
+
+
+class TestRewriteURLs(unittest.TestCase):
+    def test_rewrite(self):
+        string = " /a.png  1x,/b.png,, /c.png 2x\t"
+        obj = SRCSet(string)
+        result = obj.rewrite_urls(lambda url: "/proxy" + url)
+        self.assertEqual(result, " /proxy/a.png  1x,/proxy/b.png,, /proxy/c.png 2x\t")
+        self.assertEqual(obj.candidates, None)
+
+    def test_partial(self):
+        string = "/a.png 1x, https://cdn/b,c.png 2x"
+        result = SRCSet(string).rewrite_urls(
+            lambda url: "/proxy/" + url if url.startswith("https:") else url
+        )
+        self.assertEqual(result, "/a.png 1x, /proxy/https://cdn/b,c.png 2x")
+
+    def test_invalid_candidates(self):
+        string = "/a.png foo, /b.png 1x"
+        result = SRCSet(string).rewrite_urls(lambda url: url.upper())
+        self.assertEqual(result, "/a.png foo, /B.PNG 1x")
+
+    def test_unchanged(self):
+        string = "/a.png 1x, /b.png 2x"
+        self.assertIs(SRCSet(string).rewrite_urls(lambda url: url), string)
+        self.assertIs(SRCSet(string, cache=ParseCache()).rewrite_urls(lambda url: url), string)
+
+    def test_cache(self):
+        cache = ParseCache()
+        SRCSet("/a.png 1x", cache=cache).parse()
+        result = SRCSet("/a.png 1x", cache=cache).rewrite_urls(lambda url: "/b.png")
+        self.assertEqual(result, "/b.png 1x")
+        self.assertEqual(cache.hits, 1)
+
+
+@unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+class TestBinary(unittest.TestCase):
+    strings = (
+        "  data:,a  1x  , data:c qw",
+        " /a.png,, 1x, /b.png 100w 5h, /c.png (x, y) 1x",
+        "/q_auto,f_auto/image.png?a 1w, image2.png",
+        "data:,a 1w 1h, data:,b foo, data:,c 0.5x",
+        # Non-ASCII digits and whitespaces
+        "a.png \u0661x, b.png \xa01x, c.png 2x",
+        "a.png \u0661\u0660w, \u20ac.png 10w \uff11h, c.png 10w",
+    )
+
+    def test_same_as_text(self):
+        for string in self.strings:
+            text = SRCSet(string)
+            text.parse()
+            for raw in (string.encode("utf-8"), bytearray(string.encode("utf-8"))):
+                obj = SRCSet(raw)
+                candidates = obj.parse()
+                self.assertEqual(
+                    [{key: value if value is None else bytes(value).decode("utf-8")
+                      for key, value in c.items()} for c in candidates],
+                    text.candidates
+                )
+                self.assertEqual(obj.stringify(), text.stringify().encode("utf-8"))
+
+    def test_memoryview(self):
+        raw = memoryview(b"/a.png 1x, /b.png 2x")
+        obj = SRCSet(raw, compact=True)
+        candidates = obj.parse()
+        self.assertIsInstance(candidates[0].url, memoryview)
+        self.assertEqual(candidates[0].url, b"/a.png")
+        self.assertEqual(candidates[1].x, b"2")
+        self.assertEqual(obj.stringify(), b"/a.png 1x, /b.png 2x")
+        chunks = []
+        obj.write_to(chunks)
+        self.assertEqual(b"".join(chunks), b"/a.png 1x, /b.png 2x")
+
+    def test_memoryview_spans(self):
+        candidates = SRCSet(memoryview(b"data:,a 1x, /b.png 2x"), spans=True).parse()
+        self.assertTrue(candidates[0].url_startswith(b"data:"))
+        self.assertFalse(candidates[1].url_startswith(b"data:"))
+        self.assertFalse(candidates[0].url_startswith(b"data:,a 1x"))
+        self.assertEqual(candidates[1].url, b"/b.png")
+
+    def test_cache(self):
+        cache = ParseCache()
+        for raw in (bytearray(b"/a.png 1x, /b.png 2x"), memoryview(bytearray(b"/a.png 1x, /b.png 2x"))):
+            obj = SRCSet(raw, cache=cache, compact=True)
+            self.assertEqual([bytes(candidate.url) for candidate in obj.parse()], [b"/a.png", b"/b.png"])
+            self.assertEqual(obj.rewrite_urls(lambda url: b"/p" + url), b"/p/a.png 1x, /p/b.png 2x")
+            self.assertEqual(len(parse_many([raw], cache=cache)[0]), 2)
+        self.assertEqual((cache.misses, len(cache.entries)), (1, 1))
+
+    def test_non_ascii(self):
+        string = "/\u00e4.png 1x, /\u00f6.png 2x"
+        obj = SRCSet(string.encode("utf-8"))
+        obj.parse()
+        self.assertEqual(obj.stringify(), string.encode("utf-8"))
+
+    def test_rewrite_urls(self):
+        raw = b"/a.png 1x,  /b.png 2x"
+        self.assertEqual(SRCSet(raw).rewrite_urls(lambda url: b"/proxy" + url), b"/proxy/a.png 1x,  /proxy/b.png 2x")
+        self.assertIs(SRCSet(raw).rewrite_urls(lambda url: url), raw)
+
+
+class TestScanner(unittest.TestCase):
+    html = (
+        '<!doctype html><html><head>'
+        '<link rel=preload as=image imagesrcset="/a.png 1x, /b.png 2x">'
+        '<!-- <img srcset="/comment.png 1x"> -->'
+        '<script>var s = \'<img srcset="/script.png 1x">\';</script>'
+        '<style>img[srcset] {}</style>'
+        '</head><body><p>srcset="/text.png"</p>'
+        '<IMG alt="a>b" SRCSET=\'/c.png?a=1&amp;b=2 100w,/d.png 200w\' data-srcset="/no.png 1x">'
+        '<img srcset=/e.png><img srcset><img alt=don\'t srcset="/f.png 3x">'
+        '<picture><source srcset="/g.webp" type="image/webp"></picture>'
+        '</body></html>'
     )
-    args = parser.parse_args()
-    if args.benchmark:
-        print(
-            "%.3fs (best of %s repeats for %s repetitions)" %
-            (
-                min(timeit.Timer(
-                    'benchmark()', setup="from __main__ import benchmark"
-                ).repeat(number=10000)),
-                REPEAT,
-                LOOP_SIZE,
+
+    def test_attributes(self):
+        attributes = list(scan(self.html, compact=True))
+        self.assertEqual(
+            [(a.name, self.html[a.start:a.end]) for a in attributes],
+            [
+                ("imagesrcset", "/a.png 1x, /b.png 2x"),
+                ("srcset", "/c.png?a=1&amp;b=2 100w,/d.png 200w"),
+                ("srcset", "/e.png"),
+                ("srcset", ""),
+                ("srcset", "/f.png 3x"),
+                ("srcset", "/g.webp"),
+            ]
+        )
+        self.assertEqual(attributes[1].candidates, [
+            Candidate("/c.png?a=1&b=2", "100", None, None),
+            Candidate("/d.png", "200", None, None),
+        ])
+        self.assertEqual(attributes[3].candidates, [])
+        self.assertEqual(attributes[4].candidates, [Candidate("/f.png", None, "3", None)])
+
+    def test_same_as_parser(self):
+        for attribute in scan(self.html):
+            value = self.html[attribute.start:attribute.end].replace("&amp;", "&")
+            self.assertEqual(attribute.candidates, SRCSet(value).parse())
+
+    def test_references(self):
+        # Legacy references without ";" are not decoded before alphanumerics and "="
+        html = '<img srcset="/a.jpg?x=1&region=us&copy=2&not=3 1x, /b.jpg?a&amp;b&lt;c&#233; 2x">'
+        self.assertEqual(
+            [candidate["url"] for candidate in list(scan(html))[0].candidates],
+            ["/a.jpg?x=1&region=us&copy=2&not=3", u"/b.jpg?a&b<c\u00e9"]
+        )
+
+    def test_abrupt_comments(self):
+        # "<!-->" and "<!--->" are complete, empty comments
+        for comment in ("<!-->", "<!--->"):
+            html = comment + '<img srcset="/a.png 1x"><!-- x -->'
+            self.assertEqual([a.candidates for a in scan(html)], [[{"url": "/a.png", "w": None, "x": "1", "h": None}]])
+
+    def test_raw_text(self):
+        html = '<textarea><img srcset="/a.png"></textarea><plaintext><img srcset="/b.png">'
+        self.assertEqual(list(scan(html)), [])
+        html = '<script><img srcset="/a.png">'
+        self.assertEqual(list(scan(html)), [])
+        html = '<title>x</TITLE ><img srcset="/a.png">'
+        self.assertEqual(len(list(scan(html))), 1)
+
+    def test_unclosed(self):
+        html = '<img srcset="/a.png 1x, /b.png'
+        self.assertEqual(list(scan(html)), [Attribute("srcset", 13, len(html), [
+            {"url": "/a.png", "w": None, "x": "1", "h": None},
+            {"url": "/b.png", "w": None, "x": None, "h": None},
+        ])])
+
+    def test_linear(self):
+        for html in ("<a " + "b= " * 100000, "<a b c= d=\"e\" f='g' /" * 100000):
+            start = time.time()
+            self.assertEqual(list(scan(html)), [])
+            self.assertLess(time.time() - start, STRESS_BUDGET)
+
+    @unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+    def test_binary(self):
+        html = self.html.encode("ascii")
+        text = list(scan(self.html))
+        binary = list(scan(html))
+        self.assertEqual([(a.start, a.end) for a in binary], [(a.start, a.end) for a in text])
+        self.assertEqual(binary[0].name, b"imagesrcset")
+        self.assertEqual(binary[1].candidates[0]["url"], b"/c.png?a=1&b=2")
+        html = '<img srcset="/&euro;.png 1x">'.encode("utf-8")
+        self.assertEqual(list(scan(html))[0].candidates[0]["url"], "/\u20ac.png".encode("utf-8"))
+
+
+class TestStreamRewriter(unittest.TestCase):
+    html = TestScanner.html + '<!-- <img srcset="/unclosed.png">'
+
+    @staticmethod
+    def callback(url):
+        return "//cdn/\"" + url if url != "/e.png" else url
+
+    def rewrite(self, chunks):
+        rewriter = StreamRewriter(self.callback)
+        return "".join(rewriter.feed(chunk) for chunk in chunks) + rewriter.close()
+
+    def test_rewrite(self):
+        html = self.rewrite([self.html])
+        self.assertIn('imagesrcset="//cdn/&quot;/a.png 1x, //cdn/&quot;/b.png 2x"', html)
+        self.assertIn("SRCSET='//cdn/\"/c.png?a=1&amp;b=2 100w,//cdn/\"/d.png 200w'", html)
+        self.assertIn('<img srcset=/e.png><img srcset>', html)
+        self.assertIn('data-srcset="/no.png 1x"', html)
+        self.assertIn('<!-- <img srcset="/comment.png 1x"> -->', html)
+        self.assertIn('\'<img srcset="/script.png 1x">\'', html)
+        self.assertTrue(html.endswith('<!-- <img srcset="/unclosed.png">'))
+
+    def test_unquoted(self):
+        self.assertEqual(self.rewrite(["<img srcset=/a.png>"]), '<img srcset="//cdn/&quot;/a.png">')
+
+    def test_references(self):
+        rewriter = StreamRewriter(lambda url: "/p/" + url)
+        html = rewriter.feed('<img srcset="a.jpg?x=1&region=us 1x, b.jpg?a&amp;b 2x">') + rewriter.close()
+        self.assertEqual(html, '<img srcset="/p/a.jpg?x=1&amp;region=us 1x, /p/b.jpg?a&amp;b 2x">')
+
+    def test_abrupt_comments(self):
+        for comment in ("<!-->", "<!--->"):
+            html = comment + "<img srcset=/a.png><!-- x -->"
+            expected = comment + '<img srcset="//cdn/&quot;/a.png"><!-- x -->'
+            for i in range(len(html)):
+                self.assertEqual(self.rewrite([html[:i], html[i:]]), expected)
+
+    def test_unchanged(self):
+        rewriter = StreamRewriter(lambda url: url)
+        self.assertEqual(rewriter.feed(self.html) + rewriter.close(), self.html)
+
+    def test_chunk_boundaries(self):
+        expected = self.rewrite([self.html])
+        for i in range(len(self.html)):
+            self.assertEqual(self.rewrite([self.html[:i], self.html[i:]]), expected)
+        self.assertEqual(self.rewrite(self.html), expected)
+
+    def test_output_is_immediate(self):
+        rewriter = StreamRewriter(self.callback)
+        self.assertEqual(rewriter.feed("<p>text</p><img srcset=/a.png"), "<p>text</p>")
+        self.assertEqual(rewriter.feed(" alt=x>"), '<img srcset="//cdn/&quot;/a.png" alt=x>')
+        self.assertEqual(rewriter.feed("<script>" + "x" * 100), "<script>" + "x" * 89)
+        self.assertEqual(rewriter.feed("</scr"), "x" * 5)
+        self.assertEqual(rewriter.feed("ipt><img srcset=/b.png>"), "x" * 6 + '</script><img srcset="//cdn/&quot;/b.png">')
+
+    def test_bounded_buffer(self):
+        rewriter = StreamRewriter(self.callback)
+        for chunk in ("<p>" + "text " * 1000, "<!--" + "comment " * 1000, "<script>" + "script " * 1000):
+            for _ in range(100):
+                rewriter.feed(chunk)
+                self.assertLess(len(rewriter.buffer), 100)
+            rewriter.feed("--></script>")
+
+    def test_linear(self):
+        # A long tag in small chunks is followed, not matched again with every chunk
+        for html in (
+            '<img srcset="/a.png" alt="' + "x>" * (STRESS_SIZE // 2) + '">',
+            "<img srcset=/a.png " + "b=c " * (STRESS_SIZE // 4) + ">",
+        ):
+            start = time.time()
+            rewriter = StreamRewriter(self.callback)
+            output = [rewriter.feed(html[i:i + 256]) for i in range(0, len(html), 256)]
+            output.append(rewriter.close())
+            self.assertLess(time.time() - start, STRESS_BUDGET)
+            self.assertTrue("".join(output).startswith('<img srcset="//cdn/&quot;/a.png"'))
+
+    @unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+    def test_binary(self):
+        html = self.html.encode("ascii")
+        rewriter = StreamRewriter(lambda url: b"//cdn/\"" + url if url != b"/e.png" else url)
+        output = b"".join(rewriter.feed(html[i:i + 7]) for i in range(0, len(html), 7)) + rewriter.close()
+        self.assertEqual(output, self.rewrite([self.html]).encode("ascii"))
+
+
+class AsyncChunks(object):
+    """
+    Async iterator of `chunks`
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        for chunk in self.chunks:
+            return asyncio.sleep(0, result=chunk)
+        raise StopAsyncIteration
+
+
+@unittest.skipIf(rewrite_stream is None, "asyncio is not available")
+class TestRewriteStream(unittest.TestCase):
+    html = TestStreamRewriter.html.encode("ascii")
+    callback = staticmethod(lambda url: b"//cdn" + url)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        rewriter = StreamRewriter(self.callback)
+        self.expected = rewriter.feed(self.html) + rewriter.close()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def collect(self, iterator):
+        output = []
+        while True:
+            try:
+                output.append(self.loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                return b"".join(output)
+
+    def test_stream_reader(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(self.html)
+        reader.feed_eof()
+        self.assertEqual(self.collect(rewrite_stream(reader, self.callback, slice_size=5)), self.expected)
+
+    def test_async_iterator(self):
+        chunks = [self.html[i:i + 3] for i in range(0, len(self.html), 3)]
+        self.assertEqual(self.collect(rewrite_stream(AsyncChunks(chunks), self.callback)), self.expected)
+
+    def test_yields_to_loop(self):
+        html = benchmark.sample_page(2 * 1024 * 1024).encode("ascii")
+        ticks = []
+
+        def tick():
+            ticks.append(None)
+            self.loop.call_soon(tick)
+
+        self.loop.call_soon(tick)
+        self.collect(rewrite_stream(AsyncChunks([html]), self.callback))
+        self.assertGreaterEqual(len(ticks), len(html) // SLICE_SIZE)
+
+    def test_executor(self):
+        threads = set()
+
+        def callback(url):
+            threads.add(threading.current_thread())
+            return self.callback(url)
+
+        chunks = [self.html[i:i + 3] for i in range(0, len(self.html), 3)]
+        with ThreadPoolExecutor(1) as executor:
+            output = self.collect(rewrite_stream(
+                AsyncChunks(chunks), callback, executor=executor, offload_size=60
+            ))
+        self.assertEqual(output, self.expected)
+        self.assertIn(threading.current_thread(), threads)
+        self.assertEqual(len(threads), 2)
+
+
+class TestSelector(unittest.TestCase):
+    def test_density(self):
+        selector = Selector("a.png, b.png 2x, c.png 1.5x, d.png 2x, e.png 3x")
+        self.assertEqual(selector.select(1), "a.png")
+        self.assertEqual(selector.select(1.2), "c.png")
+        self.assertEqual(selector.select(2), "b.png")
+        self.assertEqual(selector.select(2.5), "e.png")
+        self.assertEqual(selector.select(4), "e.png")
+        self.assertEqual(selector.select(0.5), "a.png")
+
+    def test_width(self):
+        selector = Selector("s.png 320w, l.png 1280w, m.png 640w, m2.png 640w")
+        self.assertEqual(selector.select(1, 320), "s.png")
+        self.assertEqual(selector.select(2, 320), "m.png")
+        self.assertEqual(selector.select(1, 400), "m.png")
+        self.assertEqual(selector.select(3, 1000), "l.png")
+        self.assertEqual(selector.select(1, 100), "s.png")
+        self.assertRaises(ValueError, selector.select, 1)
+        self.assertRaises(ValueError, selector.select, 1, 0)
+
+    def test_mixed(self):
+        selector = Selector("w.png 200w, x.png 2x, y.png 1x")
+        self.assertEqual(selector.select(1, 100), "y.png")
+        self.assertEqual(selector.select(2, 100), "w.png")
+        self.assertEqual(selector.select(1.5, 200), "x.png")
+        self.assertEqual(selector.select(3, 200), "x.png")
+
+    def test_src(self):
+        self.assertEqual(Selector("b.png 2x", src="a.png").select(1), "a.png")
+        self.assertEqual(Selector("b.png 1x", src="a.png").select(1), "b.png")
+        self.assertEqual(Selector("b.png 100w", src="a.png").select(1, 100), "b.png")
+        self.assertEqual(Selector("", src="a.png").select(3), "a.png")
+        self.assertIsNone(Selector("").select(1))
+
+    def test_normalize(self):
+        selector = Selector("a.png 2x, b.png 200w, c.png, d.png 100w")
+        self.assertEqual(selector.normalize(100), [("a.png", 2.0), ("c.png", 1.0)])
+        self.assertEqual(selector.normalize(50), [("a.png", 2.0), ("b.png", 4.0), ("c.png", 1.0)])
+
+    def test_same_as_scan(self):
+        srcset = ", ".join("%s.png %sx" % (i, i / 4.0) for i in range(1, 40, 3))
+        selector = Selector(srcset)
+        normalized = selector.normalize()
+        for density in (0.1, 0.25, 1, 2.5, 2.6, 9.75, 20):
+            bigger = [item for item in normalized if item[1] >= density]
+            expected = min(bigger, key=lambda item: item[1]) if bigger else max(normalized, key=lambda item: item[1])
+            self.assertEqual(selector.select(density), expected[0])
+
+    def test_srcset_instance(self):
+        obj = SRCSet("a.png 1x, b.png 2x", compact=True)
+        self.assertEqual(Selector(obj).select(2), "b.png")
+        self.assertEqual(Selector(obj.raw, spans=True).select(2), "b.png")
+
+
+class TestSelectMany(unittest.TestCase):
+    srcsets = [
+        "a.png, b.png 2x, c.png 1.5x, d.png 2x",
+        "",
+        "s.png 320w, l.png 1280w, m.png 640w, m2.png 640w",
+        "w.png 200w, x.png 2x, y.png 1x",
+        "bad.png 1x 2x",
+    ]
+    densities = [1, 2, 3, 1.5]
+    widths = [100, 320, 400, 200]
+    expected = [
+        [0, 1, 1, 2],
+        [-1, -1, -1, -1],
+        [0, 2, 1, 0],
+        [2, 1, 1, 1],
+        [-1, -1, -1, -1],
+    ]
+
+    def test_python(self):
+        self.assertEqual(
+            select_many(self.srcsets, self.densities, self.widths, vectorized=False), self.expected
+        )
+
+    def test_same_as_selector(self):
+        matrix = select_many(self.srcsets, self.densities, self.widths, vectorized=False)
+        for srcset, row in zip(self.srcsets, matrix):
+            candidates = SRCSet(srcset).parse()
+            for density, width, index in zip(self.densities, self.widths, row):
+                url = Selector(srcset).select(density, width)
+                self.assertEqual(candidates[index]["url"] if index != -1 else None, url)
+
+    def test_row_widths(self):
+        matrix = select_many(["s.png 320w, l.png 1280w"] * 2, [1, 2], [[320, 320], [1280, 1280]], vectorized=False)
+        self.assertEqual(matrix, [[0, 1], [1, 1]])
+
+    def test_missing_width(self):
+        self.assertRaises(ValueError, select_many, ["a.png 100w"], [1], vectorized=False)
+        self.assertRaises(ValueError, select_many, ["a.png 100w"], [1], [0], vectorized=False)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        matrix = select_many(self.srcsets, self.densities, self.widths)
+        self.assertIsInstance(matrix, numpy.ndarray)
+        self.assertEqual(matrix.tolist(), self.expected)
+        matrix = select_many(["s.png 320w, l.png 1280w"] * 2, [1, 2], numpy.array([[320, 320], [1280, 1280]]))
+        self.assertEqual(matrix.tolist(), [[0, 1], [1, 1]])
+        self.assertEqual(select_many([], [1, 2]).shape, (0, 2))
+        self.assertRaises(ValueError, select_many, ["a.png 100w"], [1])
+        self.assertRaises(ValueError, select_many, ["a.png 100w"], [1], [0])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy_same_as_python(self):
+        srcsets = [
+            ", ".join("%s.png %s" % (j, descriptor) for j, descriptor in enumerate(descriptors))
+            for descriptors in (
+                ("1x", "2x", "3x"), ("100w", "200w", "2x", ""), ("640w", "640w", "1x", "1x"),
+                ("320w",), ("3x", "1.5x", "1x"), ("1280w", "1920w", "320w", "0.5x"),
             )
+        ] * 10
+        densities = [1, 1.5, 2, 2.625, 3] * 4
+        widths = [320, 360, 375, 414, 768, 1024, 1280, 1440, 1920, 100] * 2
+        self.assertEqual(
+            select_many(srcsets, densities, widths).tolist(),
+            select_many(srcsets, densities, widths, vectorized=False)
         )
-    else:
-        unittest.main()
+
+    @unittest.skipIf(numpy is not None, "NumPy is installed")
+    def test_no_numpy(self):
+        self.assertIsInstance(select_many(self.srcsets, self.densities, self.widths), list)
+        self.assertRaises(ImportError, select_many, self.srcsets, self.densities, self.widths, vectorized=True)
+
+
+class TestSizes(unittest.TestCase):
+    phone = Viewport(375, 667, 2)
+    desktop = Viewport(1440, 900)
+
+    def assertSizes(self, string, phone, desktop):
+        self.assertEqual(evaluate_sizes(string, self.phone, SizesCache()), phone)
+        self.assertEqual(evaluate_sizes(string, self.desktop, SizesCache()), desktop)
+
+    def test_lengths(self):
+        self.assertSizes("100px", 100, 100)
+        self.assertSizes("50vw", 187.5, 720)
+        self.assertSizes("2em", 32, 32)
+        self.assertSizes("0", 0, 0)
+        self.assertSizes("10vmin", 37.5, 90)
+        self.assertSizes("1in", 96, 96)
+
+    def test_calc(self):
+        self.assertSizes("calc(50vw - 2 * 1em)", 155.5, 688)
+        self.assertSizes("calc((100vw - 40px) / 2)", 167.5, 700)
+        self.assertSizes("calc(10px - 100vw)", 0, 0)
+        self.assertSizes("calc(100vw -20px), 1px", 1, 1)
+        self.assertSizes("calc(10px * 2px), 1px", 1, 1)
+
+    def test_conditions(self):
+        self.assertSizes("(max-width: 600px) 100vw, 50vw", 375, 720)
+        self.assertSizes("(min-width: 1000px) 33vw, (min-width: 600px) 50vw, 100vw", 375, 475.2)
+        self.assertSizes("not (min-width: 500px) 20px, 30px", 20, 30)
+        self.assertSizes("(400px <= width <= 1000px) 1px, (orientation: landscape) 10em, 2px", 2, 160)
+        self.assertSizes("(width < 400px) 1px, 2px", 1, 2)
+        self.assertSizes("(min-width: 500px) and (max-resolution: 1.5dppx) 1px, 2px", 2, 1)
+        self.assertSizes("(min-width: 5000px) or (min-resolution: 2x) 1px, 2px", 1, 2)
+        self.assertSizes("(min-width: calc(30em + 1px)) 7px, 8px", 8, 7)
+        self.assertSizes("((min-width: 600px)) 1px, 2px", 2, 1)
+
+    def test_unknown(self):
+        self.assertSizes("(prefers-color-scheme: dark) 1px, 2px", 2, 2)
+        self.assertSizes("not (prefers-color-scheme: dark) 1px, 2px", 2, 2)
+        self.assertSizes("(foo: bar) or (min-width: 10px) 1px, 2px", 1, 1)
+        self.assertSizes("screen 1px, 2px", 2, 2)
+
+    def test_invalid_entries(self):
+        self.assertSizes("", 375, 1440)
+        self.assertSizes("bad, -1px, 10%, 5, (max-width: 600px) , 42px", 42, 42)
+        self.assertSizes("(max-width: 600px) 10px 20px, 30px", 30, 30)
+        self.assertSizes("(max-width: 600px) 10px,", 10, 1440)
+        self.assertSizes("(max-width: 600px 10px", 375, 1440)
+
+    def test_parsed(self):
+        self.assertEqual(parse_sizes("(MAX-WIDTH: 600PX) 100VW, 50vw"), (
+            (("feature", "width", (("<=", ("length", (600.0, "px"))),)), (100.0, "vw")),
+            (None, (50.0, "vw")),
+        ))
+        self.assertEqual(parse_sizes(b"10px"), parse_sizes("10px"))
+
+    def test_memoized(self):
+        cache = SizesCache()
+        string = "(max-width: 600px) 100vw, 50vw"
+        self.assertEqual(cache.evaluate(string, self.phone), 375)
+        self.assertEqual(cache.evaluate(string, self.desktop), 720)
+        self.assertEqual(len(cache.parsed), 1)
+        self.assertEqual(len(cache.conditions), 2)
+        cache.evaluate("(max-width: 600px) 50vw, 10px", self.phone)
+        self.assertEqual(len(cache.conditions), 2)
+        self.assertEqual(len(cache.widths), 3)
+        cache.clear()
+        self.assertEqual(len(cache.widths), 0)
+
+    def test_bounded(self):
+        cache = SizesCache(max_entries=10)
+        for i in range(100):
+            cache.evaluate("%spx" % i, self.phone)
+        self.assertLessEqual(len(cache.parsed), 10)
+        self.assertLessEqual(len(cache.widths), 10)
+
+
+class TestMedia(unittest.TestCase):
+    def assertMatches(self, string, expected, viewport=TestSizes.phone):
+        self.assertEqual(SizesCache().matches_media(string, viewport), expected)
+
+    def test_media_types(self):
+        self.assertMatches("", True)
+        self.assertMatches("all", True)
+        self.assertMatches("screen", True)
+        self.assertMatches("print", False)
+        self.assertMatches("not print", True)
+        self.assertMatches("only screen and (max-width: 600px)", True)
+        self.assertMatches("not screen and (max-width: 600px)", False)
+        self.assertMatches("screen and (min-width: 600px)", True, TestSizes.desktop)
+
+    def test_lists(self):
+        self.assertMatches("print, (max-width: 400px)", True)
+        self.assertMatches("print, (min-width: 400px)", False)
+        self.assertMatches("(min-resolution: 2dppx), (min-resolution: 192dpi)", True)
+        self.assertMatches("not (min-width: 600px)", True)
+
+    def test_invalid(self):
+        self.assertEqual(parse_media("screen and"), ((True, "all", None),))
+        self.assertMatches("screen and", False)
+        self.assertMatches("screen and (a) or (b)", False)
+        self.assertMatches("foo bar", False)
+        self.assertMatches(",", False)
+        self.assertMatches("foo bar, screen", True)
+
+
+class TestResolver(unittest.TestCase):
+    phone = Device(Viewport(375, 667, 2), types=("image/jpeg", "image/webp"))
+    desktop = Device(Viewport(1440, 900))
+    picture = Picture([
+        Source("art.avif 1x, art-2x.avif 2x", media="(min-width: 1000px)", type="image/avif"),
+        Source("art.jpg 1x, art-2x.jpg 2x", media="(min-width: 1000px)"),
+        Source(None, type="image/webp"),
+        Source("", type="image/webp"),
+        Source("s.webp 320w, m.webp 640w, l.webp 1280w", sizes="(max-width: 600px) 100vw, 50vw",
+               type="image/webp; codecs=x"),
+        Source("s.jpg 320w, m.jpg 640w, l.jpg 1280w", sizes="50vw"),
+    ], src="fallback.jpg")
+
+    def test_resolve(self):
+        resolver = Resolver()
+        self.assertEqual(resolver.resolve(self.picture, self.desktop), "art.avif")
+        self.assertEqual(resolver.resolve(self.picture, self.phone), "l.webp")
+        old = Device(Viewport(1440, 900, 2), types=("image/jpeg",))
+        self.assertEqual(resolver.resolve(self.picture, old), "art-2x.jpg")
+        old = Device(Viewport(300, 900), types=("image/jpeg",))
+        self.assertEqual(resolver.resolve(self.picture, old), "s.jpg")
+
+    def test_img(self):
+        resolver = Resolver()
+        self.assertEqual(resolver.resolve(Picture([Source(None)], "a.png"), self.phone), "a.png")
+        self.assertEqual(resolver.resolve(Picture([Source("b.png 2x")], "a.png"), self.phone), "b.png")
+        self.assertEqual(resolver.resolve(Picture([Source("b.png 100w")]), TestSizes.phone), "b.png")
+        self.assertEqual(resolver.resolve(Picture([Source(None)]), self.phone), None)
+        self.assertEqual(resolver.resolve(Picture([Source("a.png 100w, b.png 10w", sizes="0")]), self.phone), "a.png")
+
+    def test_resolve_many(self):
+        resolver = Resolver()
+        img = Picture([Source("a.png 1x, b.png 2x")])
+        self.assertEqual(resolver.resolve_many([self.picture, img, self.picture], [self.phone, self.desktop]), [
+            ["l.webp", "art.avif"],
+            ["b.png", "a.png"],
+            ["l.webp", "art.avif"],
+        ])
+        self.assertEqual(len(resolver.selectors), 5)
+
+    def test_bounded(self):
+        resolver = Resolver(max_entries=10)
+        for i in range(100):
+            resolver.resolve(Picture([Source("%s.png" % i)]), self.phone)
+        self.assertLessEqual(len(resolver.selectors), 10)
+
+
+class TestStress(unittest.TestCase):
+    """
+    Every input is parsed in linear time, a quadratic step would not fit into
+    STRESS_BUDGET seconds
+    """
+    def assertParsedInTime(self, string, expected_length):
+        start = time.time()
+        candidates = SRCSet(string).parse()
+        self.assertLess(time.time() - start, STRESS_BUDGET)
+        self.assertEqual(len(candidates), expected_length)
+
+    def test_trailing_commas(self):
+        self.assertParsedInTime("data:,a" + "," * STRESS_SIZE, 1)
+
+    def test_long_url(self):
+        self.assertParsedInTime("data:,a" * (STRESS_SIZE // 7), 1)
+
+    def test_long_descriptor(self):
+        self.assertParsedInTime("data:,a " + "1" * STRESS_SIZE + "w", 1)
+
+    def test_unclosed_parens(self):
+        self.assertParsedInTime("data:,a (" + "1" * STRESS_SIZE, 0)
+
+    def test_whitespaces(self):
+        self.assertParsedInTime("data:,a" + " " * STRESS_SIZE + "1x", 1)
+
+    def test_many_descriptors(self):
+        self.assertParsedInTime("data:,a " + "1x " * (STRESS_SIZE // 3), 0)
+
+    def test_many_candidates(self):
+        self.assertParsedInTime("data:,a 1x," * (STRESS_SIZE // 11), STRESS_SIZE // 11)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_corpus(self):
+        corpus = dict(benchmark.build_corpus())
+        self.assertEqual(
+            sorted(corpus),
+            ["data_urls", "malformed", "parens", "single_url", "w_candidates", "x_candidates"]
+        )
+        counts = [len(SRCSet(string).parse()) for string in corpus["w_candidates"]]
+        self.assertEqual((min(counts), max(counts)), (5, 20))
+        self.assertEqual(dict(benchmark.build_corpus()), corpus)
+
+    def test_run(self):
+        for engine in (ENGINE_STATE_MACHINE, ENGINE_REGEX):
+            results = benchmark.run(engine, repeat=2, number=1, groups=["single_url", "malformed"])
+            self.assertEqual(sorted(results["groups"]), ["malformed", "single_url"])
+            self.assertEqual(results["repeat"], 2)
+            timings = results["groups"]["malformed"]
+            self.assertTrue(0 < timings["parse"]["best_us"] <= timings["parse"]["median_us"])
+            self.assertEqual(json.loads(json.dumps(results)), results)
+            output = io.StringIO()
+            benchmark.compare(results, results, output)
+            self.assertIn("1.00", output.getvalue())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([benchmark.percentile(values, p) for p in (50, 90, 99, 100)], [50, 90, 99, 100])
+        self.assertEqual(benchmark.percentile([7], 99), 7)
+        self.assertEqual(
+            [benchmark.bucket_label(value, (0, 1, 4)) for value in (0, 1, 3, 5)],
+            ["0", "1", "2-4", "5+"]
+        )
+
+    def test_latency(self):
+        corpus = [("short", ["a.png 1x"]), ("long", ["a.png 1x, " * 40, "b.png 2x, " * 40, "c.png " * 50])]
+        results = benchmark.latency(ENGINE_STATE_MACHINE, repeat=1, number=1, corpus=corpus)
+        self.assertEqual(results["inputs"], 4)
+        self.assertEqual(sorted(results["by_candidates"]), ["0", "1", "20+"])
+        self.assertEqual(results["by_length"]["0-16"]["inputs"], 1)
+        stats = results["by_length"]["257-1024"]["parse_us"]
+        self.assertTrue(stats["p50"] <= stats["p90"] <= stats["p99"] <= stats["max"])
+        self.assertEqual(json.loads(json.dumps(results)), results)
+        # Every long input costs more than 0 times the median, none 1000 times more
+        flagged = benchmark.latency(ENGINE_STATE_MACHINE, repeat=1, number=1, factor=0, corpus=corpus)
+        self.assertEqual(sorted(sample["group"] for sample in flagged["outliers"]), ["long"] * 3)
+        flagged = benchmark.latency(ENGINE_STATE_MACHINE, repeat=1, number=1, factor=1000, corpus=corpus)
+        self.assertEqual(flagged["outliers"], [])
+        output = io.StringIO()
+        benchmark.report_latency(results, output)
+        self.assertIn("20+", output.getvalue())
+
+    def test_speedup(self):
+        corpus = benchmark.cdn_corpus()
+        self.assertEqual(sorted(dict(corpus)), ["cloudinary", "imgix"])
+        for _, inputs in corpus:
+            self.assertEqual([len(SRCSet(string).parse()) for string in inputs], [8] * len(inputs))
+        results = benchmark.speedup(repeat=1, number=1, corpus=[("w", ["a.png 100w, b.png 200w"])])
+        values = results["groups"]["w"]
+        self.assertAlmostEqual(values["speedup"], values["state_machine_us"] / values["regex_us"])
+        self.assertEqual(json.loads(json.dumps(results)), results)
+        self.assertEqual(benchmark.check_speedup(results, 0), [])
+        self.assertEqual(benchmark.check_speedup(results, float("inf")), [("w", values["speedup"])])
+        output = io.StringIO()
+        benchmark.report_speedup(dict(results, min_speedup=float("inf")), output)
+        self.assertIn("Too slow", output.getvalue())
+
+    def test_batch(self):
+        corpus = [("w", ["a.png 100w, b.png 200w", "c.png"])]
+        results = benchmark.batch(ENGINE_REGEX, repeat=1, number=1, corpus=corpus)
+        self.assertEqual(sorted(results["methods"]), ["parse", "parse_many", "parse_many_instances"])
+        self.assertTrue(results["methods"]["parse_many"]["srcsets_per_s"] > 0)
+        self.assertEqual(json.loads(json.dumps(results)), results)
+        output = io.StringIO()
+        benchmark.report_throughput(results, "methods", output)
+        self.assertIn("parse_many_instances", output.getvalue())
+
+    @unittest.skipIf(ProcessPoolExecutor is None, "concurrent.futures is not available")
+    def test_parallel(self):
+        results = benchmark.parallel(ENGINE_REGEX, max_workers=2, corpus=[("x", ["a.png 1x"])], size=10)
+        self.assertEqual(results["inputs"], 10)
+        self.assertEqual(sorted(results["workers"]), ["1", "2"])
+        output = io.StringIO()
+        benchmark.report_throughput(results, "workers", output)
+        self.assertEqual(len(output.getvalue().splitlines()), 3)
+
+    def test_scanner(self):
+        page = benchmark.sample_page(5000)
+        self.assertTrue(5000 <= len(page) < 7000)
+        self.assertEqual(benchmark.html_parser(page, ENGINE_REGEX), [a.candidates for a in scan(page)])
+        results = benchmark.scanner(ENGINE_REGEX, repeat=1, sizes=(1024,))
+        self.assertEqual(sorted(results["pages"]["1024"]), ["html_parser", "scan"])
+        output = io.StringIO()
+        benchmark.report_scanner(results, output)
+        self.assertIn("html_parser", output.getvalue())
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seed(self):
+        self.assertEqual(list(corpus.iter_corpus(50, seed=1)), list(corpus.iter_corpus(50, seed=1)))
+        self.assertNotEqual(list(corpus.iter_corpus(50, seed=1)), list(corpus.iter_corpus(50, seed=2)))
+
+    def test_candidates(self):
+        for seed in range(300):
+            string, count = corpus.make_srcset(random.Random(seed), invalid=seed % 2 == 0)
+            self.assertEqual(len(SRCSet(string).parse()), count, string)
+
+    def test_invalid_share(self):
+        rng = random.Random(1)
+        invalid = 0
+        for string in corpus.iter_corpus(1000, seed=1, invalid_share=0.2):
+            is_invalid = rng.random() < 0.2
+            self.assertEqual(corpus.make_srcset(rng, is_invalid)[0], string)
+            invalid = invalid + is_invalid
+        self.assertTrue(150 < invalid < 250, invalid)
+
+    def test_files(self):
+        strings = list(corpus.iter_corpus(100, seed=1)) + [u"data:,\u20ac 1x"]
+        for name in ("corpus.txt", "corpus.txt.gz"):
+            path = os.path.join(self.directory, name)
+            self.assertEqual(corpus.write_corpus(path, iter(strings)), 101)
+            self.assertEqual(list(corpus.read_corpus(path)), strings)
+            self.assertEqual(list(corpus.read_corpus(path, limit=3)), strings[:3])
+            self.assertEqual(list(corpus.read_corpus(path, binary=True))[-1], u"data:,\u20ac 1x".encode("utf-8"))
+        self.assertEqual(len(parse_many(corpus.read_corpus(path))), 101)
+        self.assertRaises(ValueError, corpus.write_corpus, path, ["a.png 1x\nb.png 2x"])
+
+
+@unittest.skipIf(
+    not hasattr(benchmark.tracemalloc, "reset_peak") or sys.implementation.name != "cpython",
+    "Budgets are for tracemalloc of CPython 3.9 or later"
+)
+class TestMemoryBudgets(unittest.TestCase):
+    def test_budgets(self):
+        # Instances of a class share the keys of their dicts until attributes
+        # are set in another order, so other tests would change the results
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "memory.json")
+        for engine in (ENGINE_STATE_MACHINE, ENGINE_REGEX):
+            subprocess.check_output(
+                [sys.executable, benchmark.__file__, "--memory", "--engine", engine, "--output", path]
+            )
+            with open(path) as output:
+                results = json.load(output)
+            self.assertEqual(sorted(results), ["compact", "dict"])
+            self.assertEqual(benchmark.check_budgets(results), [])
+            self.assertLess(results["compact"]["candidate_bytes"], results["dict"]["candidate_bytes"])
+
+    def test_over_budget(self):
+        corpus = [("w", [", ".join(["a.png 100w, b.png 200w"] * 20)])]
+        results = benchmark.memory(ENGINE_STATE_MACHINE, corpus, modes=(("dict", {}),))
+        self.assertEqual(results["dict"]["candidates"], 40)
+        self.assertGreater(results["dict"]["container_bytes"], 0)
+        exceeded = benchmark.check_budgets(results, {"dict": {"candidate_blocks": 1, "candidate_bytes": 1000}})
+        self.assertEqual([item[:2] for item in exceeded], [("dict", "candidate_blocks")])
+        output = io.StringIO()
+        benchmark.report_memory(results, output)
+        self.assertIn("candidate_bytes", output.getvalue())
+
+    def test_retained(self):
+        benchmark.tracemalloc.start()
+        try:
+            result, (size, blocks) = benchmark.retained(lambda: [bytearray(1000) for _ in range(10)])
+        finally:
+            benchmark.tracemalloc.stop()
+        # 10 objects, 10 buffers and the list
+        self.assertGreaterEqual(blocks, 21)
+        self.assertTrue(10000 < size < 12000, size)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def instrument(self):
+        instrumentation = Instrumentation()
+        self.addCleanup(instrumentation.disable)
+        return instrumentation
+
+    def test_counters(self):
+        instrumentation = self.instrument()
+        string = "a.png 100w, b.png 1x 2x, c.png -1x, d.png 50h, e.png foo, f.png 2x 100h, g.png 1.5w, h.png"
+        with instrumentation:
+            obj = SRCSet(string)
+            self.assertEqual(len(obj.parse()), 2)
+            obj.stringify()
+            obj.write_to([])
+        stats = instrumentation.stats()
+        self.assertEqual(stats["inputs"], 1)
+        self.assertEqual(stats["bytes"], len(string))
+        self.assertEqual(stats["candidates"], 2)
+        self.assertEqual(stats["stringified"], 2)
+        self.assertEqual(stats["rejected"], {
+            "conflicting_descriptors": 2,
+            "invalid_density": 1,
+            "height_without_width": 1,
+            "unknown_descriptor": 1,
+            "invalid_width": 1,
+        })
+        self.assertEqual(sorted(stats["time"]), ["descriptors", "parse", "stringify", "tokenize", "validate"])
+        self.assertTrue(stats["time"]["parse"] > 0)
+        self.assertTrue(stats["time"]["tokenize"] > 0)
+        self.assertTrue(stats["time"]["parse"] >= stats["time"]["tokenize"] + stats["time"]["validate"])
+        self.assertEqual(json.loads(json.dumps(stats)), stats)
+
+    def test_batch(self):
+        instrumentation = self.instrument()
+        with instrumentation:
+            parse_many(["a.png 1x", "b.png 0w"] * 5, compact=True)
+            parse_columnar(["a.png 1x, b.png 100w"])
+        stats = instrumentation.stats()
+        self.assertEqual((stats["inputs"], stats["candidates"]), (11, 7))
+        self.assertEqual(stats["rejected"], {"invalid_width": 5})
+        instrumentation.reset()
+        self.assertEqual(instrumentation.stats()["inputs"], 0)
+
+    def test_limits(self):
+        instrumentation = self.instrument()
+        with instrumentation:
+            self.assertRaises(LimitExceeded, SRCSet("a.png, b.png", max_candidates=1).parse)
+            # Inputs over max_length are rejected before the engines
+            self.assertRaises(LimitExceeded, SRCSet("a.png 1x", max_length=5).parse)
+            self.assertRaises(LimitExceeded, SRCSet("a.png 1x", max_length=5, cache=ParseCache()).parse)
+            self.assertRaises(LimitExceeded, parse_many, ["a.png 1x"], max_length=5)
+            self.assertRaises(LimitExceeded, parse_columnar, ["a.png 1x"], max_length=5)
+        stats = instrumentation.stats()
+        self.assertEqual((stats["inputs"], stats["bytes"], stats["limit_exceeded"]), (5, 44, 5))
+
+    @unittest.skipIf(str is bytes, "bytes are parsed as str on Python 2")
+    def test_binary(self):
+        instrumentation = self.instrument()
+        with instrumentation:
+            obj = SRCSet(b"a.png 1x, b.png 1y")
+            obj.parse()
+            self.assertEqual(obj.stringify(), b"a.png 1x")
+        self.assertEqual(instrumentation.stats()["rejected"], {"unknown_descriptor": 1})
+
+    def test_memo(self):
+        # Descriptors known to the memo of the regex engine are validated and counted
+        SRCSet("a.png 1y, b.png 2x").parse()
+        instrumentation = self.instrument()
+        with instrumentation:
+            self.assertEqual(len(SRCSet("a.png 1y, b.png 2x").parse()), 1)
+        self.assertEqual(instrumentation.stats()["rejected"], {"unknown_descriptor": 1})
+
+    def test_disable(self):
+        instrumentation = self.instrument()
+        engines = dict(srcset.ENGINES)
+        parsers = dict(srcset.PARSERS)
+        stringify = SRCSet.stringify
+        with instrumentation:
+            self.assertNotEqual(srcset.ENGINES, engines)
+            self.assertRaises(RuntimeError, Instrumentation().enable)
+        # The original functions are back, nothing is counted
+        self.assertEqual(srcset.ENGINES, engines)
+        self.assertEqual(srcset.PARSERS, parsers)
+        self.assertEqual(SRCSet.stringify, stringify)
+        SRCSet("a.png 1x").parse()
+        self.assertEqual(instrumentation.stats()["inputs"], 0)
+        self.assertIsNone(Instrumentation.active)
+
+
+class RegexEngineMixin(object):
+    """
+    Runs all the test cases of a class with `ENGINE_REGEX`
+    """
+    def setUp(self):
+        SRCSet.engine = ENGINE_REGEX
+
+    def tearDown(self):
+        SRCSet.engine = ENGINE_STATE_MACHINE
+
+
+class TestLoopRegex(RegexEngineMixin, TestLoop):
+    pass
+
+
+class TestTokenizerRegex(RegexEngineMixin, TestTokenizer):
+    pass
+
+
+class TestDescriptorRegex(RegexEngineMixin, TestDescriptor):
+    pass
+
+
+class TestSpecificRegex(RegexEngineMixin, TestSpecific):
+    pass
+
+
+class TestLimitsRegex(RegexEngineMixin, TestLimits):
+    pass
+
+
+class TestStressRegex(RegexEngineMixin, TestStress):
+    pass
+
+
+class TestCompactRegex(RegexEngineMixin, TestCompact):
+    pass
+
+
+class TestTypedRegex(RegexEngineMixin, TestTyped):
+    pass
+
+
+class TestSpansRegex(RegexEngineMixin, TestSpans):
+    pass
+
+
+class TestIterCandidatesRegex(RegexEngineMixin, TestIterCandidates):
+    pass
+
+
+class TestColumnarRegex(RegexEngineMixin, TestColumnar):
+    pass
+
+
+class TestInstrumentationRegex(RegexEngineMixin, TestInstrumentation):
+    pass
+
+
+class TestParseCacheRegex(RegexEngineMixin, TestParseCache):
+    pass
+
+
+class TestWriteToRegex(RegexEngineMixin, TestWriteTo):
+    pass
+
+
+class TestRewriteURLsRegex(RegexEngineMixin, TestRewriteURLs):
+    pass
+
+
+class TestBinaryRegex(RegexEngineMixin, TestBinary):
+    pass
+
+
+class TestStreamRewriterRegex(RegexEngineMixin, TestStreamRewriter):
+    pass
+
+
+class TestSelectorRegex(RegexEngineMixin, TestSelector):
+    pass
+
+
+class TestSelectManyRegex(RegexEngineMixin, TestSelectMany):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()